@@ -23,11 +23,11 @@ from langflow.schema.message import Message
 from langflow.base.prompts.api_utils import process_prompt_template
 from langflow.template.utils import update_template_values
 
-# Prefer the installed pdl package; when inlined, globals() already define render/PDL.
+# Prefer the installed pdl package; when inlined, globals() already define render_async/PDL.
 try:  # pragma: no cover - defensive import for Langflow runtime
-    from pdl import render, PDL  # type: ignore
+    from pdl import render_async, PDL  # type: ignore
 except Exception:  # pragma: no cover - fallback for inlined build artifact
-    render = globals().get("render")
+    render_async = globals().get("render_async")
     PDL = globals().get("PDL")
 
 
@@ -142,7 +142,8 @@ class PromptComponent(Component):
         header = getattr(self, "X_HeaderLevel", "#")
         drop = getattr(self, "Y_DropFirstHeader", False)
 
-        result = render(
+        # Render off the event loop so other flows on this worker keep running.
+        result = await render_async(
             template_text,
             json_root,
             {
@@ -1,5 +1,5 @@
 """Python PDL entrypoint – mirrors the JS surface."""
 
-from .pdl import PDL, PDLParser, PostFormat, RenderStats, render
+from .pdl import PDL, TEMPLATE_CACHE, CompiledTemplate, PDLParser, PostFormat, RenderStats, TemplateCache, compile, render, render_async, render_iter, render_many, render_to
 
-__all__ = ["render", "PDL", "PDLParser", "PostFormat", "RenderStats"]
+__all__ = ["render", "render_async", "render_iter", "render_to", "render_many", "compile", "CompiledTemplate", "TemplateCache", "TEMPLATE_CACHE", "PDL", "PDLParser", "PostFormat", "RenderStats"]
@@ -7,13 +7,25 @@ version for cross-language fixtures and docs.
 
 from __future__ import annotations
 
+import asyncio
+import builtins
+import io
 import json
 import math
+import operator
+import os
 import re
+import sys
+import threading
+import types
 import unicodedata
-from dataclasses import dataclass
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from functools import lru_cache
+from itertools import islice
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, FrozenSet, Generator, Iterable, Iterator, List, Optional, Tuple
 from zoneinfo import ZoneInfo
 
 
@@ -53,6 +65,18 @@ class PDL:
     HL_BEFORE = ""
     HL_AFTER = ""
 
+    # The parse, date and template cache sizes are read once, when the module
+    # is imported; resize the template cache later with
+    # `TEMPLATE_CACHE.configure`. VARIANT_BYTES is read on every insert.
+    CACHE_SIZE = 256
+    CACHE_BYTES = 32 * 1024 * 1024
+    PARSE_CACHE_SIZE = 4096
+    DATE_CACHE_SIZE = 4096
+    VARIANT_BYTES = 8 * 1024 * 1024
+    INDEX_MIN_ITEMS = 32
+    BATCH_MIN_ITEMS = 32
+    BATCH_NUMPY = True  # vectorize duration columns with NumPy when it is installed
+
 
 VAR_NAME_RE = re.compile(r"^[A-Za-z0-9_]+$")
 
@@ -89,13 +113,8 @@ def to_bool(s: Any) -> Optional[bool]:
     return None
 
 
-def markdown_escape(s: Any) -> Any:
-    if not isinstance(s, str):
-        return s
-    out = s.replace("\\", "\\\\")
-    for ch in ("*", "_", "`", "~", "[", "]", "(", ")", "#", "+", "-", "!", ">", "|"):
-        out = out.replace(ch, "\\" + ch)
-    return out
+# Backslash first, then each markdown metacharacter, gets a backslash in front.
+MARKDOWN_ESCAPES = str.maketrans({ch: "\\" + ch for ch in "\\*_`~[]()#+-!>|"})
 
 
 NUMERIC_RE = re.compile(r"^[-+]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?$")
@@ -181,47 +200,80 @@ def pad(num: int, length: int = 2) -> str:
     return s.zfill(length)
 
 
-def render_tokens(fmt: str, comp: Dict[str, int], mode: str) -> str:
-    out = ""
-    s = str(fmt or "")
+# (component, width, modulo) per format token; `%y` is the year modulo 100.
+FORMAT_TOKENS: Dict[str, Tuple[str, int, Optional[int]]] = {
+    "Y": ("Y", 4, None),
+    "y": ("Y", 2, 100),
+    "m": ("m", 2, None),
+    "d": ("d", 2, None),
+    "H": ("H", 2, None),
+    "M": ("M", 2, None),
+    "S": ("S", 2, None),
+    "L": ("L", 3, None),
+}
+
+
+@lru_cache(maxsize=PDL.PARSE_CACHE_SIZE)
+def compile_format(fmt: str) -> Tuple[Any, ...]:
+    """A `%`-format as literal strings and `(component, width, modulo)` tokens."""
+    parts: List[Any] = []
+    lit = ""
+    s = fmt
     i = 0
     while i < len(s):
         ch = s[i]
         if ch != "%":
-            out += ch
+            lit += ch
             i += 1
             continue
         if i + 1 >= len(s):
-            out += "%"
+            lit += "%"
             i += 1
             continue
         t = s[i + 1]
-        if t == "%":
-            out += "%"
-            i += 2
-            continue
-        mapper = {
-            "Y": lambda: pad(comp.get("Y", 0), 4),
-            "y": lambda: pad(comp.get("Y", 0) % 100, 2),
-            "m": lambda: pad(comp.get("m", 0), 2),
-            "d": lambda: pad(comp.get("d", 0), 2),
-            "H": lambda: pad(comp.get("H", 0), 2),
-            "M": lambda: pad(comp.get("M", 0), 2),
-            "S": lambda: pad(comp.get("S", 0), 2),
-            "L": lambda: pad(comp.get("L", 0), 3),
-        }
-        out += mapper.get(t, lambda: "%" + t)()
+        token = FORMAT_TOKENS.get(t)
+        if token is None:
+            lit += "%" if t == "%" else "%" + t
+        else:
+            if lit:
+                parts.append(lit)
+                lit = ""
+            parts.append(token)
         i += 2
-    return out
+    if lit:
+        parts.append(lit)
+    return tuple(parts)
+
+
+def render_tokens(fmt: str, comp: Dict[str, int], mode: str) -> str:
+    out = []
+    for part in compile_format(str(fmt or "")):
+        if type(part) is str:
+            out.append(part)
+            continue
+        key, width, mod = part
+        num = comp.get(key, 0)
+        if mod is not None:
+            num %= mod
+        out.append(pad(num, width))
+    return "".join(out)
+
+
+@lru_cache(maxsize=64)
+def get_zone(tz: str) -> ZoneInfo:
+    return ZoneInfo(tz)
 
 
 def tz_offset_ms(utc_ms: float, tz: str) -> int:
     dt_utc = datetime.fromtimestamp(utc_ms / 1000.0, tz=timezone.utc)
-    tz_dt = dt_utc.astimezone(ZoneInfo(tz))
+    tz_dt = dt_utc.astimezone(get_zone(tz))
     offset = tz_dt.utcoffset() or timezone.utc.utcoffset(dt_utc)
     return int(offset.total_seconds() * 1000) if offset else 0
 
 
+DATE_HAS_TZ_RE = re.compile(r"[zZ]|([+-]\d{2}:?\d{2})$")
+
+
 def parse_date_input(raw: Any) -> Tuple[Optional[int], bool]:
     if raw is None:
         return None, False
@@ -231,17 +283,31 @@ def parse_date_input(raw: Any) -> Tuple[Optional[int], bool]:
             return ms, False
         except Exception:
             return None, True
+    if type(raw) is str:
+        return parse_date_text(raw, PDL.DATE_TZ)
+
+    num = coerce_number(raw)
+    if num is not None:
+        ms = num * 1000 if num < 1e12 else num
+        return int(ms), False
+    return _parse_date_string(str(raw).strip(), PDL.DATE_TZ)
+
 
+@lru_cache(maxsize=PDL.DATE_CACHE_SIZE)
+def parse_date_text(raw: str, tz: str) -> Tuple[Optional[int], bool]:
+    """`parse_date_input` for text; naive times are read in `tz`."""
     num = coerce_number(raw)
     if num is not None:
         ms = num * 1000 if num < 1e12 else num
         return int(ms), False
+    return _parse_date_string(raw.strip(), tz)
 
-    s = str(raw).strip()
+
+def _parse_date_string(s: str, tz: str) -> Tuple[Optional[int], bool]:
     if not s:
         return None, True
 
-    has_tz = bool(re.search(r"[zZ]|([+-]\d{2}:?\d{2})$", s))
+    has_tz = bool(DATE_HAS_TZ_RE.search(s))
     try:
         if has_tz:
             iso = s.replace("Z", "+00:00") if s.endswith("Z") else s
@@ -254,7 +320,7 @@ def parse_date_input(raw: Any) -> Tuple[Optional[int], bool]:
             iso = s
             dt = datetime.fromisoformat(iso)
             if dt.tzinfo is None:
-                dt = dt.replace(tzinfo=ZoneInfo(PDL.DATE_TZ))
+                dt = dt.replace(tzinfo=get_zone(tz))
             ms = int(dt.timestamp() * 1000)
             return ms, False
     except Exception:
@@ -266,14 +332,14 @@ def parse_date_input(raw: Any) -> Tuple[Optional[int], bool]:
         if base_utc.tzinfo is None:
             base_utc = base_utc.replace(tzinfo=timezone.utc)
         ms = int(base_utc.timestamp() * 1000)
-        offset = tz_offset_ms(ms, PDL.DATE_TZ)
+        offset = tz_offset_ms(ms, tz)
         return ms - offset, False
     except Exception:
         return None, True
 
 
 def components_from_date_ms(ms: int, tz: str) -> Dict[str, int]:
-    dt = datetime.fromtimestamp(ms / 1000.0, tz=ZoneInfo(tz))
+    dt = datetime.fromtimestamp(ms / 1000.0, tz=get_zone(tz))
     return {
         "Y": dt.year,
         "y": dt.year % 100,
@@ -319,24 +385,20 @@ def is_pure_token_format(fmt: str) -> bool:
     return all(re.fullmatch(r"%[YymdHMSL]", p) for p in parts)
 
 
-def apply_case_basic(s: str, upper: bool = False, lower: bool = False, title: bool = False) -> str:
-    if title:
-        try:
-            return re.sub(r"\w\S*", lambda m: m.group(0)[0].upper() + m.group(0)[1:].lower(), s)
-        except Exception:
-            return s
-    if upper:
-        return s.upper()
-    if lower:
-        return s.lower()
-    return s
+TITLE_WORD_RE = re.compile(r"\w\S*")
+NON_WORD_RE = re.compile(r"[^\w]+")
+CAMEL_HUMP_RE = re.compile(r"([a-z0-9])([A-Z])")
+
+
+def title_case(s: str) -> str:
+    return TITLE_WORD_RE.sub(lambda m: m.group(0)[0].upper() + m.group(0)[1:].lower(), s)
 
 
 def to_words(s: str) -> List[str]:
     x = str(s or "")
-    x = re.sub(r"[^\w]+", " ", x)
-    x = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", x)
-    return [w for w in x.strip().split() if w]
+    x = NON_WORD_RE.sub(" ", x)
+    x = CAMEL_HUMP_RE.sub(r"\1 \2", x)
+    return x.split()
 
 
 def camel_case(s: str, upper: bool) -> str:
@@ -457,6 +519,36 @@ def parse_kv_flags(raw: str, *, first_positional: Optional[str] = None, types: O
     return data
 
 
+class Flags:
+    """Parsed directive parameters; immutable, shared by every directive with the same text."""
+
+    __slots__ = ("extra",)
+    FIELDS: Dict[str, str] = {}
+
+    def __init__(self, data: Dict[str, Any]) -> None:
+        fields = self.FIELDS
+        for key, attr in fields.items():
+            object.__setattr__(self, attr, data.get(key))
+        object.__setattr__(self, "extra", types.MappingProxyType({k: v for k, v in data.items() if k not in fields}))
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def get(self, key: str, default: Any = None) -> Any:
+        attr = self.FIELDS.get(key)
+        if attr is not None:
+            return getattr(self, attr)
+        return self.extra.get(key, default)
+
+    def __repr__(self) -> str:
+        items = {key: getattr(self, attr) for key, attr in self.FIELDS.items()}
+        items.update(self.extra)
+        return f"{type(self).__name__}({items!r})"
+
+
 def format_index(indices: List[int], dots: bool) -> str:
     if not indices:
         return "0"
@@ -471,20 +563,25 @@ def exists_for_success(value: Any) -> bool:
     return True
 
 
-def apply_replace(s: str, spec: str) -> str:
+SED_SPEC_RE = re.compile(r"^s/((?:\\.|[^/])*)/((?:\\.|[^/])*)/([gimsGIMS]*)$")
+
+
+def _unchanged(s: str) -> str:
+    return s
+
+
+@lru_cache(maxsize=PDL.PARSE_CACHE_SIZE)
+def compile_replace(spec: str) -> Callable[[str], str]:
+    """A `replace=` spec as a function: `s/pattern/repl/flags`, or `old:new;…` pairs where the first pair found applies."""
     if not spec:
-        return s
+        return _unchanged
     if spec.startswith("s/"):
-        m = re.match(r"^s/((?:\\.|[^/])*)/((?:\\.|[^/])*)/([gimsGIMS]*)$", spec)
+        m = SED_SPEC_RE.match(spec)
         if not m:
-            return s
+            return _unchanged
         pat_raw = m.group(1).replace("\\/", "/")
         repl_raw = m.group(2).replace("\\/", "/")
-        flags_raw = m.group(3) or ""
-        flag_set = set()
-        for ch in flags_raw.lower():
-            if ch in {"i", "m", "s", "g"}:
-                flag_set.add(ch)
+        flag_set = set(ch for ch in (m.group(3) or "").lower() if ch in {"i", "m", "s", "g"})
         flags = 0
         if "i" in flag_set:
             flags |= re.IGNORECASE
@@ -494,19 +591,27 @@ def apply_replace(s: str, spec: str) -> str:
             flags |= re.DOTALL
         try:
             pattern = re.compile(pat_raw, flags)
-            if "g" in flag_set:
-                return pattern.sub(repl_raw, s)
-            return pattern.sub(repl_raw, s, count=1)
         except Exception:
-            return s
+            return _unchanged
+        count = 0 if "g" in flag_set else 1
 
-    for part in [p for p in spec.split(";") if p != ""]:
-        if ":" not in part:
-            continue
-        old_val, new_val = part.split(":", 1)
-        if old_val in s:
-            return s.replace(old_val, new_val)
-    return s
+        def sed(s: str) -> str:
+            try:
+                return pattern.sub(repl_raw, s, count=count)
+            except Exception:
+                return s
+
+        return sed
+
+    pairs = [tuple(part.split(":", 1)) for part in spec.split(";") if part != "" and ":" in part]
+
+    def swap(s: str) -> str:
+        for old_val, new_val in pairs:
+            if old_val in s:
+                return s.replace(old_val, new_val)
+        return s
+
+    return swap
 
 
 def to_render_text(value: Any, stringify_flag: bool) -> Optional[str]:
@@ -563,22 +668,39 @@ def wrap_highlight(text: str, highlight: dict, hl_flag: bool = True) -> str:
     return f"{before}{text}{after}"
 
 
+class HighlightHeuristics:
+    """The link and attribute rewrites of `apply_highlight_heuristics` for one marker pair."""
+
+    __slots__ = ("link_re", "attr_re", "repl", "line_local")
+
+    def __init__(self, before: str, after: str) -> None:
+        b_esc = escape_regexp(before)
+        a_esc = escape_regexp(after)
+        self.link_re = re.compile(rf"(\\!?\\[[^\\]]*\\]\\()\\s*{b_esc}(.*?){a_esc}\\s*(\\))")
+        self.attr_re = re.compile(rf"([A-Za-z_:][-A-Za-z0-9_:.]*\\s*=\\s*\"?){b_esc}(.*?){a_esc}(\"?)")
+        self.repl = rf"{before}\1\2\3{after}"
+        self.link_re.sub(self.repl, "")  # a bad escape in a marker fails here, as it would on any text
+        # Neither pattern matches a line break outside the markers, so without
+        # one in a marker the rewrites can run on any run of whole lines.
+        self.line_local = "\n" not in before and "\n" not in after
+
+    def apply(self, text: str) -> str:
+        if "\\" not in text:
+            return text  # both patterns need a literal backslash
+        return self.attr_re.sub(self.repl, self.link_re.sub(self.repl, text))
+
+
+@lru_cache(maxsize=64)
+def highlight_heuristics(before: str, after: str) -> HighlightHeuristics:
+    return HighlightHeuristics(before, after)
+
+
 def apply_highlight_heuristics(text: str, highlight: dict) -> str:
     if not highlight or not highlight.get("enabled"):
         return text
     before = str(highlight.get("before") or "")
     after = str(highlight.get("after") or "")
-    b_esc = escape_regexp(before)
-    a_esc = escape_regexp(after)
-    out = str(text)
-
-    link_re = re.compile(rf"(\\!?\\[[^\\]]*\\]\\()\\s*{b_esc}(.*?){a_esc}\\s*(\\))")
-    out = link_re.sub(rf"{before}\1\2\3{after}", out)
-
-    attr_re = re.compile(rf"([A-Za-z_:][-A-Za-z0-9_:.]*\\s*=\\s*\"?){b_esc}(.*?){a_esc}(\"?)")
-    out = attr_re.sub(rf"{before}\1\2\3{after}", out)
-
-    return out
+    return highlight_heuristics(before, after).apply(str(text))
 
 
 def apply_string_variables(template: str, vars: Dict[str, Any] | None = None, highlight: Dict[str, Any] | None = None) -> str:
@@ -616,6 +738,8 @@ def apply_string_variables(template: str, vars: Dict[str, Any] | None = None, hi
 
 
 class RenderStats:
+    __slots__ = ("loops", "conds_true", "conds_false", "errors_parse", "errors_inline", "expansions", "halted", "index_builds", "index_hits")
+
     def __init__(self) -> None:
         self.loops = 0
         self.conds_true = 0
@@ -624,6 +748,8 @@ class RenderStats:
         self.errors_inline = 0
         self.expansions = 0
         self.halted = False
+        self.index_builds = 0
+        self.index_hits = 0
 
     def summary(self) -> str:
         parts = [f"Expanded {self.loops} loop(s)", f"{self.conds_true + self.conds_false} condition(s)"]
@@ -636,42 +762,134 @@ class RenderStats:
         return "; ".join(parts)
 
 
-@dataclass
 class VarBinding:
-    value: Any
-    const: bool = True
-    humble: bool = False
+    __slots__ = ("value", "const", "humble")
+
+    def __init__(self, value: Any, const: bool = True, humble: bool = False) -> None:
+        self.value = value
+        self.const = const
+        self.humble = humble
+
+    def __repr__(self) -> str:
+        return f"VarBinding(value={self.value!r}, const={self.const!r}, humble={self.humble!r})"
+
+
+class Aliases:
+    """A loop alias linked to the aliases of the enclosing scope; the nearest binding wins."""
+
+    __slots__ = ("name", "value", "parent")
+
+    def __init__(self, name: str, value: Any, parent: "Aliases | Dict[str, Any]") -> None:
+        self.name = name
+        self.value = value
+        self.parent = parent
+
+    def __contains__(self, key: object) -> bool:
+        node: Any = self
+        while type(node) is Aliases:
+            if node.name == key:
+                return True
+            node = node.parent
+        return key in node
+
+    def __getitem__(self, key: str) -> Any:
+        node: Any = self
+        while type(node) is Aliases:
+            if node.name == key:
+                return node.value
+            node = node.parent
+        return node[key]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        node: Any = self
+        while type(node) is Aliases:
+            if node.name == key:
+                return node.value
+            node = node.parent
+        return node.get(key, default)
 
 
 class Scope:
-    def __init__(self, *, root: Any, aliases: Dict[str, Any] | None = None, index_chain: List[int] | None = None, dots: bool = True, var_frames: List[Dict[str, VarBinding]] | None = None, highlight: Dict[str, Any] | None = None):
+    """Render scope: loop aliases, loop indexes, `[set:]` frames and memoized paths, linked to the parent scope."""
+
+    __slots__ = ("root", "aliases", "parent", "loop_index", "_index_chain", "dots", "frame", "global_frame", "depth", "highlight", "memo", "versions", "batch", "row")
+
+    def __init__(self, *, root: Any, aliases: Dict[str, Any] | None = None, index_chain: List[int] | None = None, dots: bool = True, highlight: Dict[str, Any] | None = None):
         self.root = root
-        self.aliases = aliases or {}
-        self.index_chain = index_chain or []
+        self.aliases: Any = aliases or {}
+        self.parent: Optional[Scope] = None
+        self.loop_index: Optional[int] = None
+        self._index_chain: Optional[List[int]] = list(index_chain or [])
         self.dots = dots
-        self.var_frames: List[Dict[str, VarBinding]] = var_frames or [dict()]
+        self.frame: Optional[Dict[str, VarBinding]] = {}
+        self.global_frame: Dict[str, VarBinding] = self.frame
+        self.depth = 0
         self.highlight = highlight or {}
+        self.memo: Optional[Dict[Tuple[Any, bool], Tuple[int, Any]]] = None
+        self.versions: Dict[str, int] = {}
+        self.batch: Optional[ColumnBatch] = None
+        self.row = 0
+
+    def child(self, *, alias: Optional[str] = None, item: Any = None, index: Optional[int] = None, dots: Optional[bool] = None) -> "Scope":
+        """A nested scope, optionally binding a loop alias and appending a loop index."""
+        child = Scope.__new__(Scope)
+        child.root = self.root
+        child.aliases = Aliases(alias, item, self.aliases) if alias else self.aliases
+        child.parent = self
+        child.loop_index = index
+        child._index_chain = None
+        child.dots = self.dots if dots is None else dots
+        child.frame = None
+        child.global_frame = self.global_frame
+        child.depth = self.depth + 1
+        child.highlight = self.highlight
+        child.memo = None
+        child.versions = self.versions
+        child.batch = None if alias else self.batch
+        child.row = self.row
+        return child
+
+    @property
+    def index_chain(self) -> List[int]:
+        chain = self._index_chain
+        if chain is None:
+            chain = self.parent.index_chain
+            if self.loop_index is not None:
+                chain = [*chain, self.loop_index]
+            self._index_chain = chain
+        return chain
 
     def get_var_binding(self, name: str) -> Tuple[Optional[VarBinding], Optional[int]]:
         if not VAR_NAME_RE.match(str(name or "")):
             return None, None
-        for idx in range(len(self.var_frames) - 1, -1, -1):
-            frame = self.var_frames[idx]
-            if name in frame:
-                return frame[name], idx
+        node: Optional[Scope] = self
+        while node is not None:
+            frame = node.frame
+            if frame and name in frame:
+                return frame[name], node.depth
+            node = node.parent
         return None, None
 
     def get_var_value(self, name: str) -> Any:
         vb, _ = self.get_var_binding(name)
         return vb.value if vb else None
 
+    def target_binding(self, name: str, scope_local: bool) -> Optional[VarBinding]:
+        """The binding `[set:]` would update: in this scope's own frame, or the global one."""
+        frame = self.frame if scope_local else self.global_frame
+        return frame.get(name) if frame else None
+
+    def touch_var(self, name: str) -> None:
+        """Invalidate memoized paths that read variable `name`."""
+        self.versions[name] = self.versions.get(name, 0) + 1
+
     def set_var(self, name: str, value: Any, *, scope_local: bool = False, const_flag: Optional[bool] = None, humble_flag: Optional[bool] = None, allow_value_update_if_const_flip: bool = False) -> None:
         if not VAR_NAME_RE.match(str(name or "")):
             return
+        self.touch_var(name)
 
-        target_idx = (len(self.var_frames) - 1) if (scope_local and self.var_frames) else 0
-        target_frame = self.var_frames[target_idx]
-        binding = target_frame.get(name)
+        target_frame = self.frame if scope_local else self.global_frame
+        binding = target_frame.get(name) if target_frame else None
 
         if value is None:
             if binding:
@@ -679,6 +897,8 @@ class Scope:
             return
 
         if not binding:
+            if target_frame is None:
+                target_frame = self.frame = {}
             target_frame[name] = VarBinding(
                 value,
                 const=True if const_flag is None else bool(const_flag),
@@ -703,111 +923,519 @@ class Scope:
 # ================================================================
 
 
+NUMERIC_TESTS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+TEXT_TESTS = {"^=": str.startswith, "$=": str.endswith, "*=": lambda left, right: right in left}
+
+
+def _as_number(x: Any) -> Optional[float]:
+    t = type(x)
+    if t is int:
+        return x
+    if t is float:
+        return x if math.isfinite(x) else None
+    return coerce_number(x)
+
+
+def _as_text(s: str) -> str:
+    return s.strip() if s.isascii() else normalize_str(s)
+
+
+def _never(left: Any) -> bool:
+    return False
+
+
+def compile_comparator(op: str, right: Any, ci: bool) -> Callable[[Any], bool]:
+    """Return `left -> bool` for `left <op> right`, with `right` coerced once."""
+    rnum = coerce_number(right)
+    r = normalize_str(right)
+    r_text = isinstance(r, str)
+    if r_text and ci:
+        r = r.lower()
+
+    if op in NUMERIC_TESTS:
+        # Strings never order; only a numeric pair can satisfy these.
+        if rnum is None:
+            return _never
+        num_test = NUMERIC_TESTS[op]
+
+        def numeric(left: Any) -> bool:
+            n = _as_number(left)
+            return n is not None and num_test(n, rnum)
+
+        return numeric
+
+    if op in TEXT_TESTS:
+        if not r_text:
+            return _never
+        text_test = TEXT_TESTS[op]
+
+        def textual(left: Any) -> bool:
+            if not isinstance(left, str):
+                return False
+            t = _as_text(left)
+            return text_test(t.lower() if ci else t, r)
+
+        return textual
+
+    if op not in ("=", "!="):
+        return _never
+    eq = op == "="
+
+    def equality(left: Any) -> bool:
+        if rnum is not None:
+            n = _as_number(left)
+            if n is not None:
+                return (n == rnum) == eq
+        if isinstance(left, str):
+            t = _as_text(left)
+            if ci and r_text:
+                t = t.lower()
+            return (t == r) == eq
+        try:
+            return (left == r) == eq
+        except Exception:
+            return False
+
+    return equality
+
+
+def compile_clauses(clauses: List[List[Tuple[str, str, Any]]], ci: bool) -> List[List[Tuple[str, Callable[[Any], bool]]]]:
+    return [[(key, compile_comparator(op, value, ci)) for key, op, value in ands] for ands in clauses]
+
+
+def compile_item_predicate(clauses: List[List[Tuple[str, str, Any]]], ci: bool) -> Callable[[Any], bool]:
+    """Return `item -> bool` matching any OR-clause whose AND-conditions all hold on the item's keys."""
+    compiled = [[(tuple(key.split(".")) if key else (), test) for key, test in ands] for ands in compile_clauses(clauses, ci)]
+
+    if len(compiled) == 1 and len(compiled[0]) == 1 and len(compiled[0][0][0]) == 1:
+        (((key,), test),) = compiled[0]
+
+        def single(item: Any) -> bool:
+            return test(item.get(key) if isinstance(item, dict) else None)
+
+        return single
+
+    def predicate(item: Any) -> bool:
+        for ands in compiled:
+            for parts, test in ands:
+                cur = item
+                for part in parts:
+                    if isinstance(cur, dict) and part in cur:
+                        cur = cur[part]
+                    else:
+                        cur = None
+                        break
+                if not test(cur):
+                    break
+            else:
+                return True
+        return False
+
+    return predicate
+
+
+SEL_FIRST = 0
+SEL_INDEX = 1
+SEL_PREDICATE = 2
+
+
+class Selector:
+    """A bracket selector applied to a list: first item, index, or predicate."""
+
+    __slots__ = ("kind", "index", "ci", "clauses", "predicates", "equality", "bounds")
+
+    def __init__(self, sel: str) -> None:
+        s = str(sel or "").strip()
+        self.index = 0
+        self.ci = False
+        self.clauses: List[List[Tuple[str, str, Any]]] = []
+        self.predicates: List[Optional[Callable[[Any], bool]]] = [None, None]
+        self.equality: Optional[Tuple[str, Any]] = None
+        self.bounds: Optional[Tuple[str, str, float]] = None
+        if s == "":
+            self.kind = SEL_FIRST
+        elif re.fullmatch(r"\d+", s):
+            self.kind = SEL_INDEX
+            self.index = int(s)
+        else:
+            self.kind = SEL_PREDICATE
+            core, self.ci = PathResolver._extract_ci(s)
+            self.clauses = PathResolver._parse_predicate(core)
+            if len(self.clauses) == 1 and len(self.clauses[0]) == 1:
+                key, op, value = self.clauses[0][0]
+                if op == "=":
+                    self.equality = (key, value)
+                elif op in NUMERIC_TESTS and coerce_number(value) is not None:
+                    self.bounds = (key, op, coerce_number(value))
+
+    @classmethod
+    def equal_to(cls, key: str, right: Any) -> "Selector":
+        """The selector `key=right` for an already parsed right-hand side."""
+        sel = cls("")
+        sel.kind = SEL_PREDICATE
+        sel.clauses = [[(key, "=", right)]]
+        sel.equality = (key, right)
+        return sel
+
+    def predicate(self, ci: bool) -> Callable[[Any], bool]:
+        ci = bool(ci or self.ci)
+        test = self.predicates[ci]
+        if test is None:
+            test = self.predicates[ci] = compile_item_predicate(self.clauses, ci)
+        return test
+
+
+class EqualityIndex:
+    """Positions of an array's items bucketed like the equality comparator, for `[key=value]` lookups."""
+
+    __slots__ = ("items", "size", "ci", "numbers", "texts", "numeric_texts", "nulls")
+
+    def __init__(self, items: List[Any], key: str, ci: bool) -> None:
+        self.items = items
+        self.size = len(items)
+        self.ci = ci
+        self.numbers: Dict[Any, List[int]] = {}
+        self.texts: Dict[str, List[int]] = {}
+        self.numeric_texts: Dict[str, List[int]] = {}
+        self.nulls: List[int] = []
+        parts = tuple(key.split(".")) if key else ()
+        for i, item in enumerate(items):
+            left = item
+            for part in parts:
+                if isinstance(left, dict) and part in left:
+                    left = left[part]
+                else:
+                    left = None
+                    break
+            n = _as_number(left)
+            if isinstance(left, str):
+                t = _as_text(left)
+                if ci:
+                    t = t.lower()
+                (self.texts if n is None else self.numeric_texts).setdefault(t, []).append(i)
+            if n is not None:
+                self.numbers.setdefault(n, []).append(i)
+            elif left is None:
+                self.nulls.append(i)
+
+    def lookup(self, right: Any) -> List[int]:
+        rnum = coerce_number(right)
+        r = normalize_str(right)
+        if isinstance(r, str):
+            if self.ci:
+                r = r.lower()
+            if rnum is None:
+                return self.text_hits(r)
+            return sorted(self.numbers.get(rnum, []) + self.texts.get(r, []))
+        if rnum is not None:
+            return self.numbers.get(rnum, [])
+        return self.nulls if r is None else []
+
+    def text_hits(self, text: str) -> List[int]:
+        """Positions whose value is a string equal to the normalized `text` (lowercased under ci)."""
+        return sorted(self.texts.get(text, []) + self.numeric_texts.get(text, []))
+
+
+class RangeIndex:
+    """An array's numeric values at `key`, sorted, for `[key<n]`-style lookups."""
+
+    __slots__ = ("items", "size", "keys", "positions", "head_first", "tail_first")
+
+    def __init__(self, items: List[Any], key: str) -> None:
+        self.items = items
+        self.size = len(items)
+        parts = tuple(key.split(".")) if key else ()
+        pairs = []
+        for i, item in enumerate(items):
+            left = item
+            for part in parts:
+                if isinstance(left, dict) and part in left:
+                    left = left[part]
+                else:
+                    left = None
+                    break
+            n = _as_number(left)
+            if n is not None:
+                pairs.append((n, i))
+        pairs.sort()
+        self.keys = [n for n, _ in pairs]
+        self.positions = [i for _, i in pairs]
+        # head_first[j] / tail_first[j]: earliest position among the j smallest / from the j-th value on.
+        size = self.size
+        self.head_first = [size] * (len(pairs) + 1)
+        self.tail_first = [size] * (len(pairs) + 1)
+        for j, i in enumerate(self.positions):
+            self.head_first[j + 1] = min(self.head_first[j], i)
+        for j in range(len(pairs) - 1, -1, -1):
+            self.tail_first[j] = min(self.tail_first[j + 1], self.positions[j])
+
+    def _span(self, op: str, bound: float) -> Tuple[bool, int]:
+        """Whether the matches are a head (`<`, `<=`) or a tail of the sorted values, and where it ends/starts."""
+        if op == "<":
+            return True, bisect_left(self.keys, bound)
+        if op == "<=":
+            return True, bisect_right(self.keys, bound)
+        if op == ">":
+            return False, bisect_right(self.keys, bound)
+        return False, bisect_left(self.keys, bound)
+
+    def lookup(self, op: str, bound: float) -> List[int]:
+        """Positions whose value satisfies `value <op> bound`, in array order."""
+        head, j = self._span(op, bound)
+        return sorted(self.positions[:j] if head else self.positions[j:])
+
+    def first(self, op: str, bound: float) -> Optional[int]:
+        """The earliest position satisfying `value <op> bound`, or None."""
+        head, j = self._span(op, bound)
+        i = self.head_first[j] if head else self.tail_first[j]
+        return i if i < self.size else None
+
+
+class PathStep:
+    """One `name[sel]` segment; `key` is the selector read as a dict key."""
+
+    __slots__ = ("name", "sel", "key", "selector")
+
+    def __init__(self, name_raw: str, sel: Optional[str]) -> None:
+        self.name = name_raw.replace('"', "")
+        self.sel = sel
+        self.key: Optional[str] = None
+        self.selector: Optional[Selector] = None
+        if sel is not None:
+            quoted = PathResolver._parse_bracket_key(sel)
+            self.key = quoted if quoted is not None else str(sel).strip()
+            self.selector = compile_selector(sel)
+
+
+class PathExpr:
+    """A path string classified once into the forms the resolver tries in turn."""
+
+    __slots__ = ("empty", "name", "dotted_key", "dotted_rest", "head", "rest", "steps", "var")
+
+    NAME_RE = re.compile(r"^([A-Za-z_]\w*)$")
+    DOTTED_RE = re.compile(r'^("?[A-Za-z_]\w*"?)\.(.+)$')
+    FIRST_SEGMENT_RE = re.compile(r"^(?P<name>[A-Za-z_]\w*|\"(?:\\.|[^\"])+\")(?:\[(?P<sel>[^\]]*)\])?(?:\.(?P<rest>.*))?$")
+
+    def __init__(self, path: str) -> None:
+        p = path.strip()
+        self.empty = not p
+        self.name: Optional[str] = None
+        self.dotted_key: Optional[str] = None
+        self.dotted_rest: Tuple[PathStep, ...] = ()
+        self.head: Optional[PathStep] = None
+        self.rest: Optional[Tuple[PathStep, ...]] = None
+        self.steps = compile_steps(p)
+        self.var: Optional[str] = None
+        m0 = self.NAME_RE.match(p)
+        if m0:
+            self.name = self.var = m0.group(1)
+            return
+        mdot = self.DOTTED_RE.match(p)
+        if mdot:
+            self.dotted_key = self.var = mdot.group(1).replace('"', "")
+            self.dotted_rest = compile_steps(mdot.group(2))
+        mfirst = self.FIRST_SEGMENT_RE.match(p)
+        if mfirst:
+            self.head = PathStep(mfirst.group("name"), mfirst.group("sel"))
+            rest = mfirst.group("rest")
+            self.rest = compile_steps(rest) if rest else None
+            if self.var is None:
+                self.var = self.head.name
+
+    def bind(self, template_sel: str, sel: str, selector: Selector) -> "PathExpr":
+        """A copy whose steps with selector text `template_sel` use `sel`/`selector` instead."""
+
+        def swap(step: PathStep) -> PathStep:
+            if step.sel != template_sel:
+                return step
+            out = PathStep(step.name, None)
+            out.sel = sel
+            out.key = sel.strip()
+            out.selector = selector
+            return out
+
+        out = PathExpr.__new__(PathExpr)
+        out.empty = self.empty
+        out.name = self.name
+        out.dotted_key = self.dotted_key
+        out.dotted_rest = tuple(swap(step) for step in self.dotted_rest)
+        out.head = swap(self.head) if self.head is not None else None
+        out.rest = tuple(swap(step) for step in self.rest) if self.rest is not None else None
+        out.steps = tuple(swap(step) for step in self.steps)
+        out.var = self.var
+        return out
+
+
+SEGMENT_RE = re.compile(r"(?P<name>[A-Za-z_]\w*|\"(?:\\.|[^\"])+\")(?:\[(?P<sel>[^\]]*)\])?(?:\.|$)")
+
+
+@lru_cache(maxsize=PDL.PARSE_CACHE_SIZE)
+def compile_selector(sel: str) -> Selector:
+    return Selector(sel)
+
+
+@lru_cache(maxsize=PDL.PARSE_CACHE_SIZE)
+def compile_steps(path: str) -> Tuple[PathStep, ...]:
+    return tuple(PathStep(m.group("name"), m.group("sel")) for m in SEGMENT_RE.finditer(path.strip()))
+
+
+@lru_cache(maxsize=PDL.PARSE_CACHE_SIZE)
+def compile_path(path: str) -> PathExpr:
+    return PathExpr(path)
+
+
+class Condition:
+    """A parsed `[if: ...]` condition; comparators are compiled per ci mode on first use."""
+
+    __slots__ = ("chopped", "ci", "clauses", "compiled")
+
+    GET_KEY_RE = re.compile(r"^\[get:([A-Za-z0-9_]+)(?:[^\]]*)\]$")
+
+    def __init__(self, cond_expr: str) -> None:
+        self.chopped, self.ci = PathResolver._extract_ci(cond_expr)
+        self.clauses = PathResolver._parse_predicate(self.chopped)
+        self.compiled: List[Optional[List[List[Tuple[str, Optional[str], Callable[[Any], bool]]]]]] = [None, None]
+
+    def tests(self, ci: bool) -> List[List[Tuple[str, Optional[str], Callable[[Any], bool]]]]:
+        """AND-lists of `(key, get-variable or None, comparator)` for each OR-clause."""
+        ci = bool(ci)
+        out = self.compiled[ci]
+        if out is None:
+            out = []
+            for ands in compile_clauses(self.clauses, ci):
+                row = []
+                for key, test in ands:
+                    k = str(key or "").strip()
+                    m = self.GET_KEY_RE.match(k)
+                    row.append((k, m.group(1) if m else None, test))
+                out.append(row)
+            self.compiled[ci] = out
+        return out
+
+
+@lru_cache(maxsize=PDL.PARSE_CACHE_SIZE)
+def compile_condition(cond_expr: str) -> Condition:
+    return Condition(cond_expr)
+
+
 class PathResolver:
-    def __init__(self) -> None:
-        self.SEGMENT_RE = re.compile(r"(?P<name>[A-Za-z_]\w*|\"(?:\\.|[^\"])+\")(?:\[(?P<sel>[^\]]*)\])?(?:\.|$)")
-        self.FIRST_SEGMENT_RE = re.compile(r"^(?P<name>[A-Za-z_]\w*|\"(?:\\.|[^\"])+\")(?:\[(?P<sel>[^\]]*)\])?(?:\.(?P<rest>.*))?$")
+    __slots__ = ("stats", "indexes", "scope_aliases")
+
+    SEGMENT_RE = SEGMENT_RE
+    FIRST_SEGMENT_RE = PathExpr.FIRST_SEGMENT_RE
+
+    def __init__(self, stats: Optional[RenderStats] = None) -> None:
+        self.stats = stats if stats is not None else RenderStats()
+        self.indexes: Dict[Tuple[int, str, Any], Any] = {}
 
     def resolve_scoped(self, path: str, scope: Scope, *, default_ci: bool = False) -> Any:
+        if not isinstance(path, str):
+            self.scope_aliases = scope.aliases or {}
+            return None
+        expr = compile_path(path)
+        key = (expr, default_ci)
+        memo = scope.memo
+        version = scope.versions.get(expr.var, 0) if expr.var is not None else 0
+        if memo is None:
+            memo = scope.memo = {}
+        else:
+            hit = memo.get(key)
+            if hit is not None and hit[0] == version:
+                return hit[1]
+        val = self.resolve_expr(expr, scope, default_ci=default_ci)
+        memo[key] = (version, val)
+        return val
+
+    def resolve_expr(self, expr: PathExpr, scope: Scope, *, default_ci: bool = False) -> Any:
         self.scope_aliases = scope.aliases or {}
-        if not isinstance(path, str) or not path.strip():
+        if expr.empty:
             return None
-        p = path.strip()
 
-        m0 = re.match(r"^([A-Za-z_]\w*)$", p)
-        if m0:
-            name = m0.group(1)
+        name = expr.name
+        if name is not None:
             vb, _ = scope.get_var_binding(name)
             if vb:
                 if vb.humble is False:
                     return vb.value
                 if name in scope.aliases:
                     return scope.aliases[name]
-                rv = self._eval(p, scope.root, default_ci=default_ci)
+                rv = self._walk(expr.steps, scope.root, default_ci)
                 return rv if rv is not None else vb.value
             if name in scope.aliases:
                 return scope.aliases[name]
-            return self._eval(p, scope.root, default_ci=default_ci)
+            return self._walk(expr.steps, scope.root, default_ci)
 
-        mdot = re.match(r'^("?[A-Za-z_]\w*"?)\.(.+)$', p)
-        if mdot:
-            base = mdot.group(1)
-            rest = mdot.group(2)
-            base_key = base.replace('"', "")
+        base_key = expr.dotted_key
+        if base_key is not None:
+            rest = expr.dotted_rest
             vb, _ = scope.get_var_binding(base_key)
             if vb:
                 if vb.humble is False:
-                    return self._eval(rest, vb.value, default_ci=default_ci)
+                    return self._walk(rest, vb.value, default_ci)
                 if base_key in scope.aliases:
-                    return self._eval(rest, scope.aliases[base_key], default_ci=default_ci)
+                    return self._walk(rest, scope.aliases[base_key], default_ci)
                 if isinstance(scope.root, dict) and base_key in scope.root:
-                    return self._eval(rest, scope.root[base_key], default_ci=default_ci)
-                return self._eval(rest, vb.value, default_ci=default_ci)
+                    return self._walk(rest, scope.root[base_key], default_ci)
+                return self._walk(rest, vb.value, default_ci)
             if base_key in scope.aliases:
-                return self._eval(rest, scope.aliases[base_key], default_ci=default_ci)
+                return self._walk(rest, scope.aliases[base_key], default_ci)
             if isinstance(scope.root, dict) and base_key in scope.root:
-                return self._eval(rest, scope.root[base_key], default_ci=default_ci)
+                return self._walk(rest, scope.root[base_key], default_ci)
             return None
 
-        mfirst = self.FIRST_SEGMENT_RE.match(p)
-        if mfirst and mfirst.groupdict():
-            name_raw = mfirst.group("name")
-            sel = mfirst.group("sel")
-            rest = mfirst.group("rest")
-            base_name = name_raw.replace('"', "")
-
-            base_obj = self._resolve_base_identifier(base_name, scope, default_ci=default_ci)
+        head = expr.head
+        if head is not None:
+            base_obj = self._resolve_base_identifier(head.name, scope, default_ci=default_ci)
             if base_obj is not None:
                 cur = base_obj
-                if sel is not None:
-                    cur = self._apply_bracket_or_selector(cur, sel, default_ci=default_ci)
+                if head.sel is not None:
+                    cur = self._apply_step_selector(cur, head, default_ci)
                     if cur is None:
                         return None
-                if rest:
-                    return self._eval(rest, cur, default_ci=default_ci)
+                if expr.rest is not None:
+                    return self._walk(expr.rest, cur, default_ci)
                 return cur
 
-        return self._eval(p, scope.root, default_ci=default_ci)
+        return self._walk(expr.steps, scope.root, default_ci)
 
     def resolve_for_loop(self, path: str, scope: Scope, *, default_ci: bool = False) -> List[Any]:
+        if not isinstance(path, str):
+            self.scope_aliases = scope.aliases or {}
+            return []
+        return self.resolve_expr_all(compile_path(path), scope, default_ci=default_ci)
+
+    def resolve_expr_all(self, expr: PathExpr, scope: Scope, *, default_ci: bool = False) -> List[Any]:
         self.scope_aliases = scope.aliases or {}
-        if not isinstance(path, str) or not path.strip():
+        if expr.empty:
             return []
-        p = path.strip()
 
-        m0 = re.match(r"^([A-Za-z_]\w*)$", p)
-        if m0:
-            name = m0.group(1)
-            base_obj = self._resolve_base_identifier(name, scope, default_ci=default_ci)
+        if expr.name is not None:
+            base_obj = self._resolve_base_identifier(expr.name, scope, default_ci=default_ci)
             if base_obj is not None:
                 v = base_obj
                 if isinstance(v, list):
                     return v
                 return [] if v is None else [v]
-            v = self._eval(p, scope.root, default_ci=default_ci)
+            v = self._walk(expr.steps, scope.root, default_ci)
             if isinstance(v, list):
                 return v
             return [] if v is None else [v]
 
-        mfirst = self.FIRST_SEGMENT_RE.match(p)
-        if mfirst and mfirst.groupdict():
-            name_raw = mfirst.group("name")
-            sel = mfirst.group("sel")
-            rest = mfirst.group("rest")
-            base_name = name_raw.replace('"', "")
-            base_obj = self._resolve_base_identifier(base_name, scope, default_ci=default_ci)
+        head = expr.head
+        if head is not None:
+            base_obj = self._resolve_base_identifier(head.name, scope, default_ci=default_ci)
             if base_obj is not None:
                 cur = base_obj
-                if sel is not None:
-                    cur = self._apply_bracket_or_selector(cur, sel, default_ci=default_ci)
+                if head.sel is not None:
+                    cur = self._apply_step_selector(cur, head, default_ci)
                     if cur is None:
                         return []
-                v = self._eval_all(rest, cur, default_ci=default_ci) if rest else cur
+                v = self._walk_all(expr.rest, cur, default_ci) if expr.rest is not None else cur
                 if isinstance(v, list):
                     return v
                 return [] if v is None else [v]
 
-        v = self._eval_all(p, scope.root, default_ci=default_ci)
+        v = self._walk_all(expr.steps, scope.root, default_ci)
         if isinstance(v, list):
             return v
         return [] if v is None else [v]
@@ -820,23 +1448,23 @@ class PathResolver:
                 return vb.value
             if name in scope.aliases:
                 return scope.aliases[name]
-            rv = self._eval(name, scope.root, default_ci=default_ci)
+            rv = self._walk(compile_steps(name), scope.root, default_ci)
             return rv if rv is not None else vb.value
         if name in scope.aliases:
             return scope.aliases[name]
         return None
 
-    def _parse_bracket_key(self, sel: str) -> Optional[str]:
+    @staticmethod
+    def _parse_bracket_key(sel: str) -> Optional[str]:
         s = str(sel or "").strip()
         if len(s) >= 2 and ((s[0] == '"' and s[-1] == '"') or (s[0] == "'" and s[-1] == "'")):
             body = s[1:-1].replace('\"', '"').replace("\'", "'")
             return body
         return None
 
-    def _apply_bracket_or_selector(self, cur: Any, sel: str, *, default_ci: bool = False) -> Any:
+    def _apply_step_selector(self, cur: Any, step: PathStep, default_ci: bool) -> Any:
         if isinstance(cur, dict):
-            quoted = self._parse_bracket_key(sel)
-            key = quoted if quoted is not None else str(sel).strip()
+            key = step.key
             if key in cur:
                 return cur[key]
             if default_ci:
@@ -845,77 +1473,75 @@ class PathResolver:
                         return cur[k]
             return None
         if isinstance(cur, list):
-            return self._apply_selector_first(cur, sel, default_ci=default_ci)
+            return self._select_first(cur, step.selector, default_ci)
         return None
 
-    def _eval(self, path: str, root: Any, *, default_ci: bool = False) -> Any:
+    def _walk(self, steps: Tuple[PathStep, ...], root: Any, default_ci: bool) -> Any:
         cur = root
 
         if isinstance(cur, list) and len(cur) == 1 and isinstance(cur[0], dict):
             cur = cur[0]
 
+        aliases = self.scope_aliases or {}
         first = True
-        for m in self.SEGMENT_RE.finditer(path.strip()):
-            name_raw = m.group("name")
-            sel = m.group("sel")
-            name = name_raw.replace('"', "")
+        for step in steps:
+            name = step.name
 
             if isinstance(cur, list) and len(cur) == 1 and isinstance(cur[0], dict):
                 cur = cur[0]
 
-            if first and name in (self.scope_aliases or {}):
-                cur = self.scope_aliases[name]
+            if first and name in aliases:
+                cur = aliases[name]
             elif isinstance(cur, dict) and name in cur:
                 cur = cur[name]
             else:
                 return None
             first = False
 
-            if sel is not None:
-                applied = self._apply_bracket_or_selector(cur, sel, default_ci=default_ci)
+            if step.sel is not None:
+                applied = self._apply_step_selector(cur, step, default_ci)
                 if applied is None:
                     return None
                 cur = applied
         return cur
 
-    def _eval_all(self, path: str, root: Any, *, default_ci: bool = False) -> Any:
+    def _walk_all(self, steps: Tuple[PathStep, ...], root: Any, default_ci: bool) -> Any:
         cur = root
 
         if isinstance(cur, list) and len(cur) == 1 and isinstance(cur[0], dict):
             cur = cur[0]
 
+        aliases = self.scope_aliases or {}
         first = True
-        for m in self.SEGMENT_RE.finditer(path.strip()):
-            name_raw = m.group("name")
-            sel = m.group("sel")
-            name = name_raw.replace('"', "")
+        for step in steps:
+            name = step.name
 
             if isinstance(cur, list) and len(cur) == 1 and isinstance(cur[0], dict):
                 cur = cur[0]
 
-            if first and name in (self.scope_aliases or {}):
-                cur = self.scope_aliases[name]
+            if first and name in aliases:
+                cur = aliases[name]
             elif isinstance(cur, dict) and name in cur:
                 cur = cur[name]
             else:
                 return []
             first = False
 
-            if sel is not None:
+            if step.sel is not None:
                 if isinstance(cur, dict):
-                    quoted = self._parse_bracket_key(sel)
-                    key = quoted if quoted is not None else str(sel).strip()
+                    key = step.key
                     if key in cur:
                         cur = cur[key]
                     else:
                         return []
                 elif isinstance(cur, list):
-                    cur = self._apply_selector_all(cur, sel, default_ci=default_ci)
+                    cur = self._select_all(cur, step.selector, default_ci)
                 else:
                     return []
         return cur if isinstance(cur, list) else [cur]
 
-    def _split_top_level(self, expr: str, sep: str) -> List[str]:
+    @staticmethod
+    def _split_top_level(expr: str, sep: str) -> List[str]:
         out: List[str] = []
         cur = ""
         in_str = False
@@ -955,7 +1581,8 @@ class PathResolver:
             out.append(last)
         return out
 
-    def _find_top_level_op(self, s: str) -> Tuple[Optional[str], int]:
+    @staticmethod
+    def _find_top_level_op(s: str) -> Tuple[Optional[str], int]:
         in_str = False
         esc = False
         depth = 0
@@ -985,7 +1612,8 @@ class PathResolver:
                         return ch, i
         return None, -1
 
-    def _parse_value_token(self, tok: str) -> Any:
+    @staticmethod
+    def _parse_value_token(tok: str) -> Any:
         t = str(tok or "").strip()
         if (t.startswith('"') and t.endswith('"')) or (t.startswith("'") and t.endswith("'")):
             return t[1:-1].replace('\"', '"').replace("\'", "'")
@@ -1001,154 +1629,107 @@ class PathResolver:
             return None
         return t
 
-    def _extract_ci(self, s: str) -> Tuple[str, bool]:
+    @staticmethod
+    def _extract_ci(s: str) -> Tuple[str, bool]:
         m = re.search(r"\sci=(true|false)\s*$", str(s or ""), re.IGNORECASE)
         if m:
             ci = m.group(1).lower() == "true"
             return str(s)[: m.start()].rstrip(), ci
         return str(s or ""), False
 
-    def _parse_predicate(self, expr: str) -> List[List[Tuple[str, str, Any]]]:
-        core, _ = self._extract_ci(expr)
-        or_parts = self._split_top_level(core, "|")
+    @staticmethod
+    def _parse_predicate(expr: str) -> List[List[Tuple[str, str, Any]]]:
+        core, _ = PathResolver._extract_ci(expr)
+        or_parts = PathResolver._split_top_level(core, "|")
         result: List[List[Tuple[str, str, Any]]] = []
         for part in or_parts:
-            ands = self._split_top_level(part, "&")
+            ands = PathResolver._split_top_level(part, "&")
             conds: List[Tuple[str, str, Any]] = []
             for c in ands:
-                op, pos = self._find_top_level_op(c)
+                op, pos = PathResolver._find_top_level_op(c)
                 if not op:
                     continue
                 key = c[:pos].strip()
-                val = self._parse_value_token(c[pos + len(op) :].strip())
+                val = PathResolver._parse_value_token(c[pos + len(op) :].strip())
                 conds.append((key, op, val))
             if conds:
                 result.append(conds)
         return result
 
-    def _resolve_predicate_key(self, key: str, scope: Scope, *, default_ci: bool = False) -> Any:
-        k = str(key or "").strip()
-        m = re.match(r"^\[get:([A-Za-z0-9_]+)(?:[^\]]*)\]$", k)
-        if m:
-            return scope.get_var_value(m.group(1))
-        return self.resolve_scoped(k, scope, default_ci=default_ci)
-
     def eval_condition(self, cond_expr: str, scope: Scope, *, default_ci: bool = False) -> bool:
-        chopped, ci_in = self._extract_ci(cond_expr)
-        ci = ci_in or default_ci
-        clauses = self._parse_predicate(chopped)
-        if not clauses:
-            val = self.resolve_scoped(chopped, scope, default_ci=ci)
+        cond = compile_condition(str(cond_expr or ""))
+        ci = cond.ci or default_ci
+        if not cond.clauses:
+            val = self.resolve_scoped(cond.chopped, scope, default_ci=ci)
             return exists_for_success(val)
-        for ands in clauses:
+        for ands in cond.tests(ci):
             ok_all = True
-            for k, op, v in ands:
-                left = self._resolve_predicate_key(k, scope, default_ci=ci)
-                if not self._cmp(left, op, v, case_insensitive=ci):
+            for key, var, test in ands:
+                left = scope.get_var_value(var) if var is not None else self.resolve_scoped(key, scope, default_ci=ci)
+                if not test(left):
                     ok_all = False
                     break
             if ok_all:
                 return True
         return False
 
-    def _cmp(self, left: Any, op: str, right: Any, *, case_insensitive: bool = False) -> bool:
-        Lnum = coerce_number(left)
-        Rnum = coerce_number(right)
-        if Lnum is not None and Rnum is not None and (op in PDL.NUMERIC_OPS or op in {"=", "!="}):
-            try:
-                if op == "=":
-                    return Lnum == Rnum
-                if op == "!=":
-                    return Lnum != Rnum
-                if op == "<":
-                    return Lnum < Rnum
-                if op == "<=":
-                    return Lnum <= Rnum
-                if op == ">":
-                    return Lnum > Rnum
-                if op == ">=":
-                    return Lnum >= Rnum
-            except Exception:
-                return False
-
-        L = normalize_str(left)
-        R = normalize_str(right)
-        if isinstance(L, str) and isinstance(R, str):
-            if case_insensitive:
-                L = L.lower()
-                R = R.lower()
-            try:
-                if op == "=":
-                    return L == R
-                if op == "!=":
-                    return L != R
-                if op == "^=":
-                    return L.startswith(R)
-                if op == "$=":
-                    return L.endswith(R)
-                if op == "*=":
-                    return R in L
-            except Exception:
-                return False
-
-        try:
-            if op == "=":
-                return L == R
-            if op == "!=":
-                return L != R
-        except Exception:
-            return False
-        return False
-
-    def _get_nested(self, obj: Any, key_path: str) -> Any:
-        if key_path == "":
-            return obj
-        cur = obj
-        for part in str(key_path).split('.'):
-            if isinstance(cur, dict) and part in cur:
-                cur = cur[part]
-            else:
-                return None
-        return cur
-
-    def _apply_selector_first(self, arr: List[Any], selector: str, *, default_ci: bool = False) -> Any:
-        s = str(selector or "").strip()
-        if s == "":
+    def _select_first(self, arr: List[Any], sel: Selector, default_ci: bool) -> Any:
+        if sel.kind == SEL_FIRST:
             return arr[0] if arr else None
-        if re.fullmatch(r"\d+", s):
-            idx = int(s)
+        if sel.kind == SEL_INDEX:
+            idx = sel.index
             return arr[idx] if 0 <= idx < len(arr) else None
-        core, ci_sel = self._extract_ci(s)
-        ci = default_ci or ci_sel
-        clauses = self._parse_predicate(core)
+        if sel.equality is not None and len(arr) >= PDL.INDEX_MIN_ITEMS:
+            hits = self._equality_hits(arr, sel, default_ci)
+            return arr[hits[0]] if hits else None
+        if sel.bounds is not None and len(arr) >= PDL.INDEX_MIN_ITEMS:
+            key, op, bound = sel.bounds
+            i = self.range_index(arr, key).first(op, bound)
+            return None if i is None else arr[i]
+        test = sel.predicate(default_ci)
         for item in arr:
-            ok = any(
-                all(self._cmp(self._get_nested(item, k), op, v, case_insensitive=ci) for k, op, v in ands)
-                for ands in clauses
-            )
-            if ok:
+            if test(item):
                 return item
         return None
 
-    def _apply_selector_all(self, arr: List[Any], selector: str, *, default_ci: bool = False) -> List[Any]:
-        s = str(selector or "").strip()
-        if s == "":
+    def _select_all(self, arr: List[Any], sel: Selector, default_ci: bool) -> List[Any]:
+        if sel.kind == SEL_FIRST:
             return list(arr)
-        if re.fullmatch(r"\d+", s):
-            idx = int(s)
+        if sel.kind == SEL_INDEX:
+            idx = sel.index
             return [arr[idx]] if 0 <= idx < len(arr) else []
-        core, ci_sel = self._extract_ci(s)
-        ci = default_ci or ci_sel
-        clauses = self._parse_predicate(core)
-        out: List[Any] = []
-        for item in arr:
-            ok = any(
-                all(self._cmp(self._get_nested(item, k), op, v, case_insensitive=ci) for k, op, v in ands)
-                for ands in clauses
-            )
-            if ok:
-                out.append(item)
-        return out
+        if sel.equality is not None and len(arr) >= PDL.INDEX_MIN_ITEMS:
+            return [arr[i] for i in self._equality_hits(arr, sel, default_ci)]
+        if sel.bounds is not None and len(arr) >= PDL.INDEX_MIN_ITEMS:
+            return [arr[i] for i in self._range_hits(arr, sel)]
+        test = sel.predicate(default_ci)
+        return [item for item in arr if test(item)]
+
+    def _equality_hits(self, arr: List[Any], sel: Selector, default_ci: bool) -> List[int]:
+        key, right = sel.equality
+        return self.equality_index(arr, key, bool(default_ci or sel.ci)).lookup(right)
+
+    def _range_hits(self, arr: List[Any], sel: Selector) -> List[int]:
+        key, op, bound = sel.bounds
+        return self.range_index(arr, key).lookup(op, bound)
+
+    def equality_index(self, arr: List[Any], key: str, ci: bool) -> EqualityIndex:
+        """Return the render's index of `arr` by `key`, building it on first use."""
+        return self._index(arr, (id(arr), key, ci), lambda: EqualityIndex(arr, key, ci))
+
+    def range_index(self, arr: List[Any], key: str) -> RangeIndex:
+        """Return the render's sorted numeric index of `arr` by `key`, building it on first use."""
+        return self._index(arr, (id(arr), key, "range"), lambda: RangeIndex(arr, key))
+
+    def _index(self, arr: List[Any], slot: Tuple[int, str, Any], build: Callable[[], Any]) -> Any:
+        index = self.indexes.get(slot)
+        # The index holds `arr`, so its id cannot be reused while the entry lives.
+        if index is None or index.items is not arr or index.size != len(arr):
+            index = self.indexes[slot] = build()
+            self.stats.index_builds += 1
+        else:
+            self.stats.index_hits += 1
+        return index
 
 
 # ================================================================
@@ -1182,6 +1763,32 @@ class CommentHandler:
         return "\n".join(out)
 
 
+def _nested_text(val: Any) -> str:
+    if isinstance(val, (list, dict)):
+        return compact_json(val)
+    if isinstance(val, bool):
+        return "true" if val else "false"
+    return str(val)
+
+
+def nested_value_text(inner: str, scope: Scope, resolver: PathResolver) -> str:
+    """The text a nested `[value:inner]` is replaced with inside an expression."""
+    val = resolver.resolve_scoped(inner, scope, default_ci=False)
+    if val is None:
+        return f"{PDL.VALUE_PREFIX}{inner}]"
+    return _nested_text(val)
+
+
+def nested_get_text(inner_raw: str, scope: Scope) -> str:
+    """The text a nested `[get:inner]` is replaced with inside an expression."""
+    first_sp = re.search(r"\s", inner_raw)
+    name = inner_raw if not first_sp else inner_raw[: first_sp.start()].strip()
+    val = scope.get_var_value(name) if VAR_NAME_RE.match(name) else None
+    if val is None:
+        return "null"
+    return _nested_text(val)
+
+
 def resolve_nested_in_expr(expr: str, scope: Scope, resolver: PathResolver) -> str:
     if not expr:
         return expr
@@ -1229,26 +1836,10 @@ def resolve_nested_in_expr(expr: str, scope: Scope, resolver: PathResolver) -> s
         return segment
 
     def val_getter(inner: str) -> str:
-        val = resolver.resolve_scoped(inner, scope, default_ci=False)
-        if val is None:
-            return f"{PDL.VALUE_PREFIX}{inner}]"
-        if isinstance(val, (list, dict)):
-            return compact_json(val)
-        if isinstance(val, bool):
-            return "true" if val else "false"
-        return str(val)
+        return nested_value_text(inner, scope, resolver)
 
     def get_getter(inner_raw: str) -> str:
-        first_sp = re.search(r"\s", inner_raw)
-        name = inner_raw if not first_sp else inner_raw[: first_sp.start()].strip()
-        val = scope.get_var_value(name) if VAR_NAME_RE.match(name) else None
-        if val is None:
-            return "null"
-        if isinstance(val, (list, dict)):
-            return compact_json(val)
-        if isinstance(val, bool):
-            return "true" if val else "false"
-        return str(val)
+        return nested_get_text(inner_raw, scope)
 
     s = expand_token(s, PDL.VALUE_PREFIX, val_getter)
     s = expand_token(s, PDL.GET_PREFIX, get_getter)
@@ -1260,7 +1851,111 @@ def resolve_nested_in_expr(expr: str, scope: Scope, resolver: PathResolver) -> s
 # ================================================================
 
 
+class InlineLexer:
+    """Directive markers and bracket pairs of one line, found in a single pass."""
+
+    __slots__ = ("text", "positions", "closes")
+
+    MARKERS = (
+        PDL.VALUE_PREFIX,
+        PDL.GET_PREFIX,
+        PDL.SET_PREFIX,
+        PDL.LOOP_IDX,
+        PDL.IF_START,
+        PDL.ELIF,
+        PDL.ELSE,
+        PDL.IF_END,
+        PDL.LOOP_START,
+        PDL.LOOP_END,
+    )
+    _TOKEN_RE = re.compile(r"\[(?:" + "|".join(re.escape(m[1:]) for m in sorted(MARKERS, key=len, reverse=True)) + r")?|\]")
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.positions: Dict[str, List[int]] = {}
+        self.closes: Dict[int, int] = {}
+        stack: List[int] = []
+        for m in self._TOKEN_RE.finditer(text):
+            tok = m.group()
+            a = m.start()
+            if tok == "]":
+                if stack:
+                    self.closes[stack.pop()] = a
+                continue
+            if tok != "[":
+                self.positions.setdefault(tok, []).append(a)
+                if tok[-1] == "]":
+                    self.closes[a] = m.end() - 1
+                    continue
+            stack.append(a)
+
+    def find(self, marker: str, pos: int = 0) -> int:
+        found = self.positions.get(marker)
+        if not found:
+            return -1
+        k = bisect_left(found, pos)
+        return found[k] if k < len(found) else -1
+
+    def first(self, markers: Iterable[str], pos: int = 0) -> Tuple[int, str]:
+        """The earliest of `markers` at or after `pos` as `(index, marker)`, or `(-1, "")`."""
+        best = (-1, "")
+        for marker in markers:
+            a = self.find(marker, pos)
+            if a != -1 and (best[0] == -1 or a < best[0]):
+                best = (a, marker)
+        return best
+
+    def closing(self, a: int) -> int:
+        return self.closes.get(a, -1)
+
+
+class InlineRewrite:
+    """Output of one inline stage, built in a single forward pass."""
+
+    __slots__ = ("src", "marker", "lex", "parts", "done", "pos", "tail")
+
+    def __init__(self, text: str, marker: str) -> None:
+        self.marker = marker
+        self.src = text
+        self.lex = InlineLexer(text)
+        self.parts: List[str] = []
+        self.done = 0  # src[:done] is already in parts
+        self.pos = 0  # next search position in src
+        self.tail = ""  # last len(marker) - 1 characters written
+
+    def find(self, marker: str, pos: Optional[int] = None) -> int:
+        return self.lex.find(marker, self.pos if pos is None else pos)
+
+    def replace(self, a: int, b: int, repl: str) -> None:
+        """Replace `src[a:b]` with `repl` and continue after it."""
+        keep = len(self.marker) - 1
+        piece = self.src[self.done : a]
+        tail = (self.tail + piece[-keep:])[-keep:]
+        if self.marker in tail + repl + self.src[b : b + keep]:
+            before = "".join(self.parts) + piece
+            text = before + repl + self.src[b:]
+            self.src = text
+            self.lex = InlineLexer(text)
+            self.parts = []
+            self.done = 0
+            self.pos = len(before) - len(tail)
+            self.tail = ""
+            return
+        self.parts.append(piece)
+        self.parts.append(repl)
+        self.tail = (tail + repl[-keep:])[-keep:]
+        self.done = b
+        self.pos = b
+
+    def result(self) -> str:
+        if not self.parts:
+            return self.src[self.done :]
+        return "".join(self.parts) + self.src[self.done :]
+
+
 class InlineIfHelper:
+    __slots__ = ()
+
     @staticmethod
     def find_closing_bracket(s: str, start_pos: int, end_limit: int) -> int:
         in_str = False
@@ -1299,14 +1994,45 @@ class InlineIfHelper:
             cond_core = cleaned[: m.start()].rstrip() if m else cleaned
             return resolver.eval_condition(cond_core, scope, default_ci=default_ci)
 
+        return InlineIfHelper.resolve(line, eval_chain, stats)
+
+    @staticmethod
+    def outcomes(line: str, limit: int = 64) -> Optional[List[Tuple[str, bool]]]:
+        """Every `(text, drop)` that `apply` can produce for `line`, or None past `limit` paths."""
+        results: List[Tuple[str, bool]] = []
+        scratch = RenderStats()
+        pending: List[Tuple[bool, ...]] = [()]
+        while pending:
+            prefix = pending.pop()
+            taken: List[bool] = []
+
+            def decide(_cond: str) -> bool:
+                choice = prefix[len(taken)] if len(taken) < len(prefix) else False
+                taken.append(choice)
+                return choice
+
+            results.append(InlineIfHelper.resolve(line, decide, scratch))
+            if len(results) > limit:
+                return None
+            for k in range(len(prefix), len(taken)):
+                pending.append(tuple(taken[:k]) + (True,))
+        return results
+
+    @staticmethod
+    def resolve(line: str, eval_chain: Any, stats: RenderStats) -> Tuple[str, bool]:
         s = str(line)
+        if PDL.IF_START not in s:
+            return s, False
+        out = InlineRewrite(s, PDL.IF_START)
         changed_any = False
 
         while True:
-            start = s.find(PDL.IF_START)
+            s = out.src
+            lex = out.lex
+            start = out.find(PDL.IF_START)
             if start == -1:
                 break
-            end = s.find(PDL.IF_END, start)
+            end = lex.find(PDL.IF_END, start)
             if end == -1:
                 stats.errors_inline += 1
                 break
@@ -1323,8 +2049,8 @@ class InlineIfHelper:
             parts: List[Tuple[Optional[str], str]] = []
 
             def read_until_next_tag(cpos: int) -> Tuple[str, int]:
-                next_elif = s.find(PDL.ELIF, cpos)
-                next_else = s.find(PDL.ELSE, cpos)
+                next_elif = lex.find(PDL.ELIF, cpos)
+                next_else = lex.find(PDL.ELSE, cpos)
                 candidates = [x for x in (next_elif, next_else, end) if x != -1 and x <= end]
                 stop = min(candidates) if candidates else end
                 return s[cpos:stop], stop
@@ -1366,14 +2092,33 @@ class InlineIfHelper:
                 else:
                     stats.conds_false += 1
 
-            s = s[:start] + chosen + s[end + len(PDL.IF_END) :]
+            out.replace(start, end + len(PDL.IF_END), chosen)
             changed_any = True
 
+        s = out.result()
         drop_line = changed_any and s.strip() == ""
         return s, drop_line
 
 
+LOOP_PARAM_TYPES: Dict[str, Any] = {"as": str, "start": int, "join": str, "empty": str, "dots": bool, "ci": bool}
+LOOP_PARAM_DEFAULTS: Dict[str, Any] = {"path": "", "as": None, "start": 1, "join": None, "empty": None, "dots": True, "ci": False}
+
+
+class LoopFlags(Flags):
+    """`[loop:path as=x start=1 join=", " empty="…" dots=true ci=false]`; `as` is read as `as_`."""
+
+    FIELDS = {"path": "path", "as": "as_", "start": "start", "join": "join", "empty": "empty", "dots": "dots", "ci": "ci"}
+    __slots__ = tuple(FIELDS.values())
+
+
+@lru_cache(maxsize=PDL.PARSE_CACHE_SIZE)
+def parse_loop_params(raw: str) -> LoopFlags:
+    return LoopFlags(parse_kv_flags(raw, first_positional="path", types=LOOP_PARAM_TYPES, defaults=LOOP_PARAM_DEFAULTS))
+
+
 class InlineLoopExpander:
+    __slots__ = ()
+
     @staticmethod
     def find_header_end(s: str) -> int:
         in_str = False
@@ -1402,12 +2147,15 @@ class InlineLoopExpander:
     @staticmethod
     def apply(line: str, scope: Scope, resolver: PathResolver, stats: RenderStats) -> str:
         original = str(line)
-        s = original
+        if PDL.LOOP_START not in original:
+            return original
+        out = InlineRewrite(original, PDL.LOOP_START)
         while True:
-            a = s.find(PDL.LOOP_START)
+            s = out.src
+            a = out.find(PDL.LOOP_START)
             if a == -1:
                 break
-            b = s.find(PDL.LOOP_END, a)
+            b = out.find(PDL.LOOP_END, a)
             if b == -1:
                 break
 
@@ -1419,14 +2167,9 @@ class InlineLoopExpander:
             head = head_and_rest[:rb].strip()
             body = head_and_rest[rb + 1 :]
 
-            params = parse_kv_flags(
-                head,
-                first_positional="path",
-                types={"as": str, "start": int, "join": str, "empty": str, "dots": bool, "ci": bool},
-                defaults={"as": None, "start": 1, "join": None, "empty": None, "dots": True, "ci": False},
-            )
+            params = parse_loop_params(head)
 
-            arr = resolver.resolve_for_loop(str(params.get("path", "")), scope, default_ci=bool(params.get("ci")))
+            arr = resolver.resolve_for_loop(str(params.path), scope, default_ci=bool(params.ci))
 
             rendered: List[str] = []
             hit_limit = False
@@ -1434,14 +2177,7 @@ class InlineLoopExpander:
                 if not bump_exp(stats, 1):
                     hit_limit = True
                     break
-                child_scope = Scope(
-                    root=scope.root,
-                    aliases={**scope.aliases, **({params["as"]: item} if params.get("as") else {})},
-                    index_chain=[*scope.index_chain, int(params.get("start", 1)) + k],
-                    dots=bool(params.get("dots", True)),
-                    var_frames=[*scope.var_frames, {}],
-                    highlight=scope.highlight,
-                )
+                child_scope = scope.child(alias=params.as_, item=item, index=int(params.start) + k, dots=bool(params.dots))
 
                 seg, drop = InlineIfHelper.apply(body, child_scope, resolver, stats)
                 if not drop:
@@ -1452,67 +2188,80 @@ class InlineLoopExpander:
                         rendered.append(seg_clean)
 
             if not rendered:
-                repl = "" if params.get("empty") is None else str(params.get("empty"))
+                repl = "" if params.empty is None else str(params.empty)
             else:
                 repl = (
                     "".join(rendered)
-                    if params.get("join") is None
-                    else str(params.get("join")).join(rendered)
+                    if params.join is None
+                    else str(params.join).join(rendered)
                 )
 
-            s = s[:a] + repl + s[b + len(PDL.LOOP_END) :]
+            out.replace(a, b + len(PDL.LOOP_END), repl)
             if hit_limit:
-                return s
-        return s
+                break
+        return out.result()
+
+
+class SetArgs:
+    """The parsed inside of one `[set:name=value flags]` directive."""
+
+    __slots__ = ("name", "raw_value", "valid", "had_const", "had_humble", "const_flag", "humble_flag", "scope_local")
+
+    def __init__(self, inner: str) -> None:
+        try:
+            parts = split_args(inner)
+        except Exception:
+            parts = inner.split()
+        head = parts[0].strip() if parts else ""
+        flags_raw = " ".join(parts[1:]).strip()
+
+        self.name = head
+        self.raw_value: Optional[str] = None
+        if "=" in head:
+            idx = head.find("=")
+            self.name = head[:idx].strip()
+            self.raw_value = head[idx + 1 :].strip()
+        self.valid = bool(VAR_NAME_RE.match(str(self.name or "")))
+
+        params = parse_kv_flags(flags_raw, types={"const": bool, "humble": bool, "scope": bool}, defaults=None)
+        self.had_const = "const" in params
+        self.had_humble = "humble" in params
+        self.const_flag = bool(params.get("const")) if self.had_const else None
+        self.humble_flag = bool(params.get("humble")) if self.had_humble else None
+        self.scope_local = bool(params.get("scope")) if "scope" in params else False
+
+
+@lru_cache(maxsize=PDL.PARSE_CACHE_SIZE)
+def parse_set_args(inner: str) -> SetArgs:
+    return SetArgs(inner)
 
 
 class InlineSetDirective:
+    __slots__ = ()
+
     def apply(self, line: str, scope: Scope, resolver: PathResolver, stats: RenderStats) -> str:
         s = str(line)
+        if PDL.SET_PREFIX not in s:
+            return s
+        out = InlineRewrite(s, PDL.SET_PREFIX)
         while True:
-            a = s.find(PDL.SET_PREFIX)
+            s = out.src
+            a = out.find(PDL.SET_PREFIX)
             if a == -1:
                 break
 
-            p = a
-            depth = 0
-            end = -1
-            while p < len(s):
-                ch = s[p]
-                if ch == "[":
-                    depth += 1
-                elif ch == "]":
-                    depth -= 1
-                    if depth == 0:
-                        end = p
-                        break
-                p += 1
+            end = out.lex.closing(a)
             if end == -1:
                 break
 
-            inner = s[a + len(PDL.SET_PREFIX) : end].strip()
-            try:
-                parts = split_args(inner)
-            except Exception:
-                parts = inner.split()
-            head = parts[0].strip() if parts else ""
-            flags_raw = " ".join(parts[1:]).strip()
-
-            name = head
-            raw_value = None
-            if "=" in head:
-                idx = head.find("=")
-                name = head[:idx].strip()
-                raw_value = head[idx + 1 :].strip()
-
-            params = parse_kv_flags(flags_raw, types={"const": bool, "humble": bool, "scope": bool}, defaults=None)
+            args = parse_set_args(s[a + len(PDL.SET_PREFIX) : end].strip())
+            name = args.name
+            raw_value = args.raw_value
+            had_const = args.had_const
+            had_humble = args.had_humble
 
-            had_const = "const" in params
-            had_humble = "humble" in params
-            had_scope = "scope" in params
-
-            if not VAR_NAME_RE.match(str(name or "")):
-                s = s[:a] + s[end + 1 :]
+            if not args.valid:
+                out.replace(a, end + 1, "")
                 continue
 
             has_value = raw_value is not None
@@ -1521,14 +2270,13 @@ class InlineSetDirective:
                 expanded = resolve_nested_in_expr(raw_value, scope, resolver)
                 value_obj = parse_scalar_or_json(expanded)
 
-            const_flag = bool(params.get("const")) if had_const else None
-            humble_flag = bool(params.get("humble")) if had_humble else None
-            scope_local = bool(params.get("scope")) if had_scope else False
-            if scope_local and len(scope.var_frames) == 1:
+            const_flag = args.const_flag
+            humble_flag = args.humble_flag
+            scope_local = args.scope_local
+            if scope_local and scope.parent is None:
                 scope_local = False
 
-            target_frame = scope.var_frames[-1] if scope_local else scope.var_frames[0]
-            binding_in_target = target_frame.get(name)
+            binding_in_target = scope.target_binding(name, scope_local)
 
             if has_value:
                 allow_flip_update = bool(binding_in_target and binding_in_target.const and had_const and const_flag is False)
@@ -1546,9 +2294,10 @@ class InlineSetDirective:
                         binding_in_target.const = bool(const_flag)
                     if had_humble:
                         binding_in_target.humble = bool(humble_flag)
+                    scope.touch_var(name)
 
-            s = s[:a] + s[end + 1 :]
-        return s
+            out.replace(a, end + 1, "")
+        return out.result()
 
 
 # ================================================================
@@ -1556,489 +2305,899 @@ class InlineSetDirective:
 # ================================================================
 
 
-def expand_values_and_get_inline(text: str, scope: Scope, resolver: PathResolver, stats: RenderStats) -> str:
-    t = str(text or "")
-    if not any(tok in t for tok in (PDL.VALUE_PREFIX, PDL.LOOP_IDX, PDL.GET_PREFIX)):
-        return t
+class ValueToken:
+    """One `[value:…]`, `[get:…]` or `[loop-index]` occurrence inside a line."""
+
+    __slots__ = ("kind", "start", "end", "head", "params_raw", "params", "filter")
+
+    def __init__(self, kind: str, start: int, end: int, head: str = "", params_raw: str = "", params: Optional[ValueFlags] = None) -> None:
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self.head = head
+        self.params_raw = params_raw
+        self.params = params
+        self.filter = compile_value_filter(params_raw) if params is not None else None
+
+
+VALUE_PARAM_TYPES: Dict[str, Any] = {
+    "escapeMarkdown": bool,
+    "trim": bool,
+    "upper": bool,
+    "lower": bool,
+    "title": bool,
+    "lowerCamel": bool,
+    "upperCamel": bool,
+    "lowerSnake": bool,
+    "upperSnake": bool,
+    "truncate": int,
+    "stringify": bool,
+    "ci": bool,
+    "time": str,
+    "date": str,
+    "empty": str,
+    "unit": str,
+    "success": str,
+    "failure": str,
+    "fallback": str,
+    "replace": str,
+    "hl": bool,
+}
+
+VALUE_PARAM_DEFAULTS: Dict[str, Any] = {
+    "escapeMarkdown": False,
+    "trim": False,
+    "upper": False,
+    "lower": False,
+    "title": False,
+    "lowerCamel": False,
+    "upperCamel": False,
+    "lowerSnake": False,
+    "upperSnake": False,
+    "truncate": 0,
+    "stringify": False,
+    "ci": False,
+    "time": None,
+    "date": None,
+    "empty": None,
+    "unit": "ms",
+    "success": None,
+    "failure": None,
+    "fallback": None,
+    "replace": None,
+    "hl": True,
+}
+
+
+VALUE_MARKERS: Dict[str, str] = {PDL.VALUE_PREFIX: "val", PDL.LOOP_IDX: "idx", PDL.GET_PREFIX: "get"}
+
+
+class ValueFlags(Flags):
+    """Parameters of a `[value:…]` / `[get:…]` token; unknown keys such as `suffix` stay in `extra`."""
+
+    FIELDS = {key: key for key in VALUE_PARAM_TYPES}
+    __slots__ = tuple(FIELDS.values())
+
+
+@lru_cache(maxsize=PDL.PARSE_CACHE_SIZE)
+def parse_value_flags(raw: str) -> ValueFlags:
+    return ValueFlags(parse_kv_flags(raw, types=VALUE_PARAM_TYPES, defaults=VALUE_PARAM_DEFAULTS))
+
+
+def _find_value_split(s: str) -> int:
+    depth = 0
+    in_s = False
+    in_d = False
+    esc = False
+    for idx, ch in enumerate(s):
+        if esc:
+            esc = False
+            continue
+        if ch == "\\" and (in_s or in_d):
+            esc = True
+            continue
+        if ch == "'" and not in_d:
+            in_s = not in_s
+            continue
+        if ch == '"' and not in_s:
+            in_d = not in_d
+            continue
+        if not in_s and not in_d:
+            if ch == "[":
+                depth += 1
+            elif ch == "]" and depth > 0:
+                depth -= 1
+            elif depth == 0 and ch.isspace():
+                return idx
+    return -1
 
-    out = ""
+
+def scan_value_tokens(text: str) -> List[Any]:
+    """Split a line into literal text and `ValueToken`s."""
+    t = str(text or "")
+    lex = InlineLexer(t)
+    parts: List[Any] = []
     i = 0
     while i < len(t):
-        a_val = t.find(PDL.VALUE_PREFIX, i)
-        a_idx = t.find(PDL.LOOP_IDX, i)
-        a_get = t.find(PDL.GET_PREFIX, i)
-
-        candidates: List[Tuple[str, int]] = []
-        if a_val != -1:
-            candidates.append(("val", a_val))
-        if a_idx != -1:
-            candidates.append(("idx", a_idx))
-        if a_get != -1:
-            candidates.append(("get", a_get))
-
-        if not candidates:
-            out += t[i:]
+        a, marker = lex.first(VALUE_MARKERS, i)
+        if a == -1:
+            parts.append(t[i:])
             break
 
-        candidates.sort(key=lambda x: x[1])
-        kind, a = candidates[0]
-        out += t[i:a]
+        kind = VALUE_MARKERS[marker]
+        if a > i:
+            parts.append(t[i:a])
 
         if kind == "idx":
-            if not bump_exp(stats, 1):
-                out += t[a:]
-                break
-            out += format_index(scope.index_chain, scope.dots)
+            parts.append(ValueToken(kind, a, a + len(PDL.LOOP_IDX) - 1))
             i = a + len(PDL.LOOP_IDX)
             continue
 
-        p = a
-        depth = 0
-        end = -1
-        while p < len(t):
-            ch = t[p]
-            if ch == "[":
-                depth += 1
-            elif ch == "]":
-                depth -= 1
-                if depth == 0:
-                    end = p
-                    break
-            p += 1
+        end = lex.closing(a)
         if end == -1:
-            out += t[a:]
+            parts.append(t[a:])
             break
 
-        prefix_len = len(PDL.VALUE_PREFIX) if kind == "val" else len(PDL.GET_PREFIX)
-        inner_raw = t[a + prefix_len : end].strip()
-
-        def find_split(s: str) -> int:
-            depth = 0
-            in_s = False
-            in_d = False
-            esc = False
-            for idx, ch in enumerate(s):
-                if esc:
-                    esc = False
-                    continue
-                if ch == "\\" and (in_s or in_d):
-                    esc = True
-                    continue
-                if ch == "'" and not in_d:
-                    in_s = not in_s
-                    continue
-                if ch == '"' and not in_s:
-                    in_d = not in_d
-                    continue
-                if not in_s and not in_d:
-                    if ch == "[":
-                        depth += 1
-                    elif ch == "]" and depth > 0:
-                        depth -= 1
-                    elif depth == 0 and ch.isspace():
-                        return idx
-            return -1
+        inner_raw = t[a + len(marker) : end].strip()
 
-        split_idx = find_split(inner_raw)
+        split_idx = _find_value_split(inner_raw)
         head = inner_raw if split_idx == -1 else inner_raw[:split_idx].strip()
         params_raw = "" if split_idx == -1 else inner_raw[split_idx:].strip()
 
-        params = parse_kv_flags(
-            params_raw,
-            types={
-                "escapeMarkdown": bool,
-                "trim": bool,
-                "upper": bool,
-                "lower": bool,
-                "title": bool,
-                "lowerCamel": bool,
-                "upperCamel": bool,
-                "lowerSnake": bool,
-                "upperSnake": bool,
-                "truncate": int,
-                "stringify": bool,
-                "ci": bool,
-                "time": str,
-                "date": str,
-                "empty": str,
-                "unit": str,
-                "success": str,
-                "failure": str,
-                "fallback": str,
-                "replace": str,
-                "hl": bool,
-            },
-            defaults={
-                "escapeMarkdown": False,
-                "trim": False,
-                "upper": False,
-                "lower": False,
-                "title": False,
-                "lowerCamel": False,
-                "upperCamel": False,
-                "lowerSnake": False,
-                "upperSnake": False,
-                "truncate": 0,
-                "stringify": False,
-                "ci": False,
-                "time": None,
-                "date": None,
-                "empty": None,
-                "unit": "ms",
-                "success": None,
-                "failure": None,
-                "fallback": None,
-                "replace": None,
-                "hl": True,
-            },
-        )
+        parts.append(ValueToken(kind, a, end, head, params_raw, parse_value_flags(params_raw)))
+        i = end + 1
+    return parts
+
+
+def render_value_parts(parts: List[Any], text: str, scope: Scope, resolver: PathResolver, stats: RenderStats) -> str:
+    out: List[str] = []
+    for part in parts:
+        if isinstance(part, str):
+            out.append(part)
+            continue
 
         if not bump_exp(stats, 1):
-            out += t[a:]
+            out.append(text[part.start :])
             break
 
-        if kind == "val":
+        if part.kind == "idx":
+            out.append(format_index(scope.index_chain, scope.dots))
+            continue
+
+        rendered = _expand_value_token(part, scope, resolver, stats)
+        out.append(text[part.start : part.end + 1] if rendered is None else rendered)
+    return "".join(out)
+
+
+def has_value_tokens(text: str) -> bool:
+    return PDL.VALUE_PREFIX in text or PDL.LOOP_IDX in text or PDL.GET_PREFIX in text
+
+
+def expand_values_and_get_inline(text: str, scope: Scope, resolver: PathResolver, stats: RenderStats) -> str:
+    t = str(text or "")
+    if not has_value_tokens(t):
+        return t
+    # Lines built at render time carry data, so their scans are not cached;
+    # template lines are scanned once into `LineMeta.values` instead.
+    return render_value_parts(scan_value_tokens(t), t, scope, resolver, stats)
+
+
+class CorrelatedPath:
+    """A `[value:]` path whose one selector compares a key with a nested `[value:]`/`[get:]`."""
+
+    __slots__ = ("key", "kind", "inner", "template", "expr", "shortcut")
+
+    RE = re.compile(r"^(?P<arr>[A-Za-z_]\w*(?:\.[A-Za-z_]\w*)*)\[(?P<key>[A-Za-z_]\w*)=\[(?P<kind>value|get):(?P<inner>[^\[\]]+)\]\](?P<rest>(?:\.[A-Za-z_]\w*)*)$")
+    # Argument text containing any of these could change how the spliced path parses.
+    UNSAFE = frozenset('[]"\'|&<>=!^$*\n')
+
+    def __init__(self, m: "re.Match[str]") -> None:
+        arr, rest = m.group("arr"), m.group("rest")
+        self.key = m.group("key")
+        self.kind = m.group("kind")
+        self.inner = m.group("inner").strip()
+        self.template = f"{self.key}=_"
+        self.expr = compile_path(f"{arr}[{self.template}]{rest}")
+        parts = arr.split(".")
+        fields = rest[1:].split(".") if rest else []
+        # The `base.arr[k=v].field` shape also takes the text-comparison shortcut first.
+        self.shortcut = (parts[0], parts[1], fields[0]) if len(parts) == 2 and len(fields) == 1 else None
+
+    def argument(self, scope: Scope, resolver: PathResolver) -> str:
+        if self.kind == "value":
+            return nested_value_text(self.inner, scope, resolver)
+        return nested_get_text(self.inner, scope)
+
+    def binds(self, arg: str) -> bool:
+        """Whether splicing `arg` into the path leaves its structure unchanged."""
+        return bool(arg.strip()) and self.UNSAFE.isdisjoint(arg)
+
+    def resolve(self, arg: str, scope: Scope, resolver: PathResolver, ci: bool) -> Any:
+        if self.shortcut is not None:
+            base, arr_name, field = self.shortcut
+            found = _select_field_by_text(scope, resolver, base, arr_name, self.key, "=", arg.strip(), field, ci)
+            if found is not None:
+                return found
+        selector = Selector.equal_to(self.key, PathResolver._parse_value_token(arg))
+        expr = self.expr.bind(self.template, f"{self.key}={arg}", selector)
+        found = resolver.resolve_expr(expr, scope, default_ci=ci)
+        if found is None:
+            alt_arr = resolver.resolve_expr_all(expr, scope, default_ci=ci)
+            if isinstance(alt_arr, list) and alt_arr:
+                found = alt_arr[0]
+        return found
+
+
+@lru_cache(maxsize=PDL.PARSE_CACHE_SIZE)
+def compile_correlated(head: str) -> Optional[CorrelatedPath]:
+    m = CorrelatedPath.RE.match(head)
+    return CorrelatedPath(m) if m else None
+
+
+def _select_field_by_text(scope: Scope, resolver: PathResolver, base: str, arr_name: str, k: str, op: str, rhs: str, field: str, ci: bool) -> Any:
+    """`base.arr_name[k <op> rhs].field` with text-only comparison; None when nothing matches."""
+    base_obj = (
+        scope.aliases.get(base)
+        if base in scope.aliases
+        else scope.root.get(base) if isinstance(scope.root, dict) and base in scope.root else None
+    )
+    if not isinstance(base_obj, dict):
+        return None
+    arr = base_obj.get(arr_name)
+    if not isinstance(arr, list):
+        return None
+
+    def cmp(L, R):
+        if ci and isinstance(L, str) and isinstance(R, str):
+            L = L.lower()
+            R = R.lower()
+        if op == "=":
+            return L == R
+        if op == "^=":
+            return isinstance(L, str) and L.startswith(R)
+        if op == "$=":
+            return isinstance(L, str) and L.endswith(R)
+        if op == "*=":
+            return isinstance(L, str) and R in L
+        return False
+
+    if op == "=" and len(arr) >= PDL.INDEX_MIN_ITEMS:
+        # Only string values can equal the (string) right-hand side.
+        R = normalize_str(rhs)
+        for i in resolver.equality_index(arr, k, ci).text_hits(R.lower() if ci else R):
+            if field in arr[i]:
+                return arr[i][field]
+        return None
+    for it in arr:
+        if isinstance(it, dict) and k in it:
+            L = normalize_str(it[k])
+            R = normalize_str(rhs)
+            if cmp(L, R) and field in it:
+                return it[field]
+    return None
+
+
+# `base.arr[key <op> rhs].field`, answered by `_select_field_by_text` before the general resolver.
+FIELD_BY_TEXT_RE = re.compile(r"^([A-Za-z_]\w*)\.([A-Za-z_]\w*)\[(.+)\]\.([A-Za-z_]\w*)$")
+TEXT_CLAUSE_RE = re.compile(r"^([A-Za-z_]\w*)\s*(<|<=|>|>=|=|\^=|\$=|\*=)\s*(.+)$")
+
+
+def _expand_value_token(tok: ValueToken, scope: Scope, resolver: PathResolver, stats: RenderStats) -> Optional[str]:
+    """Resolve and format one value/get token; None leaves the token verbatim."""
+    kind = tok.kind
+    head = tok.head
+    params = tok.params
+
+    if kind == "val":
+        batch = scope.batch
+        if batch is not None:
+            column = batch.column(tok, resolver)
+            if column is not None:
+                text, errors = column[scope.row]
+                stats.errors_parse += errors
+                return text
+        corr = compile_correlated(head) if "[" in head else None
+        if corr is not None:
+            arg = corr.argument(scope, resolver)
+            if corr.binds(arg):
+                original = corr.resolve(arg, scope, resolver, bool(params.ci))
+            else:
+                corr = None
+        if corr is None:
             resolved_path = resolve_nested_in_expr(head, scope, resolver)
             original = None
 
             if original is None and isinstance(resolved_path, str):
                 path_str = resolved_path.strip()
-                m = re.match(r"^([A-Za-z_]\w*)\.([A-Za-z_]\w*)\[(.+)\]\.([A-Za-z_]\w*)$", path_str)
+                m = FIELD_BY_TEXT_RE.match(path_str)
                 if m:
-                    base_obj = (
-                        scope.aliases.get(m.group(1))
-                        if m.group(1) in scope.aliases
-                        else scope.root.get(m.group(1)) if isinstance(scope.root, dict) and m.group(1) in scope.root else None
-                    )
-                    if isinstance(base_obj, dict):
-                        arr = base_obj.get(m.group(2))
-                        if isinstance(arr, list):
-                            sel = m.group(3).strip()
-                            key = m.group(4)
-                            ci = bool(params.get("ci"))
-                            op_match = re.match(r"^([A-Za-z_]\w*)\s*(<|<=|>|>=|=|\^=|\$=|\*=)\s*(.+)$", sel)
-                            if op_match:
-                                k = op_match.group(1)
-                                op = op_match.group(2)
-                                rhs = op_match.group(3).strip()
-                                if (rhs.startswith('"') and rhs.endswith('"')) or (rhs.startswith("'") and rhs.endswith("'")):
-                                    rhs = rhs[1:-1]
-
-                                def cmp(L, R):
-                                    if ci and isinstance(L, str) and isinstance(R, str):
-                                        L = L.lower()
-                                        R = R.lower()
-                                    if op == "=":
-                                        return L == R
-                                    if op == "^=":
-                                        return isinstance(L, str) and L.startswith(R)
-                                    if op == "$=":
-                                        return isinstance(L, str) and L.endswith(R)
-                                    if op == "*=":
-                                        return isinstance(L, str) and R in L
-                                    return False
-
-                                for it in arr:
-                                    if isinstance(it, dict) and k in it:
-                                        L = normalize_str(it[k])
-                                        R = normalize_str(rhs)
-                                        if cmp(L, R) and key in it:
-                                            original = it[key]
-                                            break
+                    sel = m.group(3).strip()
+                    op_match = TEXT_CLAUSE_RE.match(sel)
+                    if op_match:
+                        rhs = op_match.group(3).strip()
+                        if (rhs.startswith('"') and rhs.endswith('"')) or (rhs.startswith("'") and rhs.endswith("'")):
+                            rhs = rhs[1:-1]
+                        original = _select_field_by_text(
+                            scope, resolver, m.group(1), m.group(2), op_match.group(1), op_match.group(2), rhs, m.group(4), bool(params.ci)
+                        )
 
             if original is None:
-                original = resolver.resolve_scoped(resolved_path, scope, default_ci=bool(params.get("ci")))
+                original = resolver.resolve_scoped(resolved_path, scope, default_ci=bool(params.ci))
                 if original is None and isinstance(resolved_path, str) and "[" in resolved_path:
-                    alt_arr = resolver.resolve_for_loop(resolved_path, scope, default_ci=bool(params.get("ci")))
+                    alt_arr = resolver.resolve_for_loop(resolved_path, scope, default_ci=bool(params.ci))
                     if isinstance(alt_arr, list) and alt_arr:
                         original = alt_arr[0]
-        else:
-            name = head
-            original = scope.get_var_value(name) if VAR_NAME_RE.match(str(name or "")) else None
+    else:
+        name = head
+        original = scope.get_var_value(name) if VAR_NAME_RE.match(str(name or "")) else None
 
-        value_out = original
-        resolved = value_out is not None
+    value_out = original
+    resolved = value_out is not None
 
-        if re.search(r"\bdefault\s*=", params_raw):
-            stats.errors_parse += 1
+    stats.errors_parse += tok.filter.default_errors
 
-        if not resolved and params.get("fallback"):
-            def_expr = strip_outer_quotes(params.get("fallback"))
-            def_path = resolve_nested_in_expr(def_expr, scope, resolver)
-            def_resolved = resolver.resolve_scoped(def_path, scope, default_ci=bool(params.get("ci")))
-            if def_resolved is not None:
-                value_out = def_resolved
-                resolved = True
-
-        if not resolved:
-            if params.get("failure"):
-                value_out = params.get("failure")
-            else:
-                out += t[a : end + 1]
-                i = end + 1
-                continue
-        elif isinstance(value_out, str) and value_out == "":
-            value_out = params.get("empty", "") if params.get("empty") is not None else ""
+    if not resolved and params.fallback:
+        def_expr = strip_outer_quotes(params.fallback)
+        def_path = resolve_nested_in_expr(def_expr, scope, resolver)
+        def_resolved = resolver.resolve_scoped(def_path, scope, default_ci=bool(params.ci))
+        if def_resolved is not None:
+            value_out = def_resolved
+            resolved = True
+
+    highlight = scope.highlight if hasattr(scope, "highlight") else getattr(resolver, "highlight", None) or {}
+    return format_value(value_out, resolved, tok.filter, highlight, stats)
+
+
+def format_value(value_out: Any, resolved: bool, vf: "ValueFilter", highlight: Dict[str, Any], stats: RenderStats) -> Optional[str]:
+    """Apply a value token's presence, date/time, text and highlight flags; None leaves the token verbatim."""
+    params = vf.params
+    if not resolved:
+        if params.failure:
+            value_out = params.failure
         else:
-            if params.get("success") is not None:
-                value_out = params.get("success")
+            return None
+    elif isinstance(value_out, str) and value_out == "":
+        value_out = params.empty if params.empty is not None else ""
+    else:
+        if params.success is not None:
+            value_out = params.success
 
-        if re.search(r"\bformat\s*=", params_raw):
-            stats.errors_parse += 1
+    stats.errors_parse += vf.format_errors
 
-        has_date = params.get("date") not in (None, "")
-        has_time = params.get("time") not in (None, "")
-        if has_date and has_time:
+    if vf.date is not None and vf.time is not None:
+        stats.errors_parse += 1
+        value_out = PDL.INVALID_TIME_DEFAULT
+    elif vf.date is not None:
+        value_out, errors = format_date(value_out, vf.date)
+        stats.errors_parse += errors
+    elif vf.time is not None:
+        num_ms = duration_ms(value_out, params)
+        if num_ms is None:
             stats.errors_parse += 1
-            value_out = PDL.INVALID_TIME_DEFAULT
-        elif has_date:
-            ms, bad = parse_date_input(value_out)
-            if ms is None or bad:
-                stats.errors_parse += 1
-                value_out = PDL.INVALID_DATE_DEFAULT
-            else:
-                comp = components_from_date_ms(ms, PDL.DATE_TZ)
-                value_out = render_tokens(str(params.get("date")), comp, "date")
-        elif has_time:
-            empty_time = params.get("empty")
-            if empty_time in (None, ""):
-                empty_time = PDL.INVALID_TIME_DEFAULT
-            unit = str(params.get("unit", "ms")).strip().lower()
-            num = coerce_number(value_out)
-            if num is None:
-                stats.errors_parse += 1
-                value_out = str(empty_time)
-            else:
-                num_ms = float(num)
-                if unit == "ms":
-                    pass
-                elif unit == "s":
-                    num_ms *= 1000
-                elif unit == "m":
-                    num_ms *= 60000
-                elif unit == "h":
-                    num_ms *= 3600000
-                elif unit == "d":
-                    num_ms *= 86400000
-                else:
-                    stats.errors_parse += 1
-                    num_ms = None
-                    value_out = str(empty_time)
-
-                if num_ms is not None:
-                    comp = break_down_duration(num_ms)
-                    fmt = str(params.get("time"))
-                    cleaned = str(fmt or "")
-                    has_letters_outside_tokens = bool(re.search(r"[A-Za-z]", re.sub(r"%[YymdHMSL]", "", cleaned)))
-                    if not has_letters_outside_tokens:
-                        order = ["Y", "m", "d", "H", "M", "S", "L"]
-                        words = {"Y": "year", "m": "month", "d": "day", "H": "hour", "M": "minute", "S": "second", "L": "millisecond"}
-                        seq = [(tok, comp[tok]) for tok in order]
-                        first = next((idx for idx, (_, val) in enumerate(seq) if val != 0), -1)
-                        last = next((idx for idx in range(len(seq) - 1, -1, -1) if seq[idx][1] != 0), -1)
-                        if first == -1 or last == -1:
-                            value_out = "0 seconds"
-                        else:
-                            parts = [f"{val} {plural(val, words[tok])}" for tok, val in seq[first : last + 1]]
-                            value_out = " ".join(parts)
-                    else:
-                        value_out = render_tokens(fmt, comp, "duration")
-
-        if isinstance(value_out, str):
-            if params.get("replace"):
-                value_out = apply_replace(value_out, strip_outer_quotes(params.get("replace")))
-            if params.get("escapeMarkdown"):
-                value_out = markdown_escape(value_out)
-            if params.get("trim"):
-                value_out = value_out.strip()
-            value_out = apply_case_basic(value_out, upper=bool(params.get("upper")), lower=bool(params.get("lower")), title=bool(params.get("title")))
-            if params.get("lowerCamel"):
-                value_out = camel_case(value_out, False)
-            if params.get("upperCamel"):
-                value_out = camel_case(value_out, True)
-            if params.get("lowerSnake"):
-                value_out = snake_case(value_out, False)
-            if params.get("upperSnake"):
-                value_out = snake_case(value_out, True)
-            trunc = params.get("truncate")
-            if isinstance(trunc, int) and trunc > 0:
-                value_out = apply_truncate(value_out, trunc, params.get("suffix"))
-
-        text_out = to_render_text(value_out, bool(params.get("stringify")))
-        if text_out is None:
-            text_out = ""
-
-        text_out = wrap_highlight(text_out, scope.highlight if hasattr(scope, "highlight") else getattr(resolver, "highlight", None) or {}, params.get("hl", True))
-
-        out += text_out
-        i = end + 1
+            value_out = empty_time_text(params)
+        else:
+            value_out = format_duration(break_down_duration(num_ms), vf.time)
+
+    return vf.render(value_out, highlight)
+
+
+def format_date(value: Any, fmt: str) -> Tuple[str, int]:
+    """`value` formatted with a `date=` format, and the number of parse errors."""
+    ms, bad = parse_date_input(value)
+    if ms is None or bad:
+        return PDL.INVALID_DATE_DEFAULT, 1
+    return render_tokens(fmt, components_from_date_ms(ms, PDL.DATE_TZ), "date"), 0
+
+
+DURATION_UNITS_MS: Dict[str, int] = {"ms": 1, "s": 1000, "m": 60000, "h": 3600000, "d": 86400000}
+
+
+def empty_time_text(params: ValueFlags) -> str:
+    empty_time = params.empty
+    if empty_time in (None, ""):
+        empty_time = PDL.INVALID_TIME_DEFAULT
+    return str(empty_time)
+
+
+def duration_ms(value: Any, params: ValueFlags) -> Optional[float]:
+    """`value` in milliseconds for a `time=` token; None for a non-number or an unknown unit."""
+    unit = str(params.unit).strip().lower()
+    num = coerce_number(value)
+    if num is None:
+        return None
+    factor = DURATION_UNITS_MS.get(unit)
+    if factor is None:
+        return None
+    return float(num) * factor
+
+
+DURATION_ORDER = ("Y", "m", "d", "H", "M", "S", "L")
+DURATION_WORDS = {"Y": "year", "m": "month", "d": "day", "H": "hour", "M": "minute", "S": "second", "L": "millisecond"}
+
+
+@lru_cache(maxsize=PDL.PARSE_CACHE_SIZE)
+def duration_in_words(fmt: str) -> bool:
+    """Whether a `time=` format is only tokens, which spells the duration out in words."""
+    return not re.search(r"[A-Za-z]", re.sub(r"%[YymdHMSL]", "", fmt))
+
+
+def format_duration(comp: Dict[str, int], fmt: str) -> str:
+    if not duration_in_words(fmt):
+        return render_tokens(fmt, comp, "duration")
+    seq = [(tok, comp[tok]) for tok in DURATION_ORDER]
+    first = next((idx for idx, (_, val) in enumerate(seq) if val != 0), -1)
+    last = next((idx for idx in range(len(seq) - 1, -1, -1) if seq[idx][1] != 0), -1)
+    if first == -1 or last == -1:
+        return "0 seconds"
+    return " ".join(f"{val} {plural(val, DURATION_WORDS[tok])}" for tok, val in seq[first : last + 1])
+
+
+def _fused(steps: List[Callable[[str], str]]) -> Optional[Callable[[str], str]]:
+    if not steps:
+        return None
+    if len(steps) == 1:
+        return steps[0]
+
+    def run(value: str) -> str:
+        for step in steps:
+            value = step(value)
+        return value
+
+    return run
+
+
+DEFAULT_FLAG_RE = re.compile(r"\bdefault\s*=")
+FORMAT_FLAG_RE = re.compile(r"\bformat\s*=")
+
+
+class ValueFilter:
+    """A value token's flags, compiled once per parameter text."""
+
+    __slots__ = ("params", "default_errors", "format_errors", "date", "time", "text", "stringify", "hl")
+
+    def __init__(self, params_raw: str) -> None:
+        params = self.params = parse_value_flags(params_raw)
+        self.default_errors = 1 if DEFAULT_FLAG_RE.search(params_raw) else 0
+        self.format_errors = 1 if FORMAT_FLAG_RE.search(params_raw) else 0
+        self.date = None if params.date in (None, "") else str(params.date)
+        self.time = None if params.time in (None, "") else str(params.time)
+        self.text = _fused(self.text_steps(params))
+        self.stringify = bool(params.stringify)
+        self.hl = params.hl
 
+    @staticmethod
+    def text_steps(params: ValueFlags) -> List[Callable[[str], str]]:
+        steps: List[Callable[[str], str]] = []
+        if params.replace:
+            replace = compile_replace(strip_outer_quotes(params.replace))
+            if replace is not _unchanged:
+                steps.append(replace)
+        if params.escapeMarkdown:
+            steps.append(lambda s: s.translate(MARKDOWN_ESCAPES))
+        if params.trim:
+            steps.append(str.strip)
+        if params.title:
+            steps.append(title_case)
+        elif params.upper:
+            steps.append(str.upper)
+        elif params.lower:
+            steps.append(str.lower)
+        if params.lowerCamel:
+            steps.append(lambda s: camel_case(s, False))
+        if params.upperCamel:
+            steps.append(lambda s: camel_case(s, True))
+        if params.lowerSnake:
+            steps.append(lambda s: snake_case(s, False))
+        if params.upperSnake:
+            steps.append(lambda s: snake_case(s, True))
+        trunc = params.truncate
+        if isinstance(trunc, int) and trunc > 0:
+            suffix = params.extra.get("suffix")
+            steps.append(lambda s: apply_truncate(s, trunc, suffix))
+        return steps
+
+    def render(self, value: Any, highlight: Dict[str, Any]) -> str:
+        """The output text for a formatted value: text steps, then stringify and highlight."""
+        if self.text is not None and isinstance(value, str):
+            value = self.text(value)
+        text = to_render_text(value, self.stringify)
+        return wrap_highlight("" if text is None else text, highlight, self.hl)
+
+
+@lru_cache(maxsize=PDL.PARSE_CACHE_SIZE)
+def compile_value_filter(params_raw: str) -> ValueFilter:
+    return ValueFilter(params_raw)
+
+
+DURATION_KEYS = ("Y", "y", "m", "d", "H", "M", "S", "L")
+
+
+@lru_cache(maxsize=None)
+def load_numpy() -> Any:
+    try:
+        import numpy
+    except ImportError:  # pragma: no cover - depends on the environment
+        return None
+    return numpy
+
+
+def break_down_durations(values: List[float]) -> List[Dict[str, int]]:
+    """`break_down_duration` over a column, vectorized with NumPy when it is installed."""
+    np = load_numpy() if PDL.BATCH_NUMPY else None
+    if np is None:
+        return [break_down_duration(v) for v in values]
+    arr = np.asarray(values, dtype=np.float64)
+    # Non-finite, negative and huge values keep the scalar path.
+    fast = np.isfinite(arr) & (arr >= 0) & (arr < 2.0**62)
+    total = np.trunc(np.where(fast, arr, 0.0)).astype(np.int64)
+    total, ms = np.divmod(total, 1000)
+    total, sec = np.divmod(total, 60)
+    total, minute = np.divmod(total, 60)
+    days, hour = np.divmod(total, 24)
+    months, day = np.divmod(days, 30)
+    year, month = np.divmod(months, 12)
+    rows = zip(*(c.tolist() for c in (year, year % 100, month, day, hour, minute, sec, ms)))
+    return [dict(zip(DURATION_KEYS, row)) if ok else break_down_duration(v) for ok, row, v in zip(fast.tolist(), rows, values)]
+
+
+def _distinct(values: List[Any], fn: Callable[[Any], Any]) -> List[Any]:
+    """`fn` over `values`, computed once per distinct hashable value."""
+    seen: Dict[Tuple[type, Any], Any] = {}
+    out = []
+    for v in values:
+        try:
+            key = (type(v), v)
+            r = seen[key] if key in seen else seen.setdefault(key, fn(v))
+        except TypeError:
+            r = fn(v)
+        out.append(r)
     return out
 
 
+def format_column(values: List[Any], vf: ValueFilter, highlight: Dict[str, Any]) -> List[Tuple[Optional[str], int]]:
+    """`format_value` for a column of resolved values: `(text or None, parse errors)` per row."""
+    params = vf.params
+    n = len(values)
+    errors = [vf.default_errors] * n
+    late = vf.format_errors
+    live = []
+    outs: List[Any] = [None] * n
+    for k, v in enumerate(values):
+        if v is None:
+            if not params.failure:
+                continue
+            v = params.failure
+        elif isinstance(v, str) and v == "":
+            v = params.empty if params.empty is not None else ""
+        elif params.success is not None:
+            v = params.success
+        errors[k] += late
+        outs[k] = v
+        live.append(k)
+
+    if vf.date is not None and vf.time is not None:
+        for k in live:
+            errors[k] += 1
+            outs[k] = PDL.INVALID_TIME_DEFAULT
+    elif vf.date is not None:
+        fmt = vf.date
+        dated = _distinct([outs[k] for k in live], lambda v: format_date(v, fmt))
+        for k, (text, bad) in zip(live, dated):
+            outs[k] = text
+            errors[k] += bad
+    elif vf.time is not None:
+        fmt = vf.time
+        nums = [duration_ms(outs[k], params) for k in live]
+        good = [k for k, num in zip(live, nums) if num is not None]
+        for k, num in zip(live, nums):
+            if num is None:
+                errors[k] += 1
+                outs[k] = empty_time_text(params)
+        comps = break_down_durations([num for num in nums if num is not None])
+        texts = _distinct([tuple(comp.values()) for comp in comps], lambda key: format_duration(dict(zip(DURATION_KEYS, key)), fmt))
+        for k, text in zip(good, texts):
+            outs[k] = text
+
+    texts = _distinct([outs[k] for k in live], lambda v: vf.render(v, highlight))
+    rows: List[Tuple[Optional[str], int]] = [(None, e) for e in errors]
+    for k, text in zip(live, texts):
+        rows[k] = (text, errors[k])
+    return rows
+
+
+# Flags whose work is worth doing a column at a time.
+COLUMN_FLAGS = ("date", "time", "replace", "escapeMarkdown", "trim", "upper", "lower", "title", "lowerCamel", "upperCamel", "lowerSnake", "upperSnake", "truncate")
+
+
+@lru_cache(maxsize=PDL.PARSE_CACHE_SIZE)
+def column_tokens(texts: Tuple[str, ...], alias: str) -> FrozenSet[Tuple[str, str]]:
+    """`(head, params)` of the value tokens in a loop body that can be formatted as columns."""
+    if not alias:
+        return frozenset()
+    sets_alias = re.compile(re.escape(PDL.SET_PREFIX) + r"\s*" + re.escape(alias) + r"(?![A-Za-z0-9_])")
+    head_re = re.compile(re.escape(alias) + r"(?:\.[A-Za-z_]\w*)*")
+    out = set()
+    for text in texts:
+        if sets_alias.search(text):
+            return frozenset()
+        if PDL.VALUE_PREFIX not in text:
+            continue
+        for part in scan_value_tokens(text):
+            if isinstance(part, str) or part.kind != "val" or not head_re.fullmatch(part.head):
+                continue
+            params = part.params
+            if not params.fallback and any(getattr(params, flag) for flag in COLUMN_FLAGS):
+                out.add((part.head, part.params_raw))
+    return frozenset(out)
+
+
+class ColumnBatch:
+    """Formatted loop fields, computed a column at a time."""
+
+    __slots__ = ("scope", "params", "items", "tokens", "columns")
+
+    def __init__(self, scope: Scope, params: LoopFlags, items: List[Any], tokens: FrozenSet[Tuple[str, str]]) -> None:
+        self.scope = scope
+        self.params = params
+        self.items = items
+        self.tokens = tokens
+        self.columns: Dict[Tuple[str, str], List[Tuple[Optional[str], int]]] = {}
+
+    @classmethod
+    def plan(cls, scope: Scope, params: LoopFlags, items: List[Any], tokens: FrozenSet[Tuple[str, str]]) -> Optional["ColumnBatch"]:
+        if not tokens or len(items) < PDL.BATCH_MIN_ITEMS:
+            return None
+        if scope.get_var_binding(params.as_)[0] is not None:
+            return None
+        return cls(scope, params, items, tokens)
+
+    def column(self, tok: ValueToken, resolver: PathResolver) -> Optional[List[Tuple[Optional[str], int]]]:
+        key = (tok.head, tok.params_raw)
+        col = self.columns.get(key)
+        if col is None:
+            if key not in self.tokens:
+                return None
+            expr = compile_path(tok.head)
+            ci = bool(tok.params.ci)
+            scope, alias = self.scope, self.params.as_
+            values = [resolver.resolve_expr(expr, scope.child(alias=alias, item=item), default_ci=ci) for item in self.items]
+            try:
+                col = format_column(values, tok.filter, scope.highlight)
+            except (ValueError, OverflowError, OSError):
+                # A value that fails to format (e.g. a date out of range) must only fail the rows that render it.
+                col = []
+            self.columns[key] = col
+        return col or None
+
+
 # ================================================================
 # 7) Engine (block directives + inline pipeline)
 # ================================================================
 
 
+IF_BLOCK_RE = re.compile(r"^\s*\[if:(.+)\]\s*$")
+ELIF_BLOCK_RE = re.compile(r"^\s*\[if-elif:(.+)\]\s*$")
+ELSE_BLOCK_RE = re.compile(r"^\s*\[if-else\]\s*$")
+IF_END_BLOCK_RE = re.compile(r"^\s*\[if-end\]\s*$")
+LOOP_BLOCK_RE = re.compile(r"^\s*\[loop:(.+)\]\s*$")
+LOOP_END_BLOCK_RE = re.compile(r"^\s*\[loop-end\]\s*$")
+
+# Structural marks of a (normalized) line, as seen by the block directives.
+MARK_IF = 1
+MARK_ELIF = 2
+MARK_ELSE = 4
+MARK_IF_END = 8
+MARK_LOOP = 16
+MARK_LOOP_END = 32
+MARK_LOOP_BLOCK = 64  # MARK_LOOP without a `[loop-end]` on the same line
+
+# What `Engine.expand_lines` has to do for a line, decided when it is parsed.
+STEP_TEXT = 0  # static text: no directives, no structural marks
+STEP_BLANK = 1  # whitespace only
+STEP_DYNAMIC = 2  # blocks, inline ifs and inline directives
+
+# How `InlineIfHelper.apply` treats a line.
+INLINE_IF_NONE = 0  # no `[if:` at all: line is returned unchanged
+INLINE_IF_UNCLOSED = 1  # `[if:` without a later `[if-end]`: unchanged, one inline issue
+INLINE_IF_FULL = 2  # a real inline if: result depends on the scope
+
+
+def line_marks(s: str) -> int:
+    if "[" not in s:
+        return 0
+    marks = 0
+    if IF_BLOCK_RE.match(s):
+        marks |= MARK_IF
+    if ELIF_BLOCK_RE.match(s):
+        marks |= MARK_ELIF
+    if ELSE_BLOCK_RE.match(s):
+        marks |= MARK_ELSE
+    if IF_END_BLOCK_RE.match(s):
+        marks |= MARK_IF_END
+    if LOOP_BLOCK_RE.match(s):
+        marks |= MARK_LOOP
+        if PDL.LOOP_END not in s:
+            marks |= MARK_LOOP_BLOCK
+    if LOOP_END_BLOCK_RE.match(s):
+        marks |= MARK_LOOP_END
+    return marks
+
+
 class IfBlockDirective:
-    def __init__(self) -> None:
-        self._IF = re.compile(r"^\s*\[if:(.+)\]\s*$")
-        self._ELIF = re.compile(r"^\s*\[if-elif:(.+)\]\s*$")
-        self._ELSE = re.compile(r"^\s*\[if-else\]\s*$")
-        self._END = re.compile(r"^\s*\[if-end\]\s*$")
+    __slots__ = ()
+
+    MARK = MARK_IF
+
+    _IF = IF_BLOCK_RE
+    _ELIF = ELIF_BLOCK_RE
+    _ELSE = ELSE_BLOCK_RE
+    _END = IF_END_BLOCK_RE
 
     def match(self, line: str) -> bool:
         return bool(self._IF.match(line))
 
+    @staticmethod
+    def test(engine: "Engine", scope: Scope, expr: str) -> bool:
+        """Evaluate one branch condition and count it in the stats."""
+        m = re.search(r"\sci=(true|false)\s*$", str(expr), re.IGNORECASE)
+        ci = bool(m and m.group(1).lower() == "true")
+        core = str(expr)[: m.start()].rstrip() if m else str(expr)
+        core2 = resolve_nested_in_expr(core, scope, engine.resolver)
+        if engine.resolver.eval_condition(core2, scope, default_ci=ci):
+            engine.stats.conds_true += 1
+            return True
+        engine.stats.conds_false += 1
+        return False
+
+    @staticmethod
+    def branch_scope(scope: Scope) -> Scope:
+        return scope.child()
+
     def expand(self, engine: "Engine", lines: List[str], i: int, scope: Scope, depth: int) -> Tuple[List[str], int]:
+        info = lines.block(i) if lines.meta(i).inline_if != INLINE_IF_FULL else None
+        if info is not None:
+            engine.replay_scan(lines, info, scope)
+            branches = [(cond, lines.window(start, stop)) for cond, start, stop in info.branches]
+            j = info.end - lines.start
+        else:
+            branches, j = self.scan(engine, lines, i, scope)
+
+        chosen: TemplateLines = lines[0:0]
+        for cond, block in branches:
+            if cond is None or IfBlockDirective.test(engine, scope, cond):
+                chosen = block
+                break
+
+        emitted_raw = engine.expand_lines(chosen, IfBlockDirective.branch_scope(scope), depth + 1)
+
+        indent_before = _count_indent(lines[i])
+        emitted = _apply_block_deindent(emitted_raw, indent_before)
+
+        if not emitted and j < len(lines):
+            probe, _ = engine.scan_line(lines, j, scope)
+            if probe.strip() == "":
+                return emitted, j + 1
+
+        return emitted, j
+
+    def scan(self, engine: "Engine", lines: TemplateLines, i: int, scope: Scope) -> Tuple[List[Tuple[Optional[str], TemplateLines]], int]:
+        """Find the branches of the block at `i` line by line, resolving inline ifs."""
         m_if = self._IF.match(lines[i])
         cond_root = m_if.group(1).strip() if m_if else ""
 
         depth_ctr = 1
         j = i + 1
-        branches: List[Tuple[Optional[str], List[str]]] = []
+        branches: List[Tuple[Optional[str], TemplateLines]] = []
         cur_cond = cond_root
-        cur_block: List[str] = []
         seen_else = False
 
+        block_start = j
         while j < len(lines):
-            l_raw = lines[j]
-            l_norm, _ = InlineIfHelper.apply(l_raw, scope, engine.resolver, engine.stats)
+            l_norm, marks = engine.scan_line(lines, j, scope)
 
-            if self._IF.match(l_norm):
+            if marks & MARK_IF:
                 depth_ctr += 1
-                cur_block.append(l_raw)
-            elif self._END.match(l_norm):
+            elif marks & MARK_IF_END:
                 depth_ctr -= 1
                 if depth_ctr == 0:
-                    branches.append((cur_cond, cur_block))
+                    branches.append((cur_cond, lines[block_start:j]))
                     j += 1
                     break
-                cur_block.append(l_raw)
-            elif depth_ctr == 1 and not seen_else and self._ELIF.match(l_norm):
+            elif depth_ctr == 1 and not seen_else and marks & MARK_ELIF:
                 m_elif = self._ELIF.match(l_norm)
-                branches.append((cur_cond, cur_block))
+                branches.append((cur_cond, lines[block_start:j]))
                 cur_cond = m_elif.group(1).strip() if m_elif else ""
-                cur_block = []
-            elif depth_ctr == 1 and not seen_else and self._ELSE.match(l_norm):
-                branches.append((cur_cond, cur_block))
+                block_start = j + 1
+            elif depth_ctr == 1 and not seen_else and marks & MARK_ELSE:
+                branches.append((cur_cond, lines[block_start:j]))
                 cur_cond = None
-                cur_block = []
+                block_start = j + 1
                 seen_else = True
-            else:
-                cur_block.append(l_raw)
             j += 1
+        return branches, j
 
-        def eval_cond(expr: Optional[str]) -> bool:
-            if expr is None:
-                return False
-            m = re.search(r"\sci=(true|false)\s*$", str(expr), re.IGNORECASE)
-            ci = bool(m and m.group(1).lower() == "true")
-            core = str(expr)[: m.start()].rstrip() if m else str(expr)
-            core2 = resolve_nested_in_expr(core, scope, engine.resolver)
-            return engine.resolver.eval_condition(core2, scope, default_ci=ci)
-
-        chosen: List[str] = []
-        triggered = False
-        for cond, block in branches:
-            if cond is None:
-                if not triggered:
-                    chosen = block
-                break
-            if eval_cond(cond):
-                engine.stats.conds_true += 1
-                chosen = block
-                triggered = True
-                break
-            else:
-                engine.stats.conds_false += 1
-
-        emitted_raw = engine.expand_lines(
-            chosen,
-            Scope(
-                root=scope.root,
-                aliases=scope.aliases,
-                index_chain=scope.index_chain,
-                dots=scope.dots,
-                var_frames=[*scope.var_frames, {}],
-                highlight=scope.highlight,
-            ),
-            depth + 1,
-        )
-
-        indent_before = _count_indent(lines[i])
-        emitted = _apply_block_deindent(emitted_raw, indent_before)
-
-        if not emitted and j < len(lines):
-            probe, _ = InlineIfHelper.apply(lines[j], scope, engine.resolver, engine.stats)
-            if probe.strip() == "":
-                return emitted, j + 1
 
-        return emitted, j
+class LoopBlockDirective:
+    __slots__ = ()
 
+    MARK = MARK_LOOP_BLOCK
 
-class LoopBlockDirective:
-    def __init__(self) -> None:
-        self._START = re.compile(r"^\s*\[loop:(.+)\]\s*$")
-        self._END = re.compile(r"^\s*\[loop-end\]\s*$")
+    _START = LOOP_BLOCK_RE
+    _END = LOOP_END_BLOCK_RE
 
     def match(self, line: str) -> bool:
         if PDL.LOOP_END in str(line):
             return False
         return bool(self._START.match(line))
 
-    def expand(self, engine: "Engine", lines: List[str], i: int, scope: Scope, depth: int) -> Tuple[List[str], int]:
-        m = self._START.match(lines[i])
-        raw = m.group(1) if m else ""
+    @staticmethod
+    def child_scope(scope: Scope, params: LoopFlags, k: int, item: Any, batch: Optional[ColumnBatch] = None) -> Scope:
+        child = scope.child(alias=params.as_, item=item, index=int(params.start) + k, dots=bool(params.dots))
+        if batch is not None:
+            child.batch = batch
+            child.row = k
+        return child
+
+    @staticmethod
+    def merge(iter_blocks: List[List[str]], params: LoopFlags, indent_before: int, next_is_blank: bool, halted: bool) -> List[str]:
+        """Combine the rendered iterations of a block loop into its output lines."""
+        if halted:
+            return Engine.coalesce_loop_blocks(iter_blocks)
 
-        params = parse_kv_flags(
-            raw,
-            first_positional="path",
-            types={"as": str, "start": int, "join": str, "empty": str, "dots": bool, "ci": bool},
-            defaults={"as": None, "start": 1, "join": None, "empty": None, "dots": True, "ci": False},
-        )
+        if params.join is not None:
+            joined_blocks = ["\n".join(b) for b in iter_blocks]
+            merged = str(params.join).join(joined_blocks).split("\n")
+        else:
+            merged = Engine.coalesce_loop_blocks(iter_blocks)
 
-        depth_ctr = 1
-        j = i + 1
-        while j < len(lines) and depth_ctr > 0:
-            ln = lines[j]
-            ln_norm, _ = InlineIfHelper.apply(ln, scope, engine.resolver, engine.stats)
-            if self._START.match(ln_norm):
-                depth_ctr += 1
-            elif self._END.match(ln_norm):
-                depth_ctr -= 1
-            j += 1
+        adjusted = _apply_block_deindent(merged, indent_before)
+
+        if next_is_blank:
+            while adjusted and adjusted[-1].strip() == "":
+                adjusted.pop()
+        return adjusted
+
+    def expand(self, engine: "Engine", lines: List[str], i: int, scope: Scope, depth: int) -> Tuple[List[str], int]:
+        meta = lines.meta(i)
+        params = meta.loop_params
+
+        info = lines.block(i) if meta.inline_if != INLINE_IF_FULL else None
+        if info is not None:
+            engine.replay_scan(lines, info, scope)
+            j = info.end - lines.start
+        else:
+            depth_ctr = 1
+            j = i + 1
+            while j < len(lines) and depth_ctr > 0:
+                _, marks = engine.scan_line(lines, j, scope)
+                if marks & MARK_LOOP:
+                    depth_ctr += 1
+                elif marks & MARK_LOOP_END:
+                    depth_ctr -= 1
+                j += 1
 
         body = lines[i + 1 : j - 1]
         indent_before = _count_indent(lines[i])
         engine.stats.loops += 1
 
-        arr = engine.resolver.resolve_for_loop(str(params.get("path", "")), scope, default_ci=bool(params.get("ci")))
+        arr = engine.resolver.resolve_for_loop(str(params.path), scope, default_ci=bool(params.ci))
 
         next_is_blank = False
         if j < len(lines):
-            probe, _ = InlineIfHelper.apply(lines[j], scope, engine.resolver, engine.stats)
+            probe, _ = engine.scan_line(lines, j, scope)
             next_is_blank = probe.strip() == ""
 
         if not isinstance(arr, list) or not arr:
-            if params.get("empty"):
-                return [str(params.get("empty"))], j
+            if params.empty:
+                return [str(params.empty)], j
             return [], j
 
+        batch = ColumnBatch.plan(scope, params, arr, info.column_tokens(lines.program, params.as_)) if info is not None else None
         iter_blocks: List[List[str]] = []
         for k, item in enumerate(arr):
             if not bump_exp(engine.stats, 1):
                 break
-            new_index = [*scope.index_chain, int(params.get("start", 1)) + k]
-            child_scope = Scope(
-                root=scope.root,
-                aliases={**scope.aliases, **({params.get("as"): item} if params.get("as") else {})},
-                index_chain=new_index,
-                dots=bool(params.get("dots", True)),
-                var_frames=[*scope.var_frames, {}],
-                highlight=scope.highlight,
-            )
+            child_scope = LoopBlockDirective.child_scope(scope, params, k, item, batch)
 
             sub_lines = engine.expand_lines(body, child_scope, depth + 1)
             resolved = [expand_values_and_get_inline(ln, child_scope, engine.resolver, engine.stats) for ln in sub_lines]
@@ -2047,33 +3206,45 @@ class LoopBlockDirective:
             if engine.stats.halted:
                 break
 
-        if engine.stats.halted:
-            merged = Engine.coalesce_loop_blocks(iter_blocks)
-            return merged, j
-
-        if params.get("join") is not None:
-            joined_blocks = ["\n".join(b) for b in iter_blocks]
-            merged = str(params.get("join")).join(joined_blocks).split("\n")
-        else:
-            merged = Engine.coalesce_loop_blocks(iter_blocks)
-
-        adjusted = _apply_block_deindent(merged, indent_before)
-
-        if next_is_blank:
-            while adjusted and adjusted[-1].strip() == "":
-                adjusted.pop()
-
-        return adjusted, j
+        return LoopBlockDirective.merge(iter_blocks, params, indent_before, next_is_blank, engine.stats.halted), j
 
 
 class Engine:
+    __slots__ = ("resolver", "stats", "highlight", "block_registry", "inline_registry")
+
     def __init__(self, *, highlight: Dict[str, Any] | None = None) -> None:
-        self.resolver = PathResolver()
         self.stats = RenderStats()
+        self.resolver = PathResolver(self.stats)
         self.highlight = highlight or {}
         self.block_registry = [LoopBlockDirective(), IfBlockDirective()]
         self.inline_registry = [InlineSetDirective(), InlineLoopExpander(), lambda line, s, r, st: expand_values_and_get_inline(line, s, r, st)]
 
+    def scan_line(self, lines: "TemplateLines", j: int, scope: Scope) -> Tuple[str, int]:
+        """Return line `j` after inline `[if:]` resolution and its structural marks."""
+        meta = lines.meta(j)
+        if meta.inline_if == INLINE_IF_FULL:
+            text, _ = InlineIfHelper.apply(meta.text, scope, self.resolver, self.stats)
+            return text, line_marks(text)
+        if meta.inline_if == INLINE_IF_UNCLOSED:
+            self.stats.errors_inline += 1
+        return meta.text, meta.marks
+
+    def replay_scan(self, lines: "TemplateLines", info: "BlockInfo", scope: Scope) -> None:
+        """Apply the stats side effects of scanning a block's lines with `scan_line`."""
+        if info.scan_unclosed:
+            self.stats.errors_inline += info.scan_unclosed
+        texts = lines.program.texts
+        for k in info.scan_inline:
+            InlineIfHelper.apply(texts[k], scope, self.resolver, self.stats)
+
+    def apply_inline(self, line: str, scope: Scope) -> str:
+        """Run the inline stages over one line, stopping once rendering halts."""
+        for inline in self.inline_registry:
+            line = inline.apply(line, scope, self.resolver, self.stats) if hasattr(inline, "apply") else inline(line, scope, self.resolver, self.stats)
+            if self.stats.halted:
+                break
+        return line
+
     def _check_limits(self, depth: int) -> bool:
         if self.stats.halted:
             return True
@@ -2124,7 +3295,18 @@ class Engine:
             out.extend(bb[k:])
         return out
 
-    def expand_lines(self, lines: List[str], scope: Scope, depth: int = 0) -> List[str]:
+    def expand_lines(self, lines: List[str] | "TemplateLines", scope: Scope, depth: int = 0) -> List[str]:
+        emitted: List[str] = []
+        for chunk, _ in self.iter_lines(lines, scope, depth):
+            emitted.extend(chunk)
+        return emitted
+
+    def iter_lines(self, lines: List[str] | "TemplateLines", scope: Scope, depth: int = 0) -> Iterator[Tuple[List[str], int]]:
+        """Expand `lines` like `expand_lines`, yielding the output and the next line to run as each block directive ends."""
+        if not isinstance(lines, TemplateLines):
+            lines = Program(list(lines)).lines()
+        metas = lines.program.metas
+        base = lines.start
         emitted: List[str] = []
         i = 0
         n = len(lines)
@@ -2136,15 +3318,41 @@ class Engine:
                 emitted.extend(lines[i:])
                 break
 
-            raw = lines[i]
-            line, drop = InlineIfHelper.apply(raw, scope, self.resolver, self.stats)
-            if drop:
+            meta = metas[base + i]
+            step = meta.step
+            if step == STEP_TEXT:
+                if meta.inline_if == INLINE_IF_UNCLOSED:
+                    self.stats.errors_inline += 1
+                emitted.append(meta.text)
+                previous_was_blank = False
+                skip_next_blank_after_empty_block = False
+                i += 1
+                continue
+            if step == STEP_BLANK:
+                if skip_next_blank_after_empty_block:
+                    skip_next_blank_after_empty_block = False
+                elif not previous_was_blank:
+                    emitted.append("")
+                    previous_was_blank = True
                 i += 1
                 continue
 
+            raw = meta.text
+            if meta.inline_if == INLINE_IF_FULL:
+                line, drop = InlineIfHelper.apply(raw, scope, self.resolver, self.stats)
+                if drop:
+                    i += 1
+                    continue
+                marks = line_marks(line)
+            else:
+                if meta.inline_if == INLINE_IF_UNCLOSED:
+                    self.stats.errors_inline += 1
+                line = raw
+                marks = meta.marks
+
             used_block = False
             for directive in self.block_registry:
-                if directive.match(line):
+                if marks & directive.MARK:
                     blk, new_i = directive.expand(self, lines, i, scope, depth)
                     emitted.extend(blk)
                     i = new_i
@@ -2157,6 +3365,8 @@ class Engine:
                         skip_next_blank_after_empty_block = True
                     if self.stats.halted:
                         emitted.extend(lines[i:])
+                    yield emitted, base + (n if self.stats.halted else i)
+                    emitted = []
                     break
             if self.stats.halted:
                 break
@@ -2164,19 +3374,27 @@ class Engine:
                 continue
 
             original_line = line
-            for inline in self.inline_registry:
-                line = inline.apply(line, scope, self.resolver, self.stats) if hasattr(inline, "apply") else inline(line, scope, self.resolver, self.stats)
+            if line is raw and meta.values is not None:
+                # Only value/get/index tokens: replay the pre-scanned parts.
+                line = render_value_parts(meta.values, raw, scope, self.resolver, self.stats)
+                if self.stats.halted:
+                    emitted.append(line)
+                    emitted.extend(lines[i + 1 :])
+                    yield emitted, base + n
+                    return
+            elif line is not raw or meta.inline:
+                line = self.apply_inline(line, scope)
                 if self.stats.halted:
                     emitted.append(line)
                     emitted.extend(lines[i + 1 :])
-                    return emitted
+                    yield emitted, base + n
+                    return
 
             only_spaces = line.strip() == ""
-            only_set = (
-                only_spaces
-                and "[set:" in original_line
-                and "[loop:" not in original_line
-                and "[if:" not in original_line
+            only_set = only_spaces and (
+                meta.only_set
+                if original_line is raw
+                else "[set:" in original_line and "[loop:" not in original_line and "[if:" not in original_line
             )
 
             if only_set:
@@ -2200,7 +3418,7 @@ class Engine:
 
             i += 1
 
-        return emitted
+        yield emitted, base + n
 
 
 # ================================================================
@@ -2209,20 +3427,41 @@ class Engine:
 
 
 class CondenseProcessor:
+    _TOKEN_RE = re.compile(re.escape(PDL.CONDENSE_START) + "|" + re.escape(PDL.CONDENSE_END))
+
+    # The whitespace runs the condense rules change: after "(" (with a comma
+    # between), holding anything but single spaces, or before ".,!?;" or ")".
+    _RUN_RE = re.compile(r"\((?:\s*,\s+|\s+)|[^\S ]\s*| \s+| (?=[.,!?;)])")
+
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def _normalize_run(ws: str) -> str:
+        ws = ws.replace("\r\n", " ").replace("\r", " ").replace("\n", " ")
+        return re.sub(r" {2,}", " ", ws)
+
+    @staticmethod
+    def _rewrite_run(m: "re.Match[str]") -> str:
+        run = m.group()
+        end = m.end()
+        follows = m.string[end : end + 1]
+        if run[0] != "(":
+            return "" if follows and follows in ".,!?;)" else CondenseProcessor._normalize_run(run)
+        comma = run.find(",")
+        if comma < 0:
+            return "("
+        if follows and follows in ".,!?;)":
+            return "(,"
+        # "(" and "," close up and "(, " then loses its comma and space.
+        ws = CondenseProcessor._normalize_run(run[comma + 1 :])
+        return "(" + ws[1:] if ws[0] == " " else "(," + ws
+
     @staticmethod
     def _apply_rules(s: str) -> str:
+        """Condense `s` in one pass over its whitespace runs."""
         if s is None:
             return ""
         x = str(s)
-        x = x.replace("\r\n", "\n").replace("\r", "\n")
-        x = x.replace("\n", " ")
-        x = re.sub(r" {2,}", " ", x)
-        x = re.sub(r"\s+([.,!?;])", r"\1", x)
-        x = re.sub(r"\(\s+", "(", x)
-        x = re.sub(r"\s+\)", ")", x)
-        x = x.replace("(, ", "(").replace(", )", ")")
-        x = x.replace("( ", "(").replace(" )", ")")
-        return x.strip()
+        return CondenseProcessor._RUN_RE.sub(CondenseProcessor._rewrite_run, x).strip()
 
     @staticmethod
     def apply_all(text: str) -> str:
@@ -2232,33 +3471,25 @@ class CondenseProcessor:
             return text
 
         s = str(text)
-        stack: List[int] = []
-        i = 0
-        while i < len(s):
-            a = s.find(start_tok, i)
-            b = s.find(end_tok, i)
-            if a == -1 and b == -1:
-                break
-            if a != -1 and (b == -1 or a < b):
-                stack.append(a)
-                i = a + len(start_tok)
-                continue
-            if b != -1:
-                if stack:
-                    start_idx = stack.pop()
-                    inner = s[start_idx + len(start_tok) : b]
-                    replaced = CondenseProcessor._apply_rules(inner)
-                    s = s[:start_idx] + replaced + s[b + len(end_tok) :]
-                    i = start_idx + len(replaced)
-                    continue
-                else:
-                    s = s[:b] + s[b + len(end_tok) :]
-                    i = b
-                    continue
-        while stack:
-            idx = stack.pop()
-            s = s[:idx] + s[idx + len(start_tok) :]
-        return s
+        # frames[0] is the output; each open [condense] collects its inner text
+        # in a frame of its own until the matching end token condenses it.
+        frames: List[List[str]] = [[]]
+        cursor = 0
+        for m in CondenseProcessor._TOKEN_RE.finditer(s):
+            frames[-1].append(s[cursor : m.start()])
+            cursor = m.end()
+            if m.group() == start_tok:
+                frames.append([])
+            elif len(frames) > 1:
+                inner = "".join(frames.pop())
+                frames[-1].append(CondenseProcessor._apply_rules(inner))
+            # an end token without a start is dropped
+        frames[-1].append(s[cursor:])
+        while len(frames) > 1:
+            # unmatched start tokens are dropped, their text kept as is
+            inner = "".join(frames.pop())
+            frames[-1].append(inner)
+        return "".join(frames[0])
 
 
 # ================================================================
@@ -2266,7 +3497,28 @@ class CondenseProcessor:
 # ================================================================
 
 
+FIRST_HEADER_RE = re.compile(r"^(#{1,6})[ \t]+.+$")
+FENCE_RE = re.compile(r"^(```|~~~)")
+HEADING_RE = re.compile(r"^(#{1,6})([ \t]+)(.*)$")
+
+
 class PostFormat:
+    @staticmethod
+    def collapse_blank_runs(text: str) -> str:
+        out: List[str] = []
+        prev_blank = False
+        for line in str(text).split("\n"):
+            is_blank = line.strip() == ""
+            if is_blank:
+                if prev_blank:
+                    continue
+                prev_blank = True
+                out.append("")
+            else:
+                prev_blank = False
+                out.append(line)
+        return "\n".join(out)
+
     @staticmethod
     def drop_first_header_line(text: str, enabled: bool) -> str:
         if not enabled:
@@ -2274,7 +3526,7 @@ class PostFormat:
         lines = str(text or "").split("\n")
         if not lines:
             return text
-        if re.match(r"^(#{1,6})[ \t]+.+$", lines[0]):
+        if FIRST_HEADER_RE.match(lines[0]):
             lines.pop(0)
             if lines and lines[0].strip() == "":
                 lines.pop(0)
@@ -2288,18 +3540,16 @@ class PostFormat:
 
         out: List[str] = []
         in_code = False
-        fence_re = re.compile(r"^(```|~~~)")
-        heading_re = re.compile(r"^(#{1,6})([ \t]+)(.*)$")
 
         for line in str(text or "").split("\n"):
-            if fence_re.match(line):
+            if FENCE_RE.match(line):
                 in_code = not in_code
                 out.append(line)
                 continue
             if in_code:
                 out.append(line)
                 continue
-            m = heading_re.match(line)
+            m = HEADING_RE.match(line)
             if not m:
                 out.append(line)
                 continue
@@ -2310,36 +3560,971 @@ class PostFormat:
         return "\n".join(out)
 
 
+class PostProcessor:
+    """The passes after expansion as one line-oriented state machine."""
+
+    __slots__ = ("head", "frames", "started", "prev_blank", "hl", "pending", "first_header", "pad", "in_code", "emitted")
+
+    def __init__(self, highlight: Dict[str, Any] | None, drop_first_header: bool, header_indentation: str) -> None:
+        self.head = ""  # the output line still open
+        self.frames: List[List[str]] = []  # inner text of each open [condense]
+        self.started = False
+        self.prev_blank = False
+        self.hl: Optional[HighlightHeuristics] = None
+        if highlight and highlight.get("enabled"):
+            self.hl = highlight_heuristics(str(highlight.get("before") or ""), str(highlight.get("after") or ""))
+        self.pending: List[str] = []  # lines held for rewrites that span lines
+        self.first_header = 1 if drop_first_header else 0  # 1: at the first line, 2: after a dropped header
+        self.pad = max(0, len(str(header_indentation or "#")) - 1)
+        self.in_code = False
+        self.emitted = False
+
+    def feed(self, lines: List[str]) -> str:
+        if not lines:
+            return ""
+        joined = "\n".join(lines)
+        done: List[str] = []
+        if self.frames or PDL.CONDENSE_START in joined or PDL.CONDENSE_END in joined:
+            self._condense("\n" + joined if self.started else joined, done)
+        else:
+            if self.started:
+                done.append(self.head)
+            done.extend(lines[:-1])
+            self.head = lines[-1]
+        self.started = True
+        return self._emit(self._finish(done))
+
+    def close(self) -> str:
+        done: List[str] = []
+        self._condense("", done, final=True)
+        out = self._finish(done)
+        if self.pending:
+            text = self.hl.apply(PostFormat.collapse_blank_runs("\n".join(self.pending)))
+            self.pending = []
+            out = self._finish(text.split("\n"), collapse=False)
+        return self._emit(out)
+
+    def _condense(self, text: str, done: List[str], final: bool = False) -> None:
+        """Run `text` through the condense frames, moving the lines it finishes to `done`."""
+        frames = self.frames
+        out = [self.head]
+        cursor = 0
+        for m in CondenseProcessor._TOKEN_RE.finditer(text):
+            (frames[-1] if frames else out).append(text[cursor : m.start()])
+            cursor = m.end()
+            if m.group() == PDL.CONDENSE_START:
+                frames.append([])
+            elif frames:
+                inner = CondenseProcessor._apply_rules("".join(frames.pop()))
+                (frames[-1] if frames else out).append(inner)
+            # an end token without a start is dropped
+        (frames[-1] if frames else out).append(text[cursor:])
+        while final and frames:
+            # unmatched start tokens are dropped, their text kept as is
+            inner = "".join(frames.pop())
+            (frames[-1] if frames else out).append(inner)
+        parts = "".join(out).split("\n")
+        self.head = parts.pop()
+        if final:
+            parts.append(self.head)
+            self.head = ""
+        done.extend(parts)
+
+    def _finish(self, lines: List[str], collapse: bool = True) -> List[str]:
+        hl = self.hl
+        if hl is not None and collapse and not hl.line_local:
+            # A marker with a line break: rewrite the whole text in `close`.
+            self.pending.extend(lines)
+            return []
+        rewrite = hl.apply if hl is not None and collapse else None
+        prev_blank = self.prev_blank
+        first_header = self.first_header
+        pad = self.pad
+        in_code = self.in_code
+        out: List[str] = []
+        for line in lines:
+            if collapse:
+                if line.strip():
+                    prev_blank = False
+                elif prev_blank:
+                    continue
+                else:
+                    prev_blank = True
+                    line = ""
+            if rewrite is not None and "\\" in line:
+                line = rewrite(line)
+            if first_header:
+                if first_header == 1 and FIRST_HEADER_RE.match(line):
+                    first_header = 2
+                    continue
+                drop = first_header == 2 and line.strip() == ""
+                first_header = 0
+                if drop:
+                    continue
+            if pad and line and line[0] in "#`~":
+                if line[0] != "#":
+                    if FENCE_RE.match(line):
+                        in_code = not in_code
+                elif not in_code:
+                    m = HEADING_RE.match(line)
+                    if m:
+                        line = "#" * min(6, len(m.group(1)) + pad) + " " + m.group(3).strip()
+            out.append(line)
+        self.prev_blank = prev_blank
+        self.first_header = first_header
+        self.in_code = in_code
+        return out
+
+    def _emit(self, out: List[str]) -> str:
+        if not out:
+            return ""
+        text = "\n".join(out)
+        if self.emitted:
+            text = "\n" + text
+        self.emitted = True
+        return text
+
+
 # ================================================================
 # 11) PDLParser
 # ================================================================
 
 
 class PDLParser:
-    def __init__(self, template: str, json_root: Any, *, aliases: Dict[str, Any] | None = None, variables: Dict[str, Any] | None = None, highlight: Dict[str, Any] | None = None) -> None:
+    def __init__(self, template: str, json_root: Any, *, aliases: Dict[str, Any] | None = None, variables: Dict[str, Any] | None = None, highlight: Dict[str, Any] | None = None, program: "Program" | None = None) -> None:
         self.template = template
         self.json_root = json_root
         self.aliases = aliases or {}
         self.variables = variables or {}
         self.stats = RenderStats()
         self.highlight = highlight or {}
+        self.program = program
 
-    def render(self) -> Tuple[str, RenderStats]:
-        stripped = CommentHandler.strip(self.template)
+    def start(self) -> Tuple["Program", Engine, Scope]:
+        program = self.program if self.program is not None else Program.from_text(CommentHandler.strip(self.template))
         engine = Engine(highlight=self.highlight)
         scope = Scope(root=self.json_root, aliases=self.aliases, index_chain=[], dots=True, highlight=self.highlight)
         if isinstance(self.variables, dict):
             for k, v in self.variables.items():
                 scope.set_var(k, v, const_flag=True)
+        return program, engine, scope
 
-        expanded_lines = engine.expand_lines(stripped.split("\n"), scope, 0)
-        expanded_lines = [expand_values_and_get_inline(line, scope, engine.resolver, engine.stats) for line in expanded_lines]
+    def expand(self) -> List[str]:
+        """Return the expanded lines, ahead of the condense pass."""
+        program, engine, scope = self.start()
+        self.stats = engine.stats
+        expanded_lines = program.expand(engine, scope)
+        return [expand_values_and_get_inline(line, scope, engine.resolver, engine.stats) for line in expanded_lines]
 
-        text = "\n".join(expanded_lines)
+    def render(self) -> Tuple[str, RenderStats]:
+        text = "\n".join(self.expand())
         text = CondenseProcessor.apply_all(text)
+        return text, self.stats
 
+    def iter_lines(self) -> Iterator[List[str]]:
+        """Yield the expanded lines block by block, ahead of the condense pass."""
+        program, engine, scope = self.start()
         self.stats = engine.stats
-        return text, self.stats
+        held: List[str] = []
+        for chunk, stop in program.iter_expand(engine, scope):
+            if held or any(map(has_value_tokens, chunk)):
+                # Tokens left after expansion resolve against the final
+                # variables, so they wait while a later `[set:]` can run.
+                held.extend(chunk)
+                if stop <= program.last_set:
+                    continue
+                chunk = [expand_values_and_get_inline(line, scope, engine.resolver, engine.stats) for line in held]
+                held = []
+            yield chunk
+
+
+# ================================================================
+# 12) Compiled templates
+# ================================================================
+
+
+class LineMeta:
+    """Data-independent facts about one template line, computed at parse time."""
+
+    __slots__ = ("text", "marks", "inline_if", "step", "only_set", "may_set", "inline", "values", "loop_params", "_inert")
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        first_if = text.find(PDL.IF_START)
+        if first_if == -1:
+            self.inline_if = INLINE_IF_NONE
+        elif text.find(PDL.IF_END, first_if) == -1:
+            self.inline_if = INLINE_IF_UNCLOSED
+        else:
+            self.inline_if = INLINE_IF_FULL
+        self.marks = line_marks(text)
+        self._inert: Optional[bool] = None
+
+        m = LOOP_BLOCK_RE.match(text) if self.marks & MARK_LOOP else None
+        self.loop_params = parse_loop_params(m.group(1) if m else "")
+
+        has_set = PDL.SET_PREFIX in text
+        has_loop = PDL.LOOP_START in text
+        has_values = PDL.VALUE_PREFIX in text or PDL.GET_PREFIX in text or PDL.LOOP_IDX in text
+        self.inline = has_set or has_loop or has_values
+        # Pre-scanned value tokens, valid while the line reaches the value
+        # stage unchanged (no set/loop stage in front of it rewrote it).
+        self.values = scan_value_tokens(text) if has_values and not has_set and not has_loop else None
+        self.only_set = has_set and PDL.LOOP_START not in text and PDL.IF_START not in text
+        # Inline ifs only drop text, so they can still join a `[set:` out of its letters.
+        rest = iter(text)
+        self.may_set = has_set or (self.inline_if == INLINE_IF_FULL and all(ch in rest for ch in PDL.SET_PREFIX))
+
+        if self.inline or self.marks or self.inline_if == INLINE_IF_FULL:
+            self.step = STEP_DYNAMIC
+        elif text.strip() == "":
+            self.step = STEP_BLANK
+        else:
+            self.step = STEP_TEXT
+
+    @property
+    def inert(self) -> bool:
+        """Whether no choice of inline-if branches can turn the line into a block marker."""
+        if self._inert is None:
+            self._inert = True
+            if self.inline_if == INLINE_IF_FULL and self.text.lstrip()[:1] == "[":
+                outcomes = InlineIfHelper.outcomes(self.text)
+                self._inert = outcomes is not None and not any(line_marks(out) for out, _ in outcomes)
+        return self._inert
+
+
+class BlockInfo:
+    """Shape of a block directive whose extent does not depend on data."""
+
+    __slots__ = ("kind", "end", "body", "branches", "scan_inline", "scan_unclosed", "columns")
+
+    def __init__(self, kind: str, end: int, branches: List[Tuple[Optional[str], int, int]], body: Tuple[int, int], scan_unclosed: int, scan_inline: Tuple[int, ...]) -> None:
+        self.kind = kind
+        self.end = end
+        self.branches = branches
+        self.body = body
+        self.scan_unclosed = scan_unclosed
+        self.scan_inline = scan_inline
+        self.columns: Optional[FrozenSet[Tuple[str, str]]] = None
+
+    def column_tokens(self, program: "Program", alias: str) -> FrozenSet[Tuple[str, str]]:
+        """The loop body's `column_tokens`, computed on first use."""
+        if self.columns is None:
+            start, stop = self.body
+            self.columns = column_tokens(tuple(program.texts[start:stop]), alias)
+        return self.columns
+
+
+class Program:
+    """A prepared template split into lines with their `LineMeta`."""
+
+    def __init__(self, lines: List[str]) -> None:
+        self.texts = lines
+        self.metas = [LineMeta(ln) for ln in lines]
+        self._blocks: Dict[Tuple[int, int], Optional[BlockInfo]] = {}
+        self._index: Dict[int, BlockInfo] = {}
+        self._inline_ifs: List[int] = []
+        self._index_blocks()
+        self.last_set = max((k for k, meta in enumerate(self.metas) if meta.may_set), default=-1)
+
+    def block(self, i: int, stop: int) -> Optional[BlockInfo]:
+        """Static shape of the block opened at line `i` within lines `[.., stop)`, or None if it needs the scope."""
+        key = (i, stop)
+        if key not in self._blocks:
+            info = self._index.get(i)
+            if info is not None and info.end <= stop:
+                self._blocks[key] = info if all(self.metas[k].inert for k in info.scan_inline) else None
+            else:
+                # The block runs past the end of the window (it is unclosed there).
+                self._blocks[key] = self._analyse_block(i, stop)
+        return self._blocks[key]
+
+    def _index_blocks(self) -> None:
+        """Match every block opener with its end, elif and else lines in one pass."""
+        metas = self.metas
+        n = len(metas)
+        unclosed = [0] * (n + 1)
+        for k, meta in enumerate(metas):
+            unclosed[k + 1] = unclosed[k] + (meta.inline_if == INLINE_IF_UNCLOSED)
+            if meta.inline_if == INLINE_IF_FULL:
+                self._inline_ifs.append(k)
+
+        loops: List[int] = []
+        ifs: List[Tuple[int, List[Tuple[Optional[str], int, int]], List[Any]]] = []
+        ends: Dict[int, Tuple[int, List[Tuple[Optional[str], int, int]]]] = {}
+        for j, meta in enumerate(metas):
+            marks = meta.marks if meta.inline_if != INLINE_IF_FULL else 0
+            if not marks:
+                continue
+            if marks & MARK_LOOP:
+                loops.append(j)
+            elif marks & MARK_LOOP_END and loops:
+                opener = loops.pop()
+                ends[opener] = (j + 1, [])
+            if marks & MARK_IF:
+                m_if = IF_BLOCK_RE.match(meta.text)
+                # [condition, start of current branch, seen else]
+                ifs.append((j, [], [m_if.group(1).strip() if m_if else "", j + 1, False]))
+            elif marks & MARK_IF_END and ifs:
+                opener, branches, cur = ifs.pop()
+                branches.append((cur[0], cur[1], j))
+                ends[opener] = (j + 1, branches)
+            elif ifs and not ifs[-1][2][2] and marks & (MARK_ELIF | MARK_ELSE):
+                _, branches, cur = ifs[-1]
+                branches.append((cur[0], cur[1], j))
+                if marks & MARK_ELIF:
+                    m_elif = ELIF_BLOCK_RE.match(meta.text)
+                    cur[0] = m_elif.group(1).strip() if m_elif else ""
+                else:
+                    cur[0] = None
+                    cur[2] = True
+                cur[1] = j + 1
+        for opener in loops:
+            ends[opener] = (n, [])
+        for opener, branches, _ in ifs:
+            ends[opener] = (n, branches)
+
+        for i, (end, branches) in ends.items():
+            is_loop = bool(metas[i].marks & MARK_LOOP_BLOCK)
+            if not is_loop and not metas[i].marks & MARK_IF:
+                continue
+            lo = bisect_left(self._inline_ifs, i + 1)
+            hi = bisect_left(self._inline_ifs, end)
+            body = (i + 1, max(i + 1, end - 1))
+            self._index[i] = BlockInfo("loop" if is_loop else "if", end, branches, body, unclosed[end] - unclosed[i + 1], tuple(self._inline_ifs[lo:hi]))
+
+    def _analyse_block(self, i: int, stop: int) -> Optional[BlockInfo]:
+        metas = self.metas
+        is_loop = bool(metas[i].marks & MARK_LOOP_BLOCK)
+        branches: List[Tuple[Optional[str], int, int]] = []
+        m_if = IF_BLOCK_RE.match(self.texts[i])
+        cur_cond: Optional[str] = m_if.group(1).strip() if m_if else ""
+        seen_else = False
+        block_start = i + 1
+        depth_ctr = 1
+        j = i + 1
+        while j < stop and depth_ctr > 0:
+            meta = metas[j]
+            if not meta.inert:
+                return None
+            marks = meta.marks if meta.inline_if != INLINE_IF_FULL else 0
+            if is_loop:
+                if marks & MARK_LOOP:
+                    depth_ctr += 1
+                elif marks & MARK_LOOP_END:
+                    depth_ctr -= 1
+            elif marks & MARK_IF:
+                depth_ctr += 1
+            elif marks & MARK_IF_END:
+                depth_ctr -= 1
+                if depth_ctr == 0:
+                    branches.append((cur_cond, block_start, j))
+            elif depth_ctr == 1 and not seen_else and marks & MARK_ELIF:
+                m_elif = ELIF_BLOCK_RE.match(meta.text)
+                branches.append((cur_cond, block_start, j))
+                cur_cond = m_elif.group(1).strip() if m_elif else ""
+                block_start = j + 1
+            elif depth_ctr == 1 and not seen_else and marks & MARK_ELSE:
+                branches.append((cur_cond, block_start, j))
+                cur_cond = None
+                block_start = j + 1
+                seen_else = True
+            j += 1
+
+        scanned = range(i + 1, j)
+        scan_unclosed = sum(1 for k in scanned if metas[k].inline_if == INLINE_IF_UNCLOSED)
+        scan_inline = tuple(k for k in scanned if metas[k].inline_if == INLINE_IF_FULL)
+        body = (i + 1, max(i + 1, j - 1))
+        return BlockInfo("loop" if is_loop else "if", j, branches, body, scan_unclosed, scan_inline)
+
+    def expand(self, engine: "Engine", scope: Scope) -> List[str]:
+        return engine.expand_lines(self.lines(), scope, 0)
+
+    def iter_expand(self, engine: "Engine", scope: Scope) -> Iterator[Tuple[List[str], int]]:
+        return engine.iter_lines(self.lines(), scope, 0)
+
+    @classmethod
+    def from_text(cls, text: str) -> "Program":
+        return cls(str(text).split("\n"))
+
+    @classmethod
+    def from_template(cls, template: str, variables: Dict[str, Any] | None, highlight: Dict[str, Any] | None) -> "Program":
+        prepared = apply_string_variables(str(template or ""), variables, highlight)
+        return cls.from_text(CommentHandler.strip(prepared))
+
+    def lines(self) -> "TemplateLines":
+        return TemplateLines(self, 0, len(self.texts))
+
+
+class TemplateLines:
+    """Read-only window onto a `Program`; behaves like a list of strings."""
+
+    __slots__ = ("program", "start", "stop")
+
+    def __init__(self, program: Program, start: int, stop: int) -> None:
+        self.program = program
+        self.start = start
+        self.stop = stop
+
+    def __len__(self) -> int:
+        return self.stop - self.start
+
+    def __iter__(self):
+        return iter(self.program.texts[self.start : self.stop])
+
+    def __getitem__(self, key):
+        rng = range(self.start, self.stop)[key]
+        if isinstance(key, slice):
+            if rng.step != 1:
+                return [self.program.texts[k] for k in rng]
+            return TemplateLines(self.program, rng.start, max(rng.start, rng.stop))
+        return self.program.texts[rng]
+
+    def meta(self, i: int) -> LineMeta:
+        return self.program.metas[range(self.start, self.stop)[i]]
+
+    def block(self, i: int) -> Optional[BlockInfo]:
+        """`Program.block` for line `i` of this window (indices stay absolute)."""
+        return self.program.block(self.start + i, self.stop)
+
+    def window(self, start: int, stop: int) -> "TemplateLines":
+        """The lines `[start, stop)` given as absolute program indices."""
+        return TemplateLines(self.program, start, stop)
+
+
+def highlight_from_options(opts: Dict[str, Any]) -> Dict[str, Any]:
+    hl_before_opt = opts.get("hlBefore", None)
+    hl_after_opt = opts.get("hlAfter", None)
+    effective_before = PDL.HL_BEFORE if hl_before_opt is None else hl_before_opt
+    effective_after = PDL.HL_AFTER if hl_after_opt is None else hl_after_opt
+    return highlight_config(effective_before, effective_after)
+
+
+BACKENDS = ("interpreter", "python")
+
+PARSE_OPTIONS = ("variables", "hlBefore", "hlAfter")
+
+
+def template_placeholders(template: str) -> FrozenSet[str]:
+    """Every `{name}` that `apply_string_variables` may substitute in `template`."""
+    names = set()
+    i = template.find("{")
+    while i != -1:
+        close = template.find("}", i + 1)
+        if close == -1:
+            break
+        names.add(template[i + 1 : close])
+        i = template.find("{", i + 1)
+    return frozenset(names)
+
+
+def parse_key(placeholders: FrozenSet[str], variables: Dict[str, Any] | None, highlight: Dict[str, Any]) -> Tuple[Any, ...]:
+    """Hashable summary of the options that change how a template parses."""
+    vars_key: Tuple[Tuple[str, type, str], ...] = ()
+    if isinstance(variables, dict) and placeholders:
+        vars_key = tuple(sorted((name, type(variables[name]), "" if variables[name] is None else str(variables[name])) for name in placeholders if name in variables))
+    hl_key = (bool(highlight.get("enabled")), repr(highlight.get("before")), repr(highlight.get("after")))
+    return vars_key, hl_key
+
+
+class CompiledTemplate:
+    """A template parsed once and rendered against many data roots.
+
+    Options that change parsing (`variables`, `hlBefore`/`hlAfter`) are bound
+    at compile time; `render` re-parses (through `TEMPLATE_CACHE`) only when
+    it is given ones that change the template.
+    With `backend="python"` the line expansion runs as generated Python code
+    (see `PythonCodegen`); its source is kept in `source` and printed to
+    stderr when `dump_source` is set.
+    """
+
+    def __init__(self, template: str, options: Optional[Dict[str, Any]] = None, *, backend: str = "interpreter", dump_source: bool = False) -> None:
+        if backend not in BACKENDS:
+            raise ValueError(f"unknown PDL backend {backend!r}; expected one of {', '.join(BACKENDS)}")
+        self.template = str(template or "")
+        self.options = dict(options or {})
+        self.backend = backend
+        self.variables = self.options.get("variables", {})
+        self.highlight = highlight_from_options(self.options)
+        self.placeholders = template_placeholders(self.template)
+        self.key = parse_key(self.placeholders, self.variables, self.highlight)
+        self.program = Program.from_template(self.template, self.variables, self.highlight)
+        self.source: Optional[str] = None
+        if backend == "python":
+            self.program = GeneratedProgram(self.program)
+            self.source = self.program.source
+            if dump_source:
+                print(self.source, file=sys.stderr)
+
+    def program_for(self, opts: Dict[str, Any], variables: Dict[str, Any], highlight: Dict[str, Any], variants: Optional["ProgramVariants"] = None) -> Program:
+        key = parse_key(self.placeholders, variables, highlight)
+        if key == self.key:
+            return self.program
+        if variants is not None:
+            return variants.get(self, key, opts)
+        return TEMPLATE_CACHE.get(self.template, opts, backend=self.backend).program
+
+    def render(self, data: Any, options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        opts = {**self.options, **options} if options else self.options
+        variables = opts.get("variables", {})
+        highlight = highlight_from_options(opts)
+        program = self.program_for(opts, variables, highlight) if options else self.program
+        return render_program(program, data, opts, variables, highlight)
+
+    def render_iter(self, data: Any, options: Optional[Dict[str, Any]] = None) -> Generator[str, None, RenderStats]:
+        """Like `render`, but yield the markdown in chunks as they are finished; see `render_iter`."""
+        opts = {**self.options, **options} if options else self.options
+        variables = opts.get("variables", {})
+        highlight = highlight_from_options(opts)
+        program = self.program_for(opts, variables, highlight) if options else self.program
+        return iter_program(program, data, opts, variables, highlight)
+
+    def render_to(self, sink: Any, data: Any, options: Optional[Dict[str, Any]] = None, *, buffer_size: int = io.DEFAULT_BUFFER_SIZE) -> RenderStats:
+        """Write the markdown to `sink` as it is rendered; see `render_to`."""
+        return write_chunks(self.render_iter(data, options), sink, buffer_size)
+
+
+class ProgramVariants:
+    """Programs of one template for other parse options, held for one `render_many` call."""
+
+    def __init__(self) -> None:
+        self.bytes = 0
+        self._entries: "OrderedDict[Tuple[Any, ...], Tuple[Program, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, compiled: CompiledTemplate, key: Tuple[Any, ...], opts: Dict[str, Any]) -> Program:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry[0]
+        program = CompiledTemplate(compiled.template, {k: opts[k] for k in PARSE_OPTIONS if k in opts}, backend=compiled.backend).program
+        # Sized like `TemplateCache` entries: the template text plus the substituted values.
+        size = len(compiled.template) + sum(len(name) + len(value) for name, _, value in key[0])
+        with self._lock:
+            if size > PDL.VARIANT_BYTES or key in self._entries:
+                return program
+            self._entries[key] = (program, size)
+            self.bytes += size
+            while self.bytes > PDL.VARIANT_BYTES:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+        return program
+
+
+class TemplateCache:
+    """Process-wide LRU of compiled templates used by `render`.
+
+    Entries are keyed by the template text, `parse_key` of the options and
+    the backend.
+    The cache is bounded by entry count (`maxsize`) and by the approximate
+    size of the cached template texts (`max_bytes`); `maxsize=0` disables it.
+    """
+
+    def __init__(self, maxsize: int = PDL.CACHE_SIZE, max_bytes: int = PDL.CACHE_BYTES) -> None:
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+        self._entries: "OrderedDict[Tuple[Any, ...], Tuple[CompiledTemplate, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, template: str, options: Optional[Dict[str, Any]] = None, *, backend: str = "interpreter") -> CompiledTemplate:
+        opts = options or {}
+        text = str(template or "")
+        key = (text, parse_key(template_placeholders(text), opts.get("variables", {}), highlight_from_options(opts)), backend)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        compiled = CompiledTemplate(text, {k: opts[k] for k in PARSE_OPTIONS if k in opts}, backend=backend)
+        size = len(text) + sum(len(name) + len(value) for name, _, value in key[1][0])
+        with self._lock:
+            if self.maxsize <= 0 or size > self.max_bytes or key in self._entries:
+                return compiled
+            self._entries[key] = (compiled, size)
+            self.bytes += size
+            while len(self._entries) > self.maxsize or self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+        return compiled
+
+    def configure(self, *, maxsize: Optional[int] = None, max_bytes: Optional[int] = None) -> None:
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = maxsize
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            while self._entries and (len(self._entries) > max(self.maxsize, 0) or self.bytes > self.max_bytes):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def info(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+TEMPLATE_CACHE = TemplateCache()
+
+
+def compile(template: str, options: Optional[Dict[str, Any]] = None, *, backend: str = "interpreter", dump_source: bool = False) -> CompiledTemplate:  # noqa: A001 - mirrors re.compile
+    return CompiledTemplate(template, options, backend=backend, dump_source=dump_source)
+
+
+# ================================================================
+# 13) Python code generation
+# ================================================================
+
+
+class _DynamicStructure(Exception):
+    """A line range whose block structure is only known at render time."""
+
+
+class PythonCodegen:
+    """Translate a `Program` into Python source for its line expansion."""
+
+    def __init__(self, program: Program) -> None:
+        self.program = program
+        self.consts: List[Any] = []
+        self.functions: Dict[Tuple[int, int], str] = {}
+        self.chunks: List[str] = []
+
+    def generate(self) -> str:
+        entry = self.range_function(0, len(self.program.texts))
+        header = "# Generated by pdl.PythonCodegen; _T holds the template lines, _K other constants."
+        return header + "\n\n\n" + "\n\n\n".join(self.chunks) + f"\n\n\nrender_lines = {entry}\n"
+
+    def const(self, value: Any) -> str:
+        self.consts.append(value)
+        return f"_K[{len(self.consts) - 1}]"
+
+    def range_function(self, start: int, stop: int) -> str:
+        name = f"_lines_{start}_{stop}"
+        if (start, stop) in self.functions:
+            return name
+        self.functions[(start, stop)] = name
+        out = [f"def {name}(engine, scope, depth):"]
+        if start == stop:
+            out.append("    return []")
+        else:
+            body: List[str] = []
+            try:
+                self.emit_range(body, start, stop)
+            except _DynamicStructure:
+                view = self.const(TemplateLines(self.program, start, stop))
+                body = [f"    return engine.expand_lines({view}, scope, depth)"]
+            out.extend(body)
+        self.chunks.append("\n".join(out))
+        return name
+
+    # --- ranges ---
+    def emit_range(self, w: List[str], start: int, stop: int) -> None:
+        metas = self.program.metas
+        w.append("    stats = engine.stats")
+        w.append("    resolver = engine.resolver")
+        w.append("    if engine._check_limits(depth):")
+        w.append(f"        return _T[{start}:{stop}]")
+        w.append("    emitted = []")
+        w.append("    prev_blank = False")
+        w.append("    skip_blank = False")
+
+        guard: Optional[str] = None
+        run: List[str] = []
+        i = start
+        while i < stop:
+            meta = metas[i]
+            plain = meta.inline_if == INLINE_IF_NONE and not meta.inline and not meta.marks & (MARK_LOOP_BLOCK | MARK_IF)
+            if plain and guard is None and meta.text.strip() != "":
+                run.append(meta.text)
+                i += 1
+                continue
+            self.flush_static(w, run)
+
+            if meta.inline_if == INLINE_IF_FULL:
+                if not meta.inert:
+                    raise _DynamicStructure()
+                self.emit_line(w, i, stop, guard)
+                guard = None
+                i += 1
+            elif meta.marks & MARK_LOOP_BLOCK:
+                info = self.program.block(i, stop)
+                if info is None:
+                    raise _DynamicStructure()
+                self.emit_loop(w, i, stop, info)
+                guard = None
+                i = info.end
+            elif meta.marks & MARK_IF:
+                info = self.program.block(i, stop)
+                if info is None:
+                    raise _DynamicStructure()
+                guard = self.emit_if(w, i, stop, info)
+                i = info.end
+            else:
+                self.emit_line(w, i, stop, guard)
+                guard = None
+                i += 1
+        self.flush_static(w, run)
+        w.append("    return emitted")
+
+    def flush_static(self, w: List[str], run: List[str]) -> None:
+        if not run:
+            return
+        if len(run) == 1:
+            w.append(f"    emitted.append({run[0]!r})")
+        else:
+            w.append(f"    emitted.extend({tuple(run)!r})")
+        w.append("    prev_blank = False")
+        w.append("    skip_blank = False")
+        run.clear()
+
+    # --- lines ---
+    @staticmethod
+    def blank_branch(w: List[str], ind: str) -> None:
+        w.append(f"{ind}if skip_blank:")
+        w.append(f"{ind}    skip_blank = False")
+        w.append(f"{ind}elif not prev_blank:")
+        w.append(f"{ind}    emitted.append('')")
+        w.append(f"{ind}    prev_blank = True")
+
+    @staticmethod
+    def text_branch(w: List[str], ind: str, expr: str) -> None:
+        w.append(f"{ind}emitted.append({expr})")
+        w.append(f"{ind}prev_blank = False")
+        w.append(f"{ind}skip_blank = False")
+
+    @staticmethod
+    def halt_check(w: List[str], ind: str, rest: str) -> None:
+        w.append(f"{ind}if stats.halted:")
+        w.append(f"{ind}    emitted.append(line)")
+        w.append(f"{ind}    emitted.extend({rest})")
+        w.append(f"{ind}    return emitted")
+
+    def emit_line(self, w: List[str], i: int, stop: int, guard: Optional[str]) -> None:
+        meta = self.program.metas[i]
+        ind = "    "
+        if guard is not None:
+            w.append(f"    if not {guard}:")
+            ind = "        "
+        rest = f"_T[{i + 1}:{stop}]"
+
+        if meta.inline_if == INLINE_IF_FULL:
+            w.append(f"{ind}line, drop = InlineIfHelper.apply(_T[{i}], scope, resolver, stats)")
+            w.append(f"{ind}if not drop:")
+            inner = ind + "    "
+            w.append(f"{inner}original_line = line")
+            if meta.values is not None:
+                w.append(f"{inner}if line is _T[{i}]:")
+                w.append(f"{inner}    line = render_value_parts({self.const(meta.values)}, line, scope, resolver, stats)")
+                w.append(f"{inner}else:")
+                w.append(f"{inner}    line = engine.apply_inline(line, scope)")
+                self.halt_check(w, inner, rest)
+            elif meta.inline:
+                w.append(f"{inner}line = engine.apply_inline(line, scope)")
+                self.halt_check(w, inner, rest)
+            else:
+                w.append(f"{inner}if line is not _T[{i}]:")
+                w.append(f"{inner}    line = engine.apply_inline(line, scope)")
+                self.halt_check(w, inner + "    ", rest)
+            w.append(f"{inner}if line.strip() == '':")
+            w.append(f"{inner}    if not ('[set:' in original_line and '[loop:' not in original_line and '[if:' not in original_line):")
+            self.blank_branch(w, inner + "        ")
+            w.append(f"{inner}else:")
+            self.text_branch(w, inner + "    ", "line")
+            # The inline if itself may have hit a limit.
+            w.append(f"{ind}if stats.halted:")
+            w.append(f"{ind}    emitted.extend({rest})")
+            w.append(f"{ind}    return emitted")
+            return
+
+        if meta.inline_if == INLINE_IF_UNCLOSED:
+            w.append(f"{ind}stats.errors_inline += 1")
+
+        if meta.values is not None:
+            w.append(f"{ind}line = render_value_parts({self.const(meta.values)}, _T[{i}], scope, resolver, stats)")
+            self.halt_check(w, ind, rest)
+        elif meta.inline:
+            w.append(f"{ind}line = engine.apply_inline(_T[{i}], scope)")
+            self.halt_check(w, ind, rest)
+        elif meta.text.strip() == "":
+            self.blank_branch(w, ind)
+            return
+        else:
+            self.text_branch(w, ind, repr(meta.text))
+            return
+
+        only_set = meta.only_set
+        w.append(f"{ind}if line.strip() == '':")
+        if only_set:
+            w.append(f"{ind}    pass")
+        else:
+            self.blank_branch(w, ind + "    ")
+        w.append(f"{ind}else:")
+        self.text_branch(w, ind + "    ", "line")
+
+    # --- blocks ---
+    def emit_scan(self, w: List[str], info: BlockInfo) -> None:
+        if info.scan_unclosed:
+            w.append(f"    stats.errors_inline += {info.scan_unclosed}")
+        for k in info.scan_inline:
+            w.append(f"    InlineIfHelper.apply(_T[{k}], scope, resolver, stats)")
+
+    def emit_after_block(self, w: List[str], rest_start: str, stop: int) -> None:
+        w.append("    emitted.extend(blk)")
+        w.append("    if any(x.strip() != '' for x in blk):")
+        w.append("        prev_blank = blk[-1].strip() == ''")
+        w.append("        skip_blank = False")
+        w.append("    else:")
+        w.append("        skip_blank = True")
+        w.append("    if stats.halted:")
+        w.append(f"        emitted.extend(_T[{rest_start}:{stop}])")
+        w.append("        return emitted")
+
+    def emit_loop(self, w: List[str], i: int, stop: int, info: BlockInfo) -> None:
+        meta = self.program.metas[i]
+        params = meta.loop_params
+        p = self.const(params)
+        body = self.range_function(*info.body)
+        j = info.end
+
+        w.append(f"    # line {i}: loop")
+        if meta.inline_if == INLINE_IF_UNCLOSED:
+            w.append("    stats.errors_inline += 1")
+        self.emit_scan(w, info)
+        w.append("    stats.loops += 1")
+        w.append(f"    arr = resolver.resolve_for_loop({str(params.path)!r}, scope, default_ci={bool(params.ci)})")
+        next_is_blank = "False"
+        if j < stop:
+            probe = self.program.metas[j]
+            if probe.inline_if == INLINE_IF_FULL:
+                w.append(f"    probe, _ = InlineIfHelper.apply(_T[{j}], scope, resolver, stats)")
+                next_is_blank = "probe.strip() == ''"
+            else:
+                if probe.inline_if == INLINE_IF_UNCLOSED:
+                    w.append("    stats.errors_inline += 1")
+                next_is_blank = str(probe.text.strip() == "")
+        w.append("    if not isinstance(arr, list) or not arr:")
+        w.append(f"        blk = [{str(params.empty)!r}]" if params.empty else "        blk = []")
+        w.append("    else:")
+        w.append("        blocks = []")
+        columns = info.column_tokens(self.program, params.as_)
+        batch = f"ColumnBatch.plan(scope, {p}, arr, {self.const(columns)})" if columns else "None"
+        w.append(f"        batch = {batch}")
+        w.append("        for k, item in enumerate(arr):")
+        w.append("            if not bump_exp(stats, 1):")
+        w.append("                break")
+        w.append(f"            child = LoopBlockDirective.child_scope(scope, {p}, k, item, batch)")
+        w.append(f"            resolved = [expand_values_and_get_inline(ln, child, resolver, stats) for ln in {body}(engine, child, depth + 1)]")
+        w.append("            if any(x.strip() != '' for x in resolved):")
+        w.append("                blocks.append(resolved)")
+        w.append("            if stats.halted:")
+        w.append("                break")
+        w.append(f"        blk = LoopBlockDirective.merge(blocks, {p}, {_count_indent(meta.text)}, {next_is_blank}, stats.halted)")
+        self.emit_after_block(w, str(j), stop)
+
+    def emit_if(self, w: List[str], i: int, stop: int, info: BlockInfo) -> Optional[str]:
+        meta = self.program.metas[i]
+        j = info.end
+
+        w.append(f"    # line {i}: if")
+        if meta.inline_if == INLINE_IF_UNCLOSED:
+            w.append("    stats.errors_inline += 1")
+        self.emit_scan(w, info)
+        keyword = "if"
+        has_else = False
+        for cond, b_start, b_stop in info.branches:
+            call = f"raw_blk = {self.range_function(b_start, b_stop)}(engine, IfBlockDirective.branch_scope(scope), depth + 1)"
+            if cond is None:
+                w.append("    else:")
+                w.append(f"        {call}")
+                has_else = True
+                break
+            w.append(f"    {keyword} IfBlockDirective.test(engine, scope, {cond!r}):")
+            w.append(f"        {call}")
+            keyword = "elif"
+        if not info.branches:
+            w.append("    raw_blk = []")
+        elif not has_else:
+            w.append("    else:")
+            w.append("        raw_blk = []")
+        w.append(f"    blk = _apply_block_deindent(raw_blk, {_count_indent(meta.text)})")
+
+        guard: Optional[str] = None
+        if j < stop:
+            probe = self.program.metas[j]
+            if probe.inline_if == INLINE_IF_FULL:
+                guard = f"skip_{j}"
+                w.append(f"    {guard} = False")
+                w.append("    if not blk:")
+                w.append(f"        probe, _ = InlineIfHelper.apply(_T[{j}], scope, resolver, stats)")
+                w.append(f"        {guard} = probe.strip() == ''")
+            elif probe.inline_if == INLINE_IF_UNCLOSED:
+                w.append("    if not blk:")
+                w.append("        stats.errors_inline += 1")
+            elif probe.text.strip() == "":
+                guard = f"skip_{j}"
+                w.append(f"    {guard} = not blk")
+        self.emit_after_block(w, f"{j} + 1 if {guard} else {j}" if guard else str(j), stop)
+        return guard
+
+
+class GeneratedProgram(Program):
+    """A `Program` whose expansion runs as generated Python code."""
+
+    def __init__(self, program: Program) -> None:
+        self.texts = program.texts
+        self.metas = program.metas
+        self._blocks = program._blocks
+        self._index = program._index
+        self._inline_ifs = program._inline_ifs
+        self.last_set = program.last_set
+        codegen = PythonCodegen(program)
+        self.source = codegen.generate()
+        namespace: Dict[str, Any] = {
+            "_T": self.texts,
+            "_K": codegen.consts,
+            "InlineIfHelper": InlineIfHelper,
+            "IfBlockDirective": IfBlockDirective,
+            "LoopBlockDirective": LoopBlockDirective,
+            "ColumnBatch": ColumnBatch,
+            "render_value_parts": render_value_parts,
+            "expand_values_and_get_inline": expand_values_and_get_inline,
+            "bump_exp": bump_exp,
+            "_apply_block_deindent": _apply_block_deindent,
+        }
+        exec(builtins.compile(self.source, "<pdl-codegen>", "exec"), namespace)
+        self.render_lines = namespace["render_lines"]
+
+    def expand(self, engine: "Engine", scope: Scope) -> List[str]:
+        return self.render_lines(engine, scope, 0)
 
 
 # ================================================================
@@ -2354,50 +4539,235 @@ def normalize_root(raw: Any) -> Any:
     return json_root_raw
 
 
-def render(template: str, data: Dict[str, Any], options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-    opts = options or {}
+def render_program(program: Program, data: Any, opts: Dict[str, Any], variables: Dict[str, Any], highlight: Dict[str, Any]) -> Dict[str, Any]:
     header_indentation = opts.get("headerIndentation", "#")
     drop_first_header = bool(opts.get("dropFirstHeader", False))
-    variables = opts.get("variables", {})
-    hl_before_opt = opts.get("hlBefore", None)
-    hl_after_opt = opts.get("hlAfter", None)
 
-    effective_before = PDL.HL_BEFORE if hl_before_opt is None else hl_before_opt
-    effective_after = PDL.HL_AFTER if hl_after_opt is None else hl_after_opt
-    highlight = highlight_config(effective_before, effective_after)
+    json_root = normalize_root(data)
 
+    parser = PDLParser("", json_root, aliases={"data": json_root}, variables=variables, highlight=highlight, program=program)
+    lines = parser.expand()
+    stats = parser.stats
+
+    post = PostProcessor(highlight, drop_first_header, header_indentation)
+    expanded_text = post.feed(lines) + post.close()
+
+    return {
+        "markdown": expanded_text,
+        "stats": stats.summary(),
+        "rawStats": stats,
+    }
+
+
+def iter_program(program: Program, data: Any, opts: Dict[str, Any], variables: Dict[str, Any], highlight: Dict[str, Any]) -> Generator[str, None, RenderStats]:
     json_root = normalize_root(data)
-    templ_with_vars = apply_string_variables(str(template or ""), variables, highlight)
+    parser = PDLParser("", json_root, aliases={"data": json_root}, variables=variables, highlight=highlight, program=program)
+    post = PostProcessor(highlight, bool(opts.get("dropFirstHeader", False)), opts.get("headerIndentation", "#"))
+    for lines in parser.iter_lines():
+        chunk = post.feed(lines)
+        if chunk:
+            yield chunk
+    chunk = post.close()
+    if chunk:
+        yield chunk
+    return parser.stats
+
+
+def write_chunks(chunks: Generator[str, None, RenderStats], sink: Any, buffer_size: int) -> RenderStats:
+    write = getattr(sink, "write", None)
+    if write is None:
+        if not callable(sink):
+            raise TypeError(f"PDL output sink must be a text stream or a write callable, not {type(sink).__name__}")
+        write = sink
+    buffered: List[str] = []
+    size = 0
+    while True:
+        try:
+            chunk = next(chunks)
+        except StopIteration as stop:
+            stats = stop.value
+            break
+        buffered.append(chunk)
+        size += len(chunk)
+        if size >= buffer_size:
+            write("".join(buffered))
+            buffered = []
+            size = 0
+    if buffered:
+        write("".join(buffered))
+    return stats
 
-    parser = PDLParser(templ_with_vars, json_root, aliases={"data": json_root}, variables=variables, highlight=highlight)
-    expanded_text, stats = parser.render()
 
-    def collapse_blank_runs(text: str) -> str:
-        out: List[str] = []
-        prev_blank = False
-        for line in str(text).split("\n"):
-            is_blank = line.strip() == ""
-            if is_blank:
-                if prev_blank:
-                    continue
-                prev_blank = True
-                out.append("")
-            else:
-                prev_blank = False
-                out.append(line)
-        return "\n".join(out)
+def render(template: str, data: Dict[str, Any], options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    opts = options or {}
+    return TEMPLATE_CACHE.get(template, opts).render(data, opts)
+
 
-    expanded_text = collapse_blank_runs(expanded_text)
+def render_iter(template: str, data: Dict[str, Any], options: Optional[Dict[str, Any]] = None) -> Generator[str, None, RenderStats]:
+    """Render like `render`, yielding the markdown in chunks as soon as they are final.
+
+    The chunks join to `render(...)["markdown"]`; the generator returns the
+    `RenderStats`. Output is produced per top-level block, so memory follows
+    the largest block rather than the document. The exception are lines
+    still holding a `[value:]`/`[get:]` after expansion: those resolve
+    against the final variables, so they are held back while a later
+    `[set:]` line of the template can still run. Block expansion always
+    runs in the interpreter here, whatever the template's backend.
+    """
+    opts = options or {}
+    return TEMPLATE_CACHE.get(template, opts).render_iter(data, opts)
+
+
+def render_to(sink: Any, template: str, data: Dict[str, Any], options: Optional[Dict[str, Any]] = None, *, buffer_size: int = io.DEFAULT_BUFFER_SIZE) -> RenderStats:
+    """Render like `render`, writing the markdown to `sink` instead of returning it.
+
+    `sink` is a text stream (anything with `write`, e.g. an `io.TextIOBase`)
+    or a callable taking a string. Chunks from `render_iter` are collected
+    until `buffer_size` characters are pending and then written as one
+    string; `buffer_size=0` writes each chunk as it comes. The sink is not
+    flushed or closed. Returns the `RenderStats`.
+    """
+    opts = options or {}
+    return TEMPLATE_CACHE.get(template, opts).render_to(sink, data, opts, buffer_size=buffer_size)
+
+
+EXECUTORS = ("thread", "process")
+
+
+def render_batch(target: CompiledTemplate | Tuple[str, Dict[str, Any], str], options: Dict[str, Any], items: List[Tuple[int, Any, Any]], variants: Optional[ProgramVariants] = None) -> List[Dict[str, Any]]:
+    """Render one chunk of `render_many`.
+
+    In a worker process `target` is the (template, options, backend) to look
+    up in that process's `TEMPLATE_CACHE`, so each worker compiles once;
+    per-item substitutions are then compiled once per chunk.
+    """
+    compiled = TEMPLATE_CACHE.get(*target[:2], backend=target[2]) if isinstance(target, tuple) else target
+    variants = ProgramVariants() if variants is None else variants
+    out: List[Dict[str, Any]] = []
+    for index, data, item_variables in items:
+        opts = {**compiled.options, **options}
+        if item_variables is not None:
+            opts["variables"] = item_variables
+        variables = opts.get("variables", {})
+        highlight = highlight_from_options(opts)
+        res = render_program(compiled.program_for(opts, variables, highlight, variants), data, opts, variables, highlight)
+        res["index"] = index
+        out.append(res)
+    return out
 
-    expanded_text = apply_highlight_heuristics(expanded_text, highlight)
-    expanded_text = PostFormat.drop_first_header_line(expanded_text, drop_first_header)
-    expanded_text = PostFormat.apply_header_level_preset(expanded_text, str(header_indentation or "#"))
 
+def render_many(
+    template: str,
+    datasets: Iterable[Any],
+    options: Optional[Dict[str, Any]] = None,
+    *,
+    variables: Optional[Iterable[Dict[str, Any]]] = None,
+    executor: str | Executor | None = None,
+    max_workers: Optional[int] = None,
+    chunksize: int = 64,
+    ordered: bool = True,
+    backend: str = "interpreter",
+) -> Iterator[Dict[str, Any]]:
+    """Render `template` against each data root in `datasets`, compiling it once.
+
+    `variables`, when given, is iterated alongside `datasets` (ValueError
+    if their lengths differ) and replaces the
+    `variables` option per item; the template is then compiled again
+    only for each distinct substitution of its `{placeholders}`. Those
+    programs are kept for this call only, up to `PDL.VARIANT_BYTES`, and
+    never enter `TEMPLATE_CACHE`. Items are rendered in chunks of
+    `chunksize`: in this thread when `executor` is None, otherwise on a
+    `"thread"` or `"process"` pool of `max_workers` (shut down when done)
+    or on a `concurrent.futures.Executor` you pass in. Process workers
+    compile the template once each; data must then be picklable.
+
+    Yields one `render` result per item, with its position in `datasets`
+    under `"index"`; in input order, or as chunks finish when `ordered` is
+    false. Only a few chunks per worker are read ahead of the results.
+    """
+    if chunksize < 1:
+        raise ValueError(f"render_many chunksize must be at least 1, got {chunksize}")
+    if isinstance(executor, str) and executor not in EXECUTORS:
+        raise ValueError(f"unknown PDL executor {executor!r}; expected one of {', '.join(EXECUTORS)}")
+    opts = options or {}
+    items: Iterable[Tuple[int, Any, Any]]
+    if variables is None:
+        items = ((k, data, None) for k, data in enumerate(datasets))
+    else:
+        items = ((k, data, v) for k, (data, v) in enumerate(zip(datasets, variables, strict=True)))
+    chunks = iter(lambda: list(islice(items, chunksize)), [])
+    compiled = TEMPLATE_CACHE.get(template, opts, backend=backend)
+    return _render_chunks(compiled, opts, chunks, executor, max_workers, ordered)
+
+
+def _render_chunks(compiled: CompiledTemplate, opts: Dict[str, Any], chunks: Iterator[List[Tuple[int, Any, Any]]], executor: str | Executor | None, max_workers: Optional[int], ordered: bool) -> Iterator[Dict[str, Any]]:
+    variants = ProgramVariants()
+    if executor is None:
+        for chunk in chunks:
+            yield from render_batch(compiled, opts, chunk, variants)
+        return
+
+    if executor == "thread":
+        pool: Executor = ThreadPoolExecutor(max_workers)
+    elif executor == "process":
+        pool = ProcessPoolExecutor(max_workers)
+    else:
+        pool = executor
+    target: CompiledTemplate | Tuple[str, Dict[str, Any], str] = compiled
+    if isinstance(pool, ProcessPoolExecutor):
+        target = (compiled.template, opts, compiled.backend)
+    ahead = 2 * (max_workers or os.cpu_count() or 1)
+
+    def submit(chunk: List[Tuple[int, Any, Any]]) -> "Future[List[Dict[str, Any]]]":
+        if isinstance(target, tuple):
+            return pool.submit(render_batch, target, opts, chunk)
+        return pool.submit(render_batch, target, opts, chunk, variants)
+
+    try:
+        if ordered:
+            queue = deque(submit(chunk) for chunk in islice(chunks, ahead))
+            while queue:
+                results = queue.popleft().result()
+                for chunk in islice(chunks, 1):
+                    queue.append(submit(chunk))
+                yield from results
+        else:
+            running = {submit(chunk) for chunk in islice(chunks, ahead)}
+            while running:
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for chunk in islice(chunks, 1):
+                        running.add(submit(chunk))
+                    yield from future.result()
+    finally:
+        if pool is not executor:
+            pool.shutdown(cancel_futures=True)
+
+
+async def render_async(template: str, data: Dict[str, Any], options: Optional[Dict[str, Any]] = None, *, executor: Optional[Executor] = None, cooperative: bool = False) -> Dict[str, Any]:
+    """Render like `render` without blocking the running event loop.
+
+    By default the render runs on `executor` (the loop's default executor
+    when None). With `cooperative=True` it runs on the loop itself through
+    `render_iter`, handing control back to the loop after each top-level
+    block; data that must not leave the loop's thread can be used that way.
+    """
+    if not cooperative:
+        return await asyncio.get_running_loop().run_in_executor(executor, render, template, data, options)
+    chunks = render_iter(template, data, options)
+    parts: List[str] = []
+    while True:
+        try:
+            parts.append(next(chunks))
+        except StopIteration as stop:
+            stats = stop.value
+            break
+        await asyncio.sleep(0)
     return {
-        "markdown": expanded_text,
+        "markdown": "".join(parts),
         "stats": stats.summary(),
         "rawStats": stats,
     }
 
 
-__all__ = ["render", "PDL", "PDLParser", "PostFormat", "RenderStats"]
+__all__ = ["render", "render_async", "render_iter", "render_to", "render_many", "compile", "CompiledTemplate", "TemplateCache", "TEMPLATE_CACHE", "PDL", "PDLParser", "PostFormat", "RenderStats"]
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""Scaling benchmark for inline directives on a single line.
+
+Renders one long line with N inline directives of each kind (set, if, loop,
+value, condense) for growing N and prints the time per directive. With the
+single-pass inline stages the per-directive time stays roughly flat; a
+quadratic stage shows up as a column that grows with N.
+
+Usage: python3 tests/py/bench_inline.py [max_n]
+"""
+
+from __future__ import annotations
+
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(REPO_ROOT / "packages" / "py"))
+
+from pdl import PDL, render  # type: ignore  # noqa: E402
+
+DATA = {"flag": True, "items": [{"name": "a"}, {"name": "b"}, {"name": "c"}], "name": "Ada"}
+
+CASES = {
+    "set": lambda k: f"[set:v{k}={k}]",
+    "if": lambda k: f"[if: flag]x{k}[if-else]y[if-end]",
+    "loop": lambda k: f"[loop: items as=it join=\", \"][value:it.name][loop-end];",
+    "value": lambda k: f"[value:name] ",
+    "condense": lambda k: f"[condense] ( {k} , x ) [condense-end]",
+}
+
+
+def best_of(fn, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main() -> None:
+    max_n = int(sys.argv[1]) if len(sys.argv) > 1 else 3200
+    sizes = []
+    n = 100
+    while n <= max_n:
+        sizes.append(n)
+        n *= 2
+    PDL.MAX_EXPANSIONS = 10**9
+
+    print("us per directive")
+    print(f"{'n':>6} " + " ".join(f"{name:>9}" for name in CASES))
+    for n in sizes:
+        row = []
+        for make in CASES.values():
+            line = "".join(make(k) for k in range(n))
+            # A fresh template each time so the compiled-template cache does not hide parsing.
+            seconds = best_of(lambda: render(line + f" #{time.perf_counter_ns()}", DATA))
+            row.append(seconds / n * 1e6)
+        print(f"{n:>6} " + " ".join(f"{us:9.2f}" for us in row))
+
+
+if __name__ == "__main__":
+    main()
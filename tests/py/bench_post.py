@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Benchmark for the post-expansion passes on multi-megabyte outputs.
+
+Times the whole-text chain (`CondenseProcessor.apply_all`, then the
+`PostFormat` passes and `apply_highlight_heuristics`, each splitting and
+joining the document) against the single line-oriented `PostProcessor`
+that `render()` uses, on the same expanded lines, and checks that both
+give the same markdown.
+
+Usage: python3 tests/py/bench_post.py [megabytes]
+"""
+
+from __future__ import annotations
+
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(REPO_ROOT / "packages" / "py"))
+
+from pdl.pdl import CondenseProcessor, PostFormat, PostProcessor, apply_highlight_heuristics, highlight_config  # type: ignore  # noqa: E402
+
+SECTION = [
+    "# Section {k}",
+    "",
+    "Some text with a [link](https://example.com/{k}) and `code`.",
+    "",
+    "",
+    "   ",
+    "## Details {k}",
+    "- item one",
+    "- item two",
+    "```",
+    "# not a heading",
+    "```",
+    "",
+]
+
+OPTIONS = {
+    "plain": (highlight_config("", ""), False, "#"),
+    "headers": (highlight_config("", ""), True, "###"),
+    "highlight": (highlight_config("<<", ">>"), True, "##"),
+}
+
+
+def chained(lines, highlight, drop_first_header, header_indentation):
+    text = CondenseProcessor.apply_all("\n".join(lines))
+    text = PostFormat.collapse_blank_runs(text)
+    text = apply_highlight_heuristics(text, highlight)
+    text = PostFormat.drop_first_header_line(text, drop_first_header)
+    return PostFormat.apply_header_level_preset(text, str(header_indentation or "#"))
+
+
+def fused(lines, highlight, drop_first_header, header_indentation):
+    post = PostProcessor(highlight, drop_first_header, header_indentation)
+    return post.feed(lines) + post.close()
+
+
+def best_of(fn, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main() -> None:
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 4
+    lines = []
+    size = 0
+    k = 0
+    while size < megabytes * 1e6:
+        section = [line.format(k=k) for line in SECTION]
+        lines.extend(section)
+        size += sum(len(line) + 1 for line in section)
+        k += 1
+    print(f"{len(lines)} lines, {size / 1e6:.1f} MB")
+    print(f"{'options':>10} {'chained ms':>11} {'fused ms':>9}")
+    for name, args in OPTIONS.items():
+        if chained(lines, *args) != fused(lines, *args):
+            raise SystemExit(f"{name}: outputs differ")
+        print(f"{name:>10} {best_of(lambda: chained(lines, *args)) * 1e3:11.1f} {best_of(lambda: fused(lines, *args)) * 1e3:9.1f}")
+
+
+if __name__ == "__main__":
+    main()
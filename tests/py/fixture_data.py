@@ -0,0 +1,16 @@
+import json
+from pathlib import Path
+
+FIXTURES_DIR = Path(__file__).resolve().parents[1] / "fixtures"
+
+
+def fixture_names():
+    return [p.name.replace(".template.md", "") for p in sorted(FIXTURES_DIR.glob("*.template.md"))]
+
+
+def load_fixture(base):
+    template = (FIXTURES_DIR / f"{base}.template.md").read_text(encoding="utf-8")
+    data = json.loads((FIXTURES_DIR / f"{base}.data.json").read_text(encoding="utf-8"))
+    vars_path = FIXTURES_DIR / f"{base}.variables.json"
+    variables = json.loads(vars_path.read_text(encoding="utf-8")) if vars_path.exists() else {}
+    return template, data, variables
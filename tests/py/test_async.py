@@ -0,0 +1,46 @@
+import asyncio
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from packages.py.pdl.pdl import render, render_async
+
+TEMPLATE = "\n".join(["[loop:rows as=r]\n- [value:r upper=true]\n[loop-end]"] * 20)
+DATA = {"rows": [f"row {k}" for k in range(50)]}
+
+
+class TestRenderAsync(unittest.TestCase):
+    def test_matches_render(self):
+        expected = render(TEMPLATE, DATA, {"headerIndentation": "##"})
+
+        async def main():
+            with ThreadPoolExecutor(1) as pool:
+                return [
+                    await render_async(TEMPLATE, DATA, {"headerIndentation": "##"}),
+                    await render_async(TEMPLATE, DATA, {"headerIndentation": "##"}, executor=pool),
+                    await render_async(TEMPLATE, DATA, {"headerIndentation": "##"}, cooperative=True),
+                ]
+
+        for res in asyncio.run(main()):
+            self.assertEqual((res["markdown"], res["stats"]), (expected["markdown"], expected["stats"]))
+
+    def test_cooperative_render_yields_to_the_loop(self):
+        ticks = []
+
+        async def ticker():
+            while True:
+                ticks.append(len(ticks))
+                await asyncio.sleep(0)
+
+        async def main():
+            task = asyncio.ensure_future(ticker())
+            await asyncio.sleep(0)
+            res = await render_async(TEMPLATE, DATA, cooperative=True)
+            task.cancel()
+            return res
+
+        self.assertTrue(asyncio.run(main())["markdown"].startswith("- ROW 0"))
+        self.assertGreaterEqual(len(ticks), 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import contextlib
+import io
+import unittest
+
+from fixture_data import fixture_names, load_fixture
+from packages.py.pdl.pdl import TEMPLATE_CACHE, compile, render
+
+
+class TestPythonBackend(unittest.TestCase):
+    def test_fixtures_match_interpreter(self):
+        for base in fixture_names():
+            template, data, variables = load_fixture(base)
+            options = {"variables": variables}
+            compiled = compile(template, options, backend="python")
+            expected = render(template, data, options)
+            res = compiled.render(data)
+            self.assertEqual(res["markdown"], expected["markdown"], base)
+            self.assertEqual(res["stats"], expected["stats"], base)
+
+    def test_generated_source(self):
+        compiled = compile("# Title\n[loop:items as=x]\n- [value:x]\n[loop-end]\n[if: flag]\nyes\n[if-else]\nno\n[if-end]", backend="python")
+        self.assertIn("for k, item in enumerate(arr):", compiled.source)
+        self.assertIn("if IfBlockDirective.test(engine, scope, 'flag'):", compiled.source)
+        self.assertIn("emitted.append('# Title')", compiled.source)
+        self.assertEqual(compiled.render({"items": [1, 2]})["markdown"], "# Title\n- 1\n- 2\nno")
+
+    def test_dynamic_structure_falls_back_to_interpreter(self):
+        template = "[if: open][loop:items as=x][if-else]none[if-end]\n- [value:x]\n[loop-end]"
+        compiled = compile(template, backend="python")
+        self.assertIn("engine.expand_lines", compiled.source)
+        for data in ({"open": True, "items": ["a"]}, {"open": False, "items": ["a"]}):
+            self.assertEqual(compiled.render(data)["markdown"], render(template, data)["markdown"])
+
+    def test_dump_source(self):
+        err = io.StringIO()
+        with contextlib.redirect_stderr(err):
+            compiled = compile("Hello [value:name]", backend="python", dump_source=True)
+        self.assertEqual(err.getvalue().strip(), compiled.source.strip())
+        self.assertIsNone(compile("Hello").source)
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            compile("Hello", backend="jit")
+
+    def test_cache_keys_backend(self):
+        TEMPLATE_CACHE.clear()
+        interpreted = TEMPLATE_CACHE.get("Hello")
+        generated = TEMPLATE_CACHE.get("Hello", backend="python")
+        self.assertIsNot(interpreted, generated)
+        self.assertIsNotNone(generated.source)
+        TEMPLATE_CACHE.clear()
+
+
+if __name__ == "__main__":
+    unittest.main()
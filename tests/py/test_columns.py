@@ -0,0 +1,64 @@
+import subprocess
+import sys
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from packages.py.pdl.pdl import PDL, ColumnBatch, break_down_duration, break_down_durations, column_tokens, compile, compile_value_filter, format_column
+
+
+def rows(n):
+    return [{"name": f"row_{k}", "at": f"2024-03-{1 + k % 28:02d}T10:00:00Z", "secs": k * 61, "bad": "x" if k % 2 else k} for k in range(n)]
+
+
+TEMPLATE = '[loop:rows as=r]\n[value:r.name upperCamel=true] [value:r.at date="%d.%m."] [value:r.secs time="%H:%M" unit=s] [value:r.bad date="%Y"]\n[loop-end]'
+
+
+class TestColumns(unittest.TestCase):
+    def test_batched_loop_matches_row_by_row(self):
+        data = {"rows": rows(PDL.BATCH_MIN_ITEMS * 2)}
+        with mock.patch.object(ColumnBatch, "plan", return_value=None):
+            expected = compile(TEMPLATE).render(data)
+        for backend in ("interpreter", "python"):
+            with mock.patch("packages.py.pdl.pdl.format_column", wraps=format_column) as spy:
+                res = compile(TEMPLATE, backend=backend).render(data)
+            self.assertEqual(res["markdown"], expected["markdown"])
+            self.assertEqual(res["stats"], expected["stats"])
+            self.assertEqual(spy.call_count, 4)
+
+    def test_small_loops_and_shadowed_aliases_are_not_batched(self):
+        self.assertEqual(column_tokens(("[set:r=1]", "[value:r.a upper=true]"), "r"), frozenset())
+        self.assertEqual(column_tokens(("[set:rr=1] [value:r.a upper=true] [value:r.b] [value:x.a upper=true]",), "r"), {("r.a", "upper=true")})
+        with mock.patch("packages.py.pdl.pdl.format_column", wraps=format_column) as spy:
+            compile(TEMPLATE).render({"rows": rows(PDL.BATCH_MIN_ITEMS - 1)})
+        self.assertEqual(spy.call_count, 0)
+
+    def test_columns_without_numpy(self):
+        values = [0, 999.9, 3725000, 86400000 * 400, -1, 2.0**70, float("inf")]
+        expected = [break_down_duration(v) for v in values]
+        self.assertEqual(break_down_durations(values), expected)
+        with mock.patch("packages.py.pdl.pdl.load_numpy", return_value=None):
+            self.assertEqual(break_down_durations(values), expected)
+        with mock.patch.object(PDL, "BATCH_NUMPY", False), mock.patch("packages.py.pdl.pdl.load_numpy") as load:
+            self.assertEqual(break_down_durations(values), expected)
+        self.assertEqual(load.call_count, 0)
+        column = format_column([61, None, "x"], compile_value_filter('time="%M:%S" unit=s'), {})
+        self.assertEqual(column, [("1 minute 1 second", 0), (None, 0), ("[invalid time]", 1)])
+
+    def test_numpy_is_imported_on_first_use(self):
+        code = "import sys, pdl; print('numpy' in sys.modules)"
+        out = subprocess.run([sys.executable, "-c", code], cwd=Path(__file__).resolve().parents[2] / "packages" / "py", capture_output=True, text=True, check=True)
+        self.assertEqual(out.stdout.strip(), "False")
+
+    def test_format_errors_fall_back_to_the_rows(self):
+        template = '[loop:rows as=r]\n[if:r.ok]\n[value:r.at date="%Y"]\n[if-end]\n[loop-end]'
+        data = {"rows": [{"at": k * 1000, "ok": True} for k in range(PDL.BATCH_MIN_ITEMS)] + [{"at": 1e300}]}
+        # The out-of-range date is never rendered, so only the batch sees it.
+        self.assertEqual(compile(template).render(data)["markdown"], "\n".join(["1970"] * PDL.BATCH_MIN_ITEMS))
+        with mock.patch("packages.py.pdl.pdl.format_column", side_effect=RuntimeError("bug")):
+            with self.assertRaises(RuntimeError):
+                compile(template).render(data)
+
+
+if __name__ == "__main__":
+    unittest.main()
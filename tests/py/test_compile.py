@@ -0,0 +1,54 @@
+import unittest
+
+from fixture_data import fixture_names, load_fixture
+from packages.py.pdl.pdl import CompiledTemplate, Program, compile, parse_set_args, render
+
+
+class TestCompile(unittest.TestCase):
+    def test_fixtures_match_render(self):
+        for base in fixture_names():
+            template, data, variables = load_fixture(base)
+            options = {"variables": variables}
+            compiled = compile(template, options)
+            self.assertIsInstance(compiled, CompiledTemplate)
+            expected = render(template, data, options)
+            for _ in range(2):
+                res = compiled.render(data)
+                self.assertEqual(res["markdown"], expected["markdown"], base)
+                self.assertEqual(res["stats"], expected["stats"], base)
+
+    def test_reuse_with_different_data(self):
+        compiled = compile("[loop:items as=x]\n- [value:x upper=true]\n[loop-end]")
+        self.assertEqual(compiled.render({"items": ["a", "b"]})["markdown"], "- A\n- B")
+        self.assertEqual(compiled.render({"items": ["c"]})["markdown"], "- C")
+
+    def test_render_options_override_compile_options(self):
+        compiled = compile("# {Name} [get:Name]", {"variables": {"Name": "Ada"}})
+        self.assertEqual(compiled.render({})["markdown"], "# Ada Ada")
+        res = compiled.render({}, {"variables": {"Name": "Grace"}, "headerIndentation": "##"})
+        self.assertEqual(res["markdown"], "## Grace Grace")
+
+    def test_block_index(self):
+        program = Program.from_text("[loop:rows as=r]\n[if: r.a]\nA\n[if-elif: r.b]\nB\n[if-else]\nC\n[if-end]\n[loop-end]\nafter")
+        loop = program.block(0, 10)
+        self.assertEqual((loop.kind, loop.end, loop.body), ("loop", 9, (1, 8)))
+        cond = program.block(1, 8)
+        self.assertEqual((cond.kind, cond.end), ("if", 8))
+        self.assertEqual(cond.branches, [("r.a", 2, 3), ("r.b", 4, 5), (None, 6, 7)])
+        # An unclosed block ends with its window.
+        self.assertEqual(Program.from_text("[if: a]\nx").block(0, 2).branches, [])
+        # A dynamic inline if inside the block leaves it to the line scan.
+        self.assertIsNone(Program.from_text("[loop: xs]\n[if: b][loop-end][if-end]\n[loop-end]").block(0, 3))
+
+    def test_loop_body_is_parsed_once(self):
+        compiled = compile("[loop:rows as=r]\n- [set: n=[value:r.n] scope=true][get:n] [value:r.name upper=true]\n[value:r.n]\n[loop-end]")
+        parse_set_args.cache_clear()
+        res = compiled.render({"rows": [{"n": k, "name": f"r{k}"} for k in range(50)]})
+        self.assertTrue(res["markdown"].startswith("- 0 R0\n0\n- 1 R1"))
+        self.assertEqual(parse_set_args.cache_info().misses, 1)
+        # Value lines of the template are scanned when it is compiled.
+        self.assertIsNotNone(compiled.program.metas[2].values)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import random
+import re
+import unittest
+
+from packages.py.pdl.pdl import CondenseProcessor
+
+
+def chained_rules(s):
+    """The condense rules as the regex chain they were first written as."""
+    x = s.replace("\r\n", "\n").replace("\r", "\n")
+    x = x.replace("\n", " ")
+    x = re.sub(r" {2,}", " ", x)
+    x = re.sub(r"\s+([.,!?;])", r"\1", x)
+    x = re.sub(r"\(\s+", "(", x)
+    x = re.sub(r"\s+\)", ")", x)
+    x = x.replace("(, ", "(").replace(", )", ")")
+    x = x.replace("( ", "(").replace(" )", ")")
+    return x.strip()
+
+
+class TestCondenseRules(unittest.TestCase):
+    def check(self, cases):
+        for text, expected in cases:
+            self.assertEqual(CondenseProcessor._apply_rules(text), expected, repr(text))
+            self.assertEqual(chained_rules(text), expected, repr(text))
+
+    def test_space_before_punctuation(self):
+        self.check([("a , b ; c .", "a, b; c."), ("x !", "x!"), ("end ?", "end?"), ("a\n.", "a."), ("x ,\r\ny", "x, y")])
+
+    def test_parentheses(self):
+        self.check([("( a )", "(a)"), ("(  a  )", "(a)"), ("(, a , )", "(a,)"), ("( , b)", "(b)"), ("(\n, x\n)", "(x)"), ("f( ,)", "f(,)")])
+
+    def test_tabs_are_kept_inside_a_line(self):
+        self.check([("a\t \tb", "a\t \tb"), ("a \t b", "a \t b"), ("a\t\tb", "a\t\tb"), ("a\t.", "a.")])
+
+    def test_line_ends(self):
+        self.check([("a  \n", "a"), ("a \r\nb", "a b"), ("a\r\n\r\nb", "a b"), ("a\rb", "a b"), ("a\n \nb", "a b")])
+
+    def test_spaces_collapse_to_one(self):
+        self.check([("a     b", "a b"), ("  lead  and  trail  ", "lead and trail"), ("a \n  b", "a b")])
+
+    def test_matches_the_chain_on_random_text(self):
+        rng = random.Random(5)
+        alphabet = ["a", "b", " ", "  ", "\t", "\n", "\r", "\r\n", "(", ")", ",", ".", "!", "?", ";"]
+        for _ in range(20000):
+            text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 12)))
+            self.assertEqual(CondenseProcessor._apply_rules(text), chained_rules(text), repr(text))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,30 @@
+import unittest
+
+from packages.py.pdl.pdl import PDL, compile_format, components_from_date_ms, get_zone, parse_date_input, parse_date_text, render, render_tokens
+
+
+class TestDates(unittest.TestCase):
+    def test_compiled_format(self):
+        self.assertEqual(compile_format("%d.%m.%Y %q%%"), (("d", 2, None), ".", ("m", 2, None), ".", ("Y", 4, None), " %q%"))
+        comp = components_from_date_ms(1709634030123, "UTC")
+        self.assertEqual(render_tokens("%y/%m/%d %H:%M:%S.%L%", comp, "date"), "24/03/05 10:20:30.123%")
+        self.assertIs(compile_format("%Y"), compile_format("%Y"))
+
+    def test_parsed_inputs_are_cached(self):
+        parse_date_text.cache_clear()
+        for _ in range(3):
+            self.assertEqual(parse_date_input("2024-03-05T10:20:30Z"), (1709634030000, False))
+        self.assertEqual(parse_date_text.cache_info().misses, 1)
+        self.assertEqual(parse_date_input(" 1709634030 "), (1709634030000, False))
+        self.assertEqual(parse_date_input("not a date"), (None, True))
+        self.assertIs(get_zone(PDL.DATE_TZ), get_zone(PDL.DATE_TZ))
+
+    def test_naive_times_follow_the_date_timezone(self):
+        self.assertEqual(parse_date_input("2024-03-05 10:20"), (1709630400000, False))
+        self.assertEqual(parse_date_text("2024-03-05 10:20", "UTC"), (1709634000000, False))
+        res = render('[value:a date="%H:%M"] [value:b date="%H:%M"]', {"a": "2024-07-01 08:00", "b": "2024-07-01T08:00:00Z"})
+        self.assertEqual(res["markdown"], "08:00 10:00")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+
+from packages.py.pdl.pdl import LoopFlags, ValueFlags, compile_replace, compile_value_filter, parse_loop_params, parse_value_flags
+
+
+class TestFlags(unittest.TestCase):
+    def test_value_flags(self):
+        flags = parse_value_flags('upper=true truncate=40 date="%d.%m.%Y" suffix=…')
+        self.assertIsInstance(flags, ValueFlags)
+        self.assertTrue(flags.upper)
+        self.assertEqual(flags.truncate, 40)
+        self.assertEqual(flags.date, "%d.%m.%Y")
+        self.assertEqual(flags.unit, "ms")
+        self.assertTrue(flags.hl)
+        self.assertEqual(flags.extra, {"suffix": "…"})
+        self.assertEqual(flags.get("suffix"), "…")
+        self.assertIsNone(flags.get("missing"))
+
+    def test_loop_flags(self):
+        flags = parse_loop_params('items as=item start=0 join=", "')
+        self.assertIsInstance(flags, LoopFlags)
+        self.assertEqual((flags.path, flags.as_, flags.start, flags.join, flags.dots), ("items", "item", 0, ", ", True))
+        self.assertEqual(flags.get("as"), "item")
+        self.assertEqual(parse_loop_params("").path, "")
+
+    def test_cached_and_immutable(self):
+        flags = parse_value_flags("upper=true")
+        self.assertIs(parse_value_flags("upper=true"), flags)
+        with self.assertRaises(AttributeError):
+            flags.upper = False
+        with self.assertRaises(AttributeError):
+            flags.other = 1
+        flags = parse_value_flags("suffix=x")
+        with self.assertRaises(TypeError):
+            flags.extra["suffix"] = "changed"
+        self.assertEqual(parse_value_flags("suffix=x").get("suffix"), "x")
+
+    def test_value_filter_fuses_enabled_steps(self):
+        vf = compile_value_filter('replace="o:0" trim=true upperSnake=true truncate=6 suffix=… format="x"')
+        self.assertIs(compile_value_filter('replace="o:0" trim=true upperSnake=true truncate=6 suffix=… format="x"'), vf)
+        self.assertEqual(vf.text("  foo barBaz "), "F00_BA…")
+        self.assertEqual((vf.default_errors, vf.format_errors), (0, 1))
+        self.assertEqual(vf.render("  foo barBaz ", {"enabled": True, "before": "<", "after": ">"}), "<F00_BA…>")
+        self.assertIsNone(compile_value_filter("hl=false").text)
+        self.assertEqual(compile_value_filter("stringify=true").render({"a": 1}, {}), '{"a":1}')
+
+    def test_replace_and_escape(self):
+        self.assertIs(compile_replace("s/a+/b/g"), compile_replace("s/a+/b/g"))
+        self.assertEqual(compile_replace("s/a+/b/g")("caaat aa"), "cbt b")
+        self.assertEqual(compile_replace("s/a/b/")("aa"), "ba")
+        self.assertEqual(compile_replace("s/(/x/")("(a"), "(a")
+        self.assertEqual(compile_replace("x:y;a:b")("abc"), "bbc")
+        self.assertEqual(compile_value_filter("escapeMarkdown=true").text("a\\*b_[c](d)"), "a\\\\\\*b\\_\\[c\\]\\(d\\)")
+        self.assertEqual(compile_value_filter("upper=true title=true").text("hello woRLD"), "Hello World")
+        self.assertEqual(compile_value_filter("lower=true upper=true").text("MiXed"), "MIXED")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+
+from packages.py.pdl.pdl import PDL, InlineLexer, InlineRewrite, render
+
+
+class TestInlineLexer(unittest.TestCase):
+    def test_find_matches_str_find(self):
+        line = "a [value:x] [if: b]c[if-elif: d]e[if-else]f[if-end] [loop:xs][loop-index][loop-end] [set:y=1][get:y]"
+        lex = InlineLexer(line)
+        for marker in InlineLexer.MARKERS:
+            for pos in range(len(line) + 1):
+                self.assertEqual(lex.find(marker, pos), line.find(marker, pos), (marker, pos))
+
+    def test_closing_counts_bracket_depth(self):
+        line = "[value: a[b] ] [set: x [if-end]] [get: open ]]"
+        lex = InlineLexer(line)
+        self.assertEqual(lex.closing(0), line.index(" ] ") + 1)
+        self.assertEqual(lex.closing(line.index("[set:")), line.index("]] ") + 1)
+        self.assertEqual(lex.closing(line.index("[if-end]")), line.index("[if-end]") + 7)
+        self.assertEqual(lex.closing(line.index("[get:")), len(line) - 2)
+        self.assertEqual(InlineLexer("[value: [x]").closing(0), -1)
+
+    def test_first(self):
+        lex = InlineLexer("x [get:a] [value:b]")
+        self.assertEqual(lex.first((PDL.VALUE_PREFIX, PDL.GET_PREFIX)), (2, PDL.GET_PREFIX))
+        self.assertEqual(lex.first((PDL.VALUE_PREFIX, PDL.GET_PREFIX), 3), (10, PDL.VALUE_PREFIX))
+        self.assertEqual(lex.first((PDL.LOOP_IDX,)), (-1, ""))
+
+
+class TestInlineRewrite(unittest.TestCase):
+    def test_replacements_are_joined_once(self):
+        out = InlineRewrite("a [x] b [y] c", "[x")
+        out.replace(2, 5, "1")
+        self.assertEqual(out.pos, 5)
+        out.replace(8, 11, "2")
+        self.assertEqual(out.result(), "a 1 b 2 c")
+
+    def test_marker_in_replacement_is_rescanned(self):
+        out = InlineRewrite("a [set:x] b", PDL.SET_PREFIX)
+        out.replace(2, 9, "[set:y]")
+        self.assertEqual(out.find(PDL.SET_PREFIX), 2)
+        self.assertEqual(out.result(), "a [set:y] b")
+
+
+class TestInlineStages(unittest.TestCase):
+    data = {"a": 1, "b": 2, "c": 3, "xs": [1, 2], "strs": ["[loop:", " xs as=z]Z[loop-end]"]}
+
+    def test_marker_created_at_a_seam(self):
+        self.assertEqual(render("[[set:x=1]set:y=2][get:y] [get:x]", self.data)["markdown"], "2 1")
+        self.assertEqual(render("[if: a = 1][[if-end]if: b]B[if-end]", self.data)["markdown"], "B")
+
+    def test_nested_inline_ifs(self):
+        self.assertEqual(render("a [if: a = 1]x [if: b]y[if-end] z[if-end] q", self.data)["markdown"], "a x y z q")
+
+    def test_loop_output_is_rescanned(self):
+        self.assertEqual(render("[loop: strs as=s][value:s][loop-end] tail", self.data)["markdown"], "ZZ tail")
+
+    def test_value_scan(self):
+        self.assertEqual(render("[value:a][value:b [value:c]][loop-index][get:zz][value:", self.data)["markdown"], "120[get:zz][value:")
+
+
+if __name__ == "__main__":
+    unittest.main()
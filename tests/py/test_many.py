@@ -0,0 +1,106 @@
+import gc
+import tracemalloc
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from packages.py.pdl.pdl import PDL, TEMPLATE_CACHE, Program, ProgramVariants, render, render_batch, render_many
+
+TEMPLATE = "# {Title}\n[loop:items as=x]\n- [value:x.name upper=true] [get:Who]\n[loop-end]"
+OPTIONS = {"variables": {"Title": "Orders", "Who": "me"}, "headerIndentation": "##"}
+
+
+def datasets(n):
+    return [{"items": [{"name": f"n{k}"}, {"name": f"m{k}"}]} for k in range(n)]
+
+
+class TestRenderMany(unittest.TestCase):
+    def expected(self, n, variables=None):
+        out = []
+        for k, data in enumerate(datasets(n)):
+            opts = OPTIONS if variables is None else {**OPTIONS, "variables": variables[k]}
+            out.append({**render(TEMPLATE, data, opts), "index": k})
+        return out
+
+    def assertResults(self, results, expected):
+        self.assertEqual([(r["index"], r["markdown"], r["stats"]) for r in results], [(r["index"], r["markdown"], r["stats"]) for r in expected])
+
+    def test_serial_compiles_once(self):
+        TEMPLATE_CACHE.clear()
+        results = list(render_many(TEMPLATE, iter(datasets(50)), OPTIONS, chunksize=7))
+        self.assertEqual(TEMPLATE_CACHE.info()["misses"], 1)
+        self.assertResults(results, self.expected(50))
+        self.assertEqual(results[3]["rawStats"].loops, 1)
+
+    def test_pools_and_result_order(self):
+        expected = self.expected(40)
+        self.assertResults(list(render_many(TEMPLATE, datasets(40), OPTIONS, executor="thread", max_workers=3, chunksize=4)), expected)
+        unordered = render_many(TEMPLATE, datasets(40), OPTIONS, executor="thread", max_workers=3, chunksize=4, ordered=False)
+        self.assertResults(sorted(unordered, key=lambda r: r["index"]), expected)
+        self.assertResults(list(render_many(TEMPLATE, datasets(40), OPTIONS, executor="process", max_workers=2, chunksize=16, backend="python")), expected)
+        with ThreadPoolExecutor(2) as pool:
+            self.assertResults(list(render_many(TEMPLATE, datasets(40), OPTIONS, executor=pool)), expected)
+            self.assertEqual(pool.submit(len, "ok").result(), 2)
+
+    def test_per_item_variables(self):
+        variables = [{"Title": f"T{k}", "Who": f"w{k}"} for k in range(6)]
+        results = list(render_many(TEMPLATE, datasets(6), OPTIONS, variables=variables, executor="thread", chunksize=2))
+        self.assertResults(results, self.expected(6, variables))
+        self.assertTrue(results[5]["markdown"].startswith("## T5\n- N5 w5"))
+
+    def test_per_item_variables_compile_once_per_substitution(self):
+        TEMPLATE_CACHE.clear()
+        variables = [{"Who": f"w{k}", "Title": ("A", "B", "C")[k % 3]} for k in range(500)]
+        with mock.patch.object(Program, "from_template", wraps=Program.from_template) as spy:
+            results = list(render_many(TEMPLATE, datasets(500), OPTIONS, variables=variables, chunksize=50))
+        self.assertEqual((spy.call_count, TEMPLATE_CACHE.info()["misses"]), (4, 1))
+        self.assertEqual(results[4]["markdown"], render(TEMPLATE, datasets(5)[4], {**OPTIONS, "variables": variables[4]})["markdown"])
+        # Placeholders the template does not use never cause a compile.
+        TEMPLATE_CACHE.clear()
+        with mock.patch.object(Program, "from_template", wraps=Program.from_template) as spy:
+            list(render_many("[loop:items as=x]\n[get:Who]\n[loop-end]", datasets(500), variables=variables))
+        self.assertEqual((spy.call_count, TEMPLATE_CACHE.info()["misses"]), (1, 1))
+
+    def test_per_item_variables_are_not_retained(self):
+        TEMPLATE_CACHE.clear()
+        TEMPLATE_CACHE.configure(max_bytes=200_000)
+        self.addCleanup(TEMPLATE_CACHE.configure, maxsize=PDL.CACHE_SIZE, max_bytes=PDL.CACHE_BYTES)
+        self.addCleanup(TEMPLATE_CACHE.clear)
+        template = "{T}\n" + "[value:x]\n" * 500
+        variables = [{"T": f"t{k}"} for k in range(40)]
+        render(template, {"x": 1})
+        gc.collect()
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+        before = tracemalloc.get_traced_memory()[0]
+        for executor in (None, "thread"):
+            results = list(render_many(template, [{"x": 1}] * 40, variables=variables, executor=executor, chunksize=10))
+            self.assertEqual(results[7]["markdown"].split("\n", 1)[0], "t7")
+        del results
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0] - before
+        self.assertLessEqual(TEMPLATE_CACHE.info()["bytes"], 200_000)
+        self.assertLess(retained, 100_000)
+
+    def test_variant_byte_budget(self):
+        template = "{T}\n" + "[value:x]\n" * 100
+        variants = ProgramVariants()
+        items = [(k, {"x": k}, {"T": f"t{k}"}) for k in range(20)]
+        with mock.patch.object(PDL, "VARIANT_BYTES", 3 * len(template)):
+            results = render_batch(TEMPLATE_CACHE.get(template, {}), {}, items, variants)
+            self.assertLessEqual(variants.bytes, PDL.VARIANT_BYTES)
+        self.assertEqual(len(variants), 2)
+        self.assertEqual(results[19]["markdown"].split("\n", 2)[:2], ["t19", "19"])
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            render_many(TEMPLATE, [], executor="fibers")
+        with self.assertRaises(ValueError):
+            render_many(TEMPLATE, [], chunksize=0)
+        for variables in ([{}] * 3, [{}] * 7):
+            with self.assertRaises(ValueError):
+                list(render_many("[value:x]", [{"x": 1}] * 5, variables=variables))
+
+
+if __name__ == "__main__":
+    unittest.main()
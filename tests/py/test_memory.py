@@ -0,0 +1,75 @@
+import tracemalloc
+import unittest
+from unittest import mock
+
+from packages.py.pdl import pdl
+from packages.py.pdl.pdl import Engine, LineMeta, RenderStats, Scope, ValueToken, VarBinding, render
+
+LOOP_DATA = {"rows": [{"id": k, "name": f"n{k}"} for k in range(5000)]}
+LOOP_TEMPLATE = "[loop:rows as=r]\n[if:r.id>2]\n- [set:last=[value:r.id] scope=true][value:r.name] [get:last]\n[if-end]\n[loop-end]"
+
+
+def peak_bytes(fn):
+    tracemalloc.start()
+    try:
+        keep = fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del keep
+    return peak
+
+
+def unslotted(cls):
+    """The same class with its attributes kept in an instance `__dict__`."""
+    namespace = {k: v for k, v in vars(cls).items() if k not in cls.__slots__ and k not in ("__slots__", "__dict__", "__weakref__")}
+    return type(cls.__name__, cls.__bases__, namespace)
+
+
+def without_slots():
+    return mock.patch.multiple(pdl, **{name: unslotted(getattr(pdl, name)) for name in ("Scope", "Aliases", "VarBinding", "RenderStats")})
+
+
+def loop_scopes():
+    root = pdl.Scope(root={}, aliases={"data": {}})
+    return [(root.child(alias="x", item=k, index=k), pdl.VarBinding(k)) for k in range(20000)]
+
+
+def render_keeping_scopes():
+    kept = []
+    child = pdl.Scope.child
+
+    def keep(self, **kwargs):
+        kept.append(child(self, **kwargs))
+        return kept[-1]
+
+    with mock.patch.object(pdl.Scope, "child", keep):
+        res = render(LOOP_TEMPLATE, LOOP_DATA)
+    return kept, res
+
+
+class TestMemory(unittest.TestCase):
+    def test_runtime_objects_are_slotted(self):
+        scope = Scope(root={})
+        objects = [scope, scope.child(alias="x", item=1), VarBinding(1), RenderStats(), Engine(), LineMeta("x"), ValueToken("val", 0, 1)]
+        for obj in objects:
+            self.assertFalse(hasattr(obj, "__dict__"), type(obj).__name__)
+
+    def test_loop_scopes_peak_memory(self):
+        slotted = peak_bytes(loop_scopes)
+        with without_slots():
+            self.assertTrue(hasattr(pdl.Scope(root={}), "__dict__"))
+            unslotted_peak = peak_bytes(loop_scopes)
+        self.assertLess(slotted, 0.8 * unslotted_peak)
+
+    def test_large_loop_render_peak(self):
+        self.assertTrue(render(LOOP_TEMPLATE, LOOP_DATA)["markdown"].startswith("- n3 3\n- n4 4"))
+        # Scopes are released per iteration, so keep them alive to compare what they cost.
+        slotted = peak_bytes(render_keeping_scopes)
+        with without_slots():
+            unslotted_peak = peak_bytes(render_keeping_scopes)
+        self.assertLess(slotted, 0.95 * unslotted_peak)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+
+from packages.py.pdl.pdl import PDL, SEL_INDEX, SEL_PREDICATE, PathResolver, Scope, compile_comparator, compile_condition, compile_correlated, compile_path, compile_selector, compile_steps, render
+
+
+class TestPathResolver(unittest.TestCase):
+    def test_compiled_steps(self):
+        steps = compile_steps('data."the orders"[status="open"].total[0]')
+        self.assertEqual([s.name for s in steps], ["data", "the orders", "total"])
+        self.assertEqual(steps[1].selector.kind, SEL_PREDICATE)
+        self.assertEqual(steps[1].selector.clauses, [[("status", "=", "open")]])
+        self.assertEqual((steps[2].selector.kind, steps[2].selector.index), (SEL_INDEX, 0))
+        self.assertIs(compile_steps('data."the orders"[status="open"].total[0]'), steps)
+
+    def test_path_forms(self):
+        self.assertEqual(compile_path(" item ").name, "item")
+        dotted = compile_path("item.name")
+        self.assertEqual((dotted.dotted_key, [s.name for s in dotted.dotted_rest]), ("item", ["name"]))
+        head = compile_path("rows[1].name")
+        self.assertEqual((head.head.name, head.head.sel, [s.name for s in head.rest]), ("rows", "1", ["name"]))
+        self.assertTrue(compile_path("  ").empty)
+
+    def test_resolve_with_compiled_paths(self):
+        data = {"rows": [{"name": "a", "n": 1}, {"name": "B", "n": 2}], "cfg": {"Mode": "x"}}
+        scope = Scope(root=data, aliases={"r": data["rows"][1]})
+        resolver = PathResolver()
+        self.assertEqual(resolver.resolve_scoped("r.name", scope), "B")
+        self.assertEqual(resolver.resolve_scoped("rows[name=b ci=true].n", scope), 2)
+        self.assertEqual(resolver.resolve_scoped("rows[1].name", scope), "B")
+        self.assertEqual(resolver.resolve_scoped("cfg[mode]", scope, default_ci=True), "x")
+        self.assertEqual(resolver.resolve_for_loop("rows[n>0]", scope), data["rows"])
+        self.assertIsNone(resolver.resolve_scoped("rows[5]", scope))
+
+    def test_compiled_comparators(self):
+        self.assertTrue(compile_comparator("=", 5, False)(" 5.0 "))
+        self.assertTrue(compile_comparator("=", "Cafe\u0301", True)("CAFÉ"))
+        self.assertTrue(compile_comparator("*=", "b", False)("abc"))
+        self.assertFalse(compile_comparator("<", "abc", False)("abb"))
+        self.assertFalse(compile_comparator("^=", 1, False)("1x"))
+        self.assertTrue(compile_comparator("!=", None, False)("x"))
+
+    def test_selector_predicate_is_compiled_once(self):
+        sel = compile_selector("n>=2 & name!=c | name=a ci=true")
+        self.assertIs(sel.predicate(False), sel.predicate(True))
+        rows = [{"n": 1, "name": "A"}, {"n": 2, "name": "b"}, {"n": 3, "name": "c"}]
+        self.assertEqual([r for r in rows if sel.predicate(False)(r)], rows[:2])
+
+    def test_condition_with_get_key(self):
+        cond = compile_condition("[get:v upper=true]=x | a=1")
+        self.assertIs(compile_condition("[get:v upper=true]=x | a=1"), cond)
+        self.assertEqual([row[0][1] for row in cond.tests(False)], ["v", None])
+        scope = Scope(root={"a": 1})
+        scope.set_var("v", "y")
+        self.assertTrue(PathResolver().eval_condition("[get:v upper=true]=x | a=1", scope))
+        self.assertFalse(PathResolver().eval_condition("[get:v]=x", scope))
+
+    def test_equality_selectors_use_an_index(self):
+        products = [{"sku": f"S{i}", "name": f"P{i}", "n": i} for i in range(PDL.INDEX_MIN_ITEMS * 2)]
+        lines = [{"sku": f"s{i * 7 % len(products)}"} for i in range(10)]
+        res = render("[loop:lines as=line][value:products[sku=[value:line.sku]].name ci=true],[loop-end]", {"products": products, "lines": lines})
+        self.assertEqual(res["markdown"], "".join(f"P{i * 7 % len(products)}," for i in range(10)))
+        self.assertEqual((res["rawStats"].index_builds, res["rawStats"].index_hits), (1, 9))
+
+        scope = Scope(root={"rows": products + [{"n": "3"}]})
+        resolver = PathResolver()
+        self.assertEqual(resolver.resolve_for_loop("rows[n=3]", scope), [products[3], {"n": "3"}])
+        self.assertIsNone(resolver.resolve_scoped("rows[n=x].n", scope))
+        self.assertEqual((resolver.stats.index_builds, resolver.stats.index_hits), (1, 1))
+
+    def test_range_selectors_use_a_sorted_index(self):
+        events = [{"ts": (i * 7) % 50} for i in range(50)] + [{"ts": "12"}, {"ts": "x"}, {}]
+        scope = Scope(root={"events": events})
+        resolver = PathResolver()
+        for op, test in (("<", lambda v: v < 12), ("<=", lambda v: v <= 12), (">", lambda v: v > 12), (">=", lambda v: v >= 12)):
+            expected = [e for e in events if isinstance(e.get("ts"), (int, str)) and str(e["ts"]).isdigit() and test(int(e["ts"]))]
+            self.assertEqual(resolver.resolve_for_loop(f"events[ts{op}12]", scope), expected)
+            self.assertIs(resolver.resolve_scoped(f"events[ts{op}12]", scope), expected[0])
+        self.assertEqual((resolver.stats.index_builds, resolver.stats.index_hits), (1, 7))
+
+    def test_correlated_selectors_are_parsed_once(self):
+        self.assertIsNotNone(compile_correlated("orders[customer_id=[value:c.id]].total"))
+        self.assertIsNotNone(compile_correlated("data.orders[customer_id=[get:cid]]"))
+        self.assertIsNone(compile_correlated("orders[customer_id>[value:c.id]].total"))
+        customers = [{"id": i, "name": f"C{i}"} for i in range(40)]
+        orders = [{"customer_id": i % 40, "total": i} for i in range(80)]
+        template = '[loop:customers as=c join=","][value:c.name]=[value:orders[customer_id=[value:c.id]].total][loop-end]'
+        compile_path.cache_clear()
+        res = render(template, {"customers": customers, "orders": orders})
+        self.assertEqual(res["markdown"], ",".join(f"C{i}={i}" for i in range(40)))
+        self.assertLess(compile_path.cache_info().misses, 10)
+        self.assertEqual((res["rawStats"].index_builds, res["rawStats"].index_hits), (1, 39))
+        # Values that would change how the spliced path parses take the textual route.
+        res = render("[value:rows[k=[value:v]].f]", {"rows": [{"k": "a|b", "f": 1}, {"k": "a", "f": 2}], "v": "a|b"})
+        self.assertEqual(res["markdown"], "2")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+
+from packages.py.pdl.pdl import PathResolver, Scope, render
+
+
+class TestScope(unittest.TestCase):
+    def test_child_scopes_link_to_parent(self):
+        root = Scope(root={}, aliases={"data": {}})
+        outer = root.child(alias="x", item=1, index=0)
+        inner = outer.child(alias="y", item=2, index=3, dots=False)
+        branch = inner.child()
+        self.assertEqual((branch.aliases["x"], branch.aliases["y"], branch.aliases.get("z")), (1, 2, None))
+        self.assertIn("data", branch.aliases)
+        self.assertEqual(branch.index_chain, [0, 3])
+        self.assertFalse(branch.dots)
+        self.assertIs(root.child().aliases, root.aliases)
+
+    def test_frames_are_created_on_first_local_write(self):
+        root = Scope(root={})
+        root.set_var("g", "global")
+        child = root.child(alias="x", item=1)
+        grandchild = child.child()
+        self.assertIsNone(child.frame)
+        grandchild.set_var("g", "shadow", scope_local=True)
+        grandchild.set_var("h", "global-h")
+        self.assertIsNone(child.frame)
+        self.assertEqual(grandchild.get_var_binding("g")[1], 2)
+        self.assertEqual((grandchild.get_var_value("g"), child.get_var_value("g")), ("shadow", "global"))
+        self.assertEqual(root.get_var_value("h"), "global-h")
+
+    def test_scope_local_set_in_loop(self):
+        res = render("[set:n=0]\n[loop:xs as=x]\n[set:n=[value:x] scope=true][get:n]\n[loop-end]\n[get:n]", {"xs": [1, 2]})
+        self.assertEqual(res["markdown"], "1\n2\n0")
+
+    def test_resolved_paths_are_memoized_per_scope(self):
+        calls = []
+
+        class CountingResolver(PathResolver):
+            def resolve_expr(self, expr, scope, *, default_ci=False):
+                calls.append(expr)
+                return super().resolve_expr(expr, scope, default_ci=default_ci)
+
+        resolver = CountingResolver()
+        root = Scope(root={"c": {"name": "Ada"}})
+        child = root.child(alias="c", item={"name": "Grace"})
+        for _ in range(3):
+            self.assertEqual(resolver.resolve_scoped("c.name", root), "Ada")
+            self.assertEqual(resolver.resolve_scoped("c.name", child), "Grace")
+        self.assertEqual(len(calls), 2)
+        child.set_var("c", {"name": "Var"})
+        self.assertEqual((resolver.resolve_scoped("c.name", root), resolver.resolve_scoped("c.name", child)), ("Var", "Var"))
+        self.assertEqual(len(calls), 4)
+
+    def test_set_invalidates_memoized_values(self):
+        template = "[value:x]\n[set:x=\"v\" humble=true][value:x]\n[set:x humble=false][value:x]\n[set:x=\"w\" const=false][value:x]"
+        self.assertEqual(render(template, {"x": "d"})["markdown"], "d\nd\nv\nw")
+        res = render("[loop:xs as=x]\n[value:x]\n[set:x=0 scope=true][value:x]\n[set:x humble=true scope=true][value:x]\n[loop-end]", {"xs": [1, 2]})
+        self.assertEqual(res["markdown"], "1\n0\n1\n2\n0\n2")
+
+
+if __name__ == "__main__":
+    unittest.main()
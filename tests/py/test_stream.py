@@ -0,0 +1,101 @@
+import io
+import tracemalloc
+import unittest
+
+from fixture_data import fixture_names, load_fixture
+from packages.py.pdl.pdl import CondenseProcessor, PostFormat, PostProcessor, apply_highlight_heuristics, compile, highlight_config, render, render_iter, render_to
+
+OPTIONS = [{}, {"dropFirstHeader": True, "headerIndentation": "###"}, {"hlBefore": "<<", "hlAfter": ">>"}]
+
+
+def drain(gen):
+    chunks = []
+    while True:
+        try:
+            chunks.append(next(gen))
+        except StopIteration as stop:
+            return chunks, stop.value
+
+
+class TestStream(unittest.TestCase):
+    def test_chunks_join_to_render(self):
+        for base in fixture_names():
+            template, data, variables = load_fixture(base)
+            for extra in OPTIONS:
+                options = {"variables": variables, **extra}
+                expected = render(template, data, options)
+                chunks, stats = drain(render_iter(template, data, options))
+                self.assertEqual("".join(chunks), expected["markdown"], (base, extra))
+                self.assertEqual(stats.summary(), expected["stats"], (base, extra))
+
+    def test_chunks_follow_top_level_blocks(self):
+        template = "# Report\n\n[loop:a as=x]\n- [value:x]\n[loop-end]\n\n\n[condense]\nb ,\n c\n[condense-end]\n[loop:a as=x]\n[value:x]\n[loop-end]"
+        chunks, _ = drain(compile(template, backend="python").render_iter({"a": [1, 2]}, {"dropFirstHeader": True}))
+        # A chunk ends before the last line of a block, which the next block may still join or drop.
+        self.assertEqual(chunks, ["- 1", "\n- 2\n\nb, c\n1", "\n2"])
+        # Tokens still open after expansion are resolved against the final variables.
+        template = "[get:y]\n[loop:a as=x]\n[value:x]\n[loop-end]\n[set:y=\"late\"]\n[loop:a as=x]\n[value:x]\n[loop-end]"
+        self.assertEqual(list(render_iter(template, {"a": [1]})), ["late\n1", "\n1"])
+        # An inline if can join a `[set:` from pieces of the line.
+        template = template.replace("[set:y=\"late\"]", "[se[if:a]t:y=9[if-end]]")
+        self.assertEqual(list(render_iter(template, {"a": [1]})), ["9\n1", "\n1"])
+        self.assertEqual(list(render_iter("", {})), [])
+
+    def test_post_processor_matches_whole_text_passes(self):
+        lines = ["## Title", "  ", "", "[condense] a ,", "", " ( b ) [condense-end] [condense-end]", "```", "# code", "```", "#   Head  ", "x\\ss=\\s<<v>>", "[condense] open"]
+        for highlight in (highlight_config("", ""), highlight_config("<<", ">>"), highlight_config("<\n", ">")):
+            for drop, preset in ((False, "#"), (True, "###")):
+                text = CondenseProcessor.apply_all("\n".join(lines))
+                text = apply_highlight_heuristics(PostFormat.collapse_blank_runs(text), highlight)
+                expected = PostFormat.apply_header_level_preset(PostFormat.drop_first_header_line(text, drop), preset)
+                for split in range(len(lines) + 1):
+                    post = PostProcessor(highlight, drop, preset)
+                    self.assertEqual(post.feed(lines[:split]) + post.feed(lines[split:]) + post.close(), expected, (highlight, drop, split))
+
+    def test_render_to_sinks(self):
+        template = "# T\n[loop:a as=x]\n- [value:x]\n[loop-end]\n\n[loop:a as=x]\n[value:x][loop-end]"
+        data = {"a": list(range(50))}
+        expected = render(template, data, {"headerIndentation": "##"})
+        fp = io.StringIO()
+        stats = render_to(fp, template, data, {"headerIndentation": "##"})
+        self.assertEqual((fp.getvalue(), stats.summary()), (expected["markdown"], expected["stats"]))
+        writes = []
+        render_to(writes.append, template, data, {"headerIndentation": "##"}, buffer_size=0)
+        self.assertEqual(writes, list(render_iter(template, data, {"headerIndentation": "##"})))
+        writes.clear()
+        compile(template).render_to(writes.append, data, buffer_size=10**6)
+        self.assertEqual(writes, [render(template, data)["markdown"]])
+        with self.assertRaises(TypeError):
+            render_to(None, template, data)
+
+    def test_unresolved_tokens_stream_without_a_later_set(self):
+        template = "[set:v=1]\n[value:missing] [get:v]\n" + "[loop:a as=x]\n[value:x] [value:text]\n[loop-end]\n" * 20
+        data = {"a": [1, 2], "text": "[value:x]"}
+        chunks = list(render_iter(template, data))
+        self.assertEqual("".join(chunks), render(template, data)["markdown"])
+        self.assertGreater(len(chunks), 20)
+        self.assertEqual(chunks[0], "[value:missing] 1\n1 1")
+
+    def test_peak_memory_follows_the_largest_block(self):
+        block = "[loop:rows as=r]\n- [value:r.name] [value:r.id]\n[loop-end]\n"
+        template = "\n".join([block] * 40)
+        data = {"rows": [{"id": k, "name": f"name {k}"} for k in range(500)]}
+        sizes = []
+
+        def peak(fn):
+            tracemalloc.start()
+            try:
+                fn()
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        rendered = peak(lambda: render(template, data))
+        streamed = peak(lambda: sizes.extend(len(c) for c in render_iter(template, data)))
+        self.assertEqual(sum(sizes), len(render(template, data)["markdown"]))
+        self.assertGreater(len(sizes), 20)
+        self.assertLess(streamed, rendered / 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
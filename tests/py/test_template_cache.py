@@ -0,0 +1,74 @@
+import unittest
+
+from packages.py.pdl.pdl import PDL, TEMPLATE_CACHE, render
+
+
+class TestTemplateCache(unittest.TestCase):
+    def setUp(self):
+        TEMPLATE_CACHE.clear()
+
+    def tearDown(self):
+        TEMPLATE_CACHE.configure(maxsize=PDL.CACHE_SIZE, max_bytes=PDL.CACHE_BYTES)
+        TEMPLATE_CACHE.clear()
+
+    def test_render_reuses_compiled_template(self):
+        tpl = "Hello [value:name]"
+        self.assertEqual(render(tpl, {"name": "A"})["markdown"], "Hello A")
+        self.assertEqual(render(tpl, {"name": "B"})["markdown"], "Hello B")
+        info = TEMPLATE_CACHE.info()
+        self.assertEqual((info["hits"], info["misses"], info["size"]), (1, 1, 1))
+
+    def test_parse_options_are_part_of_the_key(self):
+        tpl = "{Name} [value:x]"
+        self.assertEqual(render(tpl, {"x": 1}, {"variables": {"Name": "A"}})["markdown"], "A 1")
+        self.assertEqual(render(tpl, {"x": 1}, {"variables": {"Name": "B"}})["markdown"], "B 1")
+        self.assertEqual(render(tpl, {"x": 1}, {"hlBefore": "<", "hlAfter": ">"})["markdown"], "{Name} <1>")
+        self.assertEqual(TEMPLATE_CACHE.info()["misses"], 3)
+
+    def test_variable_keys_keep_their_type(self):
+        tpl = "{1} [value:x]"
+        self.assertEqual(render(tpl, {"x": 1}, {"variables": {1: "a"}})["markdown"], "{1} 1")
+        self.assertEqual(render(tpl, {"x": 1}, {"variables": {"1": "a"}})["markdown"], "a 1")
+        self.assertEqual(render(tpl, {"x": 1}, {"variables": {1: "a"}})["markdown"], "{1} 1")
+
+    def test_unused_variables_share_an_entry(self):
+        tpl = "{Name} [value:x]"
+        for k in range(5):
+            self.assertEqual(render(tpl, {"x": k}, {"variables": {"Name": "A", "other": k}})["markdown"], f"A {k}")
+        info = TEMPLATE_CACHE.info()
+        self.assertEqual((info["hits"], info["misses"]), (4, 1))
+
+    def test_render_options_do_not_leak_between_calls(self):
+        tpl = "# Title\n\nBody"
+        self.assertEqual(render(tpl, {}, {"dropFirstHeader": True})["markdown"], "Body")
+        self.assertEqual(render(tpl, {})["markdown"], "# Title\n\nBody")
+
+    def test_evicts_least_recently_used(self):
+        TEMPLATE_CACHE.configure(maxsize=2)
+        render("a", {})
+        render("b", {})
+        render("a", {})
+        render("c", {})
+        info = TEMPLATE_CACHE.info()
+        self.assertEqual((info["size"], info["evictions"]), (2, 1))
+        render("a", {})
+        self.assertEqual(TEMPLATE_CACHE.info()["hits"], 2)
+
+    def test_byte_budget(self):
+        TEMPLATE_CACHE.configure(max_bytes=10)
+        render("x" * 20, {})
+        render("first", {})
+        render("second", {})
+        info = TEMPLATE_CACHE.info()
+        self.assertEqual(info["size"], 1)
+        self.assertLessEqual(info["bytes"], 10)
+
+    def test_clear(self):
+        render("a", {})
+        TEMPLATE_CACHE.clear()
+        self.assertEqual(TEMPLATE_CACHE.info()["size"], 0)
+        self.assertEqual(TEMPLATE_CACHE.info()["misses"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()